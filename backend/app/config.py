@@ -8,6 +8,125 @@ class Settings:
     UPLOAD_DIR = "temp_uploads"
     ALLOWED_EXTENSIONS = {".csv", ".xlsx", ".json"}
 
+    # LLM provider: "gemini" (default) or "fake" for offline benchmarking
+    LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+    FAKE_LLM_TRACES = os.getenv("FAKE_LLM_TRACES", "")
+    FAKE_LLM_TOKEN_LATENCY_MS = float(os.getenv("FAKE_LLM_TOKEN_LATENCY_MS", "20"))
+    FAKE_LLM_FIRST_TOKEN_MS = float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "300"))
+
+    # LLM gateway: global concurrency cap, per-session fairness and quota (0 RPM = unlimited)
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    LLM_MAX_INFLIGHT_PER_SESSION = int(os.getenv("LLM_MAX_INFLIGHT_PER_SESSION", "2"))
+    LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "1000"))
+    LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "20"))
+
+    # Sandbox worker pool for agent-generated pandas code
+    SANDBOX_ENABLED = os.getenv("SANDBOX_ENABLED", "true").lower() == "true"
+    SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", str(os.cpu_count() or 2)))
+    SANDBOX_CPU_SECONDS = float(os.getenv("SANDBOX_CPU_SECONDS", "20"))
+    SANDBOX_WALL_SECONDS = float(os.getenv("SANDBOX_WALL_SECONDS", "30"))
+    SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))
+
+    # RAG document ingestion
+    RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", str(os.cpu_count() or 2)))
+    RAG_PAGES_PER_TASK = int(os.getenv("RAG_PAGES_PER_TASK", "16"))
+    RAG_EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "64"))
+    RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "1000"))
+    RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "100"))
+    # Open Chroma collection handles kept per process (LRU)
+    RAG_MAX_OPEN_COLLECTIONS = int(os.getenv("RAG_MAX_OPEN_COLLECTIONS", "32"))
+    # Vector store: "chroma" or "quantized" (memory-mapped int8/float16 NumPy index)
+    RAG_VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+    RAG_QUANT_DTYPE = os.getenv("RAG_QUANT_DTYPE", "int8")
+    RAG_QUANT_RERANK = os.getenv("RAG_QUANT_RERANK", "true").lower() == "true"
+    # Retrieval: chunks passed to the LLM, and BM25 + vector fusion
+    RAG_TOP_K = int(os.getenv("RAG_TOP_K", "3"))
+    RAG_HYBRID_SEARCH = os.getenv("RAG_HYBRID_SEARCH", "true").lower() == "true"
+    # Prompt context: token budget (~4 chars/token) and cosine threshold for near-duplicates
+    RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1000"))
+    RAG_DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.95"))
+    # Packed retrieval results kept per (session, knowledge base version, query)
+    RAG_RETRIEVAL_CACHE_SIZE = int(os.getenv("RAG_RETRIEVAL_CACHE_SIZE", "256"))
+
+    # Embedding cache: chunk vectors on disk, query vectors in an in-memory LRU
+    EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embedding_cache/embeddings.db")
+    EMBED_QUERY_CACHE_SIZE = int(os.getenv("EMBED_QUERY_CACHE_SIZE", "1024"))
+
+    # PDF reports: rendering pool size and in-memory cache of finished reports
+    REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+    REPORT_CACHE_MB = int(os.getenv("REPORT_CACHE_MB", "64"))
+    # Executive report: threads computing sections, processes rasterizing pinned charts
+    REPORT_SECTION_WORKERS = int(os.getenv("REPORT_SECTION_WORKERS", "4"))
+    REPORT_CHART_WORKERS = int(os.getenv("REPORT_CHART_WORKERS", "2"))
+    # Pinned chart images: "matplotlib" (no browser needed) or "kaleido" (exact Plotly look, needs Chrome)
+    REPORT_CHART_RENDERER = os.getenv("REPORT_CHART_RENDERER", "matplotlib")
+
+    # Dashboard: pins per listing page and in-memory cache of chart payloads
+    DASHBOARD_PAGE_SIZE = int(os.getenv("DASHBOARD_PAGE_SIZE", "12"))
+    DASHBOARD_MAX_PAGE_SIZE = int(os.getenv("DASHBOARD_MAX_PAGE_SIZE", "100"))
+    DASHBOARD_CACHE_MB = int(os.getenv("DASHBOARD_CACHE_MB", "32"))
+    # Live pins: parallel refresh, datasets kept in memory, how long and how many SQL results are reused
+    DASHBOARD_REFRESH_WORKERS = int(os.getenv("DASHBOARD_REFRESH_WORKERS", "4"))
+    DASHBOARD_FRAME_CACHE = int(os.getenv("DASHBOARD_FRAME_CACHE", "4"))
+    DASHBOARD_QUERY_TTL_SECONDS = float(os.getenv("DASHBOARD_QUERY_TTL_SECONDS", "60"))
+    DASHBOARD_QUERY_CACHE = int(os.getenv("DASHBOARD_QUERY_CACHE", "16"))
+
+    # Shared session state (see app/services/state_store.py): "sqlite" or "redis"
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+    STATE_DIR = os.getenv("STATE_DIR", "./state")
+    STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+    STATE_REDIS_PREFIX = os.getenv("STATE_REDIS_PREFIX", "ea")
+    STATE_CHAT_HISTORY_MAX = int(os.getenv("STATE_CHAT_HISTORY_MAX", "50"))
+    # Key for secrets kept in the state store (database connection strings); empty = such
+    # secrets stay in the worker that received them and other workers ask to reconnect
+    STATE_SECRET_KEY = os.getenv("STATE_SECRET_KEY", "")
+    # App database (pins, document registry); point every worker at the same server for multi-node
+    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+    # Chroma server for multi-node RAG ("host:port"); empty = embedded client on ./chroma_db
+    RAG_CHROMA_URL = os.getenv("RAG_CHROMA_URL", "")
+
+    # Disk janitor: per-artifact TTLs (hours), total quota for local artifacts (0 = none),
+    # how long after its last access a session counts as in use, and the sweep interval
+    JANITOR_ENABLED = os.getenv("JANITOR_ENABLED", "true").lower() == "true"
+    JANITOR_INTERVAL_SECONDS = float(os.getenv("JANITOR_INTERVAL_SECONDS", "900"))
+    JANITOR_UPLOAD_TTL_HOURS = float(os.getenv("JANITOR_UPLOAD_TTL_HOURS", "72"))
+    JANITOR_EXPORT_TTL_HOURS = float(os.getenv("JANITOR_EXPORT_TTL_HOURS", "6"))
+    JANITOR_DOCUMENT_TTL_HOURS = float(os.getenv("JANITOR_DOCUMENT_TTL_HOURS", "24"))
+    JANITOR_VECTOR_TTL_HOURS = float(os.getenv("JANITOR_VECTOR_TTL_HOURS", "168"))
+    JANITOR_DISK_QUOTA_GB = float(os.getenv("JANITOR_DISK_QUOTA_GB", "20"))
+    JANITOR_IN_USE_MINUTES = float(os.getenv("JANITOR_IN_USE_MINUTES", "30"))
+
+    # Startup: load lazily imported libraries and models in the background after start;
+    # /health/ready stays 503 until that is done unless it should not block readiness
+    STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+    STARTUP_WARMUP_BLOCKS_READINESS = os.getenv("STARTUP_WARMUP_BLOCKS_READINESS", "true").lower() == "true"
+
+    # Admin-only endpoints and headers (X-Admin-Token); empty disables them
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+    # Request profiling (X-Profile: 1 plus the admin token): sample interval, cap, profiles kept
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+    PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+
+    # Compression of large JSON responses on the data routers (brotli if installed, else gzip)
+    RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "2048"))
+    RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+    RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
+    # Embedded SQL engine (DuckDB) over uploaded datasets: charts, insights, report stats
+    # and the CSV agent's sql_query tool. Threads/memory are per query; 0 threads = all cores
+    SQL_ENGINE_ENABLED = os.getenv("SQL_ENGINE_ENABLED", "true").lower() == "true"
+    SQL_ENGINE_THREADS = int(os.getenv("SQL_ENGINE_THREADS", "0"))
+    SQL_ENGINE_MEMORY_MB = int(os.getenv("SQL_ENGINE_MEMORY_MB", "1024"))
+    SQL_ENGINE_TIMEOUT_SECONDS = float(os.getenv("SQL_ENGINE_TIMEOUT_SECONDS", "30"))
+    SQL_AGENT_MAX_ROWS = int(os.getenv("SQL_AGENT_MAX_ROWS", "50"))
+
+    # Time-series rollups (minute..month) for date columns, built after upload; points per
+    # series when the client does not say how wide the chart is, and the most it may ask for
+    TIMESERIES_ROLLUPS = os.getenv("TIMESERIES_ROLLUPS", "true").lower() == "true"
+    TIMESERIES_DEFAULT_WIDTH = int(os.getenv("TIMESERIES_DEFAULT_WIDTH", "1200"))
+    TIMESERIES_MAX_WIDTH = int(os.getenv("TIMESERIES_MAX_WIDTH", "8000"))
+
 settings = Settings()
 
 # Ensure upload directory exists
@@ -1,12 +1,26 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Text, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from app.config import settings
 import json
+import zlib
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./app.db"
+SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
 
 # check_same_thread=False is needed only for SQLite
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if IS_SQLITE else {})
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, _):
+    if not IS_SQLITE:
+        return
+    # WAL lets dashboard reads proceed while a pin or ingest is being written
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -18,11 +32,67 @@ class PinnedChart(Base):
     session_id = Column(String, index=True)
     title = Column(String)
     chart_type = Column(String)
-    chart_config = Column(Text) # Stores the Plotly JSON as a string
+    chart_config = Column(Text) # Legacy: uncompressed Plotly JSON (migrated into chart_blob)
+    chart_blob = Column(LargeBinary) # zlib-compressed Plotly JSON
+    size_bytes = Column(Integer) # Uncompressed JSON size
     timestamp = Column(String)
+    # Live pins store the chart spec (source, session, chart params / SQL) instead of the data
+    spec = Column(Text)
+    source_version = Column(String) # Version of the source the chart was last rendered from
+    refreshed_at = Column(String)
+
+def compress_config(config: dict) -> tuple:
+    """Returns (compressed blob, uncompressed size). Plotly data arrays compress ~5-10x."""
+    raw = json.dumps(config, separators=(",", ":")).encode()
+    return zlib.compress(raw, 6), len(raw)
+
+def config_json(pin: PinnedChart) -> bytes:
+    """The pin's chart config as JSON bytes, from either storage format."""
+    if pin.chart_blob is not None:
+        return zlib.decompress(pin.chart_blob)
+    return (pin.chart_config or "{}").encode()
+
+class KnowledgeDocument(Base):
+    __tablename__ = "knowledge_documents"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, index=True)
+    doc_id = Column(String, index=True)
+    filename = Column(String)
+    format = Column(String)
+    size_bytes = Column(Integer)
+    pages = Column(Integer)
+    chunks = Column(Integer)
+    stats = Column(Text) # JSON of the last ingest (added/unchanged/removed chunks, timings)
+    indexed_at = Column(String)
+
+def _migrate_pinned_charts():
+    """Adds newer columns to an existing table and compresses legacy chart configs."""
+    columns = {c["name"] for c in inspect(engine).get_columns("pinned_charts")}
+    added = {"chart_blob": "BLOB", "size_bytes": "INTEGER", "spec": "TEXT", "source_version": "VARCHAR", "refreshed_at": "VARCHAR"}
+    with engine.begin() as conn:
+        for name, sql_type in added.items():
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE pinned_charts ADD COLUMN {name} {sql_type}"))
+        legacy = conn.execute(text(
+            "SELECT id, chart_config FROM pinned_charts WHERE chart_blob IS NULL AND chart_config IS NOT NULL AND spec IS NULL"
+        )).fetchall()
+        for pin_id, config in legacy:
+            try:
+                blob, size = compress_config(json.loads(config))
+            except ValueError:
+                continue
+            conn.execute(text("UPDATE pinned_charts SET chart_blob = :blob, size_bytes = :size, chart_config = NULL WHERE id = :id"),
+                         {"blob": blob, "size": size, "id": pin_id})
+    if legacy and IS_SQLITE:
+        # Give the space held by the old JSON text back to the filesystem
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+        print(f"Compressed {len(legacy)} legacy pinned charts")
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _migrate_pinned_charts()
 
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,107 @@
+"""
+Process lifecycle: how long each startup phase took, background warmup of the
+libraries and models that are loaded lazily, and the liveness/readiness state
+served by /health/*.
+
+Heavy dependencies (langchain agents, sklearn, plotly, chromadb, the FastEmbed ONNX
+model) are imported on first use, so the app starts accepting connections quickly.
+Warmup loads them in a background thread right after startup; until it finishes,
+/health/ready reports 503 (unless STARTUP_WARMUP_BLOCKS_READINESS is off), so a load
+balancer does not route the first requests to a cold worker.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from app.services.telemetry import REGISTRY
+import threading
+import time
+
+STARTUP_PHASE_SECONDS = REGISTRY.gauge("startup_phase_seconds", "Time spent in each startup phase", ["phase"])
+WARMUP_SECONDS = REGISTRY.gauge("startup_warmup_seconds", "Time spent warming up each lazily loaded dependency", ["task"])
+APP_READY = REGISTRY.gauge("app_ready", "1 once the worker is ready to serve traffic")
+
+
+class Startup:
+    def __init__(self):
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.phases = OrderedDict()  # phase -> seconds
+        self.warmup = OrderedDict()  # task -> {"status", "seconds", "error"}
+        self.serving_after = None    # seconds from import to the end of lifespan startup
+        self.ready_after = None      # seconds from import to ready
+        self.blocks_readiness = True
+        self._serving = False
+        self._warmup_done = threading.Event()
+        self._warmup_done.set()
+        self._lock = threading.Lock()
+
+    def _elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = round(seconds, 4)
+            STARTUP_PHASE_SECONDS.set(seconds, phase=name)
+
+    def warm(self, tasks: dict, blocks_readiness: bool = True):
+        """Runs tasks (name -> callable) one after another on a background thread."""
+        self.blocks_readiness = blocks_readiness
+        self._warmup_done.clear()
+        for name in tasks:
+            self.warmup[name] = {"status": "pending"}
+
+        def run():
+            for name, fn in tasks.items():
+                self.warmup[name] = {"status": "running"}
+                start = time.perf_counter()
+                try:
+                    fn()
+                    self.warmup[name] = {"status": "done"}
+                except Exception as e:
+                    # Not fatal: the dependency is loaded again on first use
+                    print(f"Warmup '{name}' failed: {e}")
+                    self.warmup[name] = {"status": "failed", "error": str(e)}
+                seconds = time.perf_counter() - start
+                self.warmup[name]["seconds"] = round(seconds, 4)
+                WARMUP_SECONDS.set(seconds, task=name)
+            self._warmup_done.set()
+            self._update_ready()
+            print(f"Warmup finished in {sum(t['seconds'] for t in self.warmup.values()):.2f}s")
+
+        threading.Thread(target=run, name="warmup", daemon=True).start()
+
+    def mark_serving(self):
+        """End of lifespan startup: the worker accepts connections from here on."""
+        self._serving = True
+        self.serving_after = round(self._elapsed(), 4)
+        self._update_ready()
+
+    def _update_ready(self):
+        with self._lock:
+            if self.ready_after is None and self.ready:
+                self.ready_after = round(self._elapsed(), 4)
+                APP_READY.set(1)
+
+    @property
+    def warmed_up(self) -> bool:
+        return self._warmup_done.is_set()
+
+    @property
+    def ready(self) -> bool:
+        return self._serving and (self.warmed_up or not self.blocks_readiness)
+
+    def report(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "serving_after_seconds": self.serving_after,
+            "ready_after_seconds": self.ready_after,
+            "phases": dict(self.phases),
+            "warmup": dict(self.warmup),
+        }
+
+
+startup = Startup()
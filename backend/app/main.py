@@ -1,12 +1,52 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from app.routers import data_routes, analytics_routes, chat_routes
-from app.database import init_db
+from app.lifecycle import startup  # first, so the imports below are timed
 
-app = FastAPI(title="Enterprise Data Analytics API")
+with startup.phase("import:fastapi"):
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI
+    from fastapi.middleware.cors import CORSMiddleware
+with startup.phase("import:app.database"):
+    from app.config import settings
+    from app.database import init_db
+# Services in dependency order, so each phase is roughly that module's own cost
+with startup.phase("import:app.services.data_handler"):
+    from app.services.data_handler import data_handler
+with startup.phase("import:app.services.analysis"):
+    from app.services.analysis import analysis_service
+    from app.services.sql_engine import sql_engine
+with startup.phase("import:app.services.rag_service"):
+    from app.services.rag_service import rag_service
+with startup.phase("import:app.services.ai_engine"):
+    from app.services.ai_engine import ai_engine
+with startup.phase("import:app.services.reports"):
+    from app.services import report_service, report_builder, dashboard_service
+with startup.phase("import:app.services.janitor"):
+    from app.services.janitor import janitor
+with startup.phase("import:app.routers"):
+    from app.routers import data_routes, analytics_routes, chat_routes, metrics_routes, health_routes
+    from app.middleware import TraceMiddleware
+    from app.utils import FastJSONResponse
 
-# Initialize SQLite DB
-init_db()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with startup.phase("init_db"):
+        init_db()
+    if settings.JANITOR_ENABLED:
+        janitor.start()
+    if settings.STARTUP_WARMUP:
+        startup.warm({
+            "analysis": analysis_service.warmup,
+            "sql_engine": sql_engine.warmup,
+            "agents": ai_engine.warmup,
+            "embeddings": rag_service.warmup,
+        }, blocks_readiness=settings.STARTUP_WARMUP_BLOCKS_READINESS)
+    startup.mark_serving()
+    print(f"Startup: serving after {startup.serving_after:.2f}s (breakdown at /health/startup)")
+    yield
+    janitor.stop()
+
+
+app = FastAPI(title="Enterprise Data Analytics API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 origins = [
     "http://localhost:5173",
@@ -19,11 +59,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "Server-Timing", "X-Profile-Id"],
 )
+app.add_middleware(TraceMiddleware)
 
 app.include_router(data_routes.router, prefix="/api/data", tags=["Data"])
 app.include_router(analytics_routes.router, prefix="/api/analytics", tags=["Analytics"])
 app.include_router(chat_routes.router, prefix="/api/chat", tags=["AI Chat"])
+app.include_router(metrics_routes.router, tags=["Observability"])
+app.include_router(health_routes.router, tags=["Health"])
 
 @app.get("/")
 def root():
@@ -31,4 +75,4 @@ def root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
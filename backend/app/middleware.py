@@ -0,0 +1,103 @@
+from app.services.telemetry import start_trace, finish_trace, HTTP_REQUEST_SECONDS
+from app.services.profiler import profiler
+from app.security import is_admin_token, ADMIN_HEADER
+import json
+import re
+import time
+
+TRACE_HEADER = "x-trace-id"
+PROFILE_HEADER = "x-profile"
+_VALID_TRACE_ID = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+_METRIC_NAME = re.compile(r"[^A-Za-z0-9_\-]")
+
+
+def server_timing(trace, total: float) -> str:
+    """
+    Server-Timing header value: time per stage so far (stages that run more than once
+    are summed) plus the total. For streamed responses the headers go out before the
+    body is produced, so only what ran up to then is included; the log line has it all.
+    """
+    totals = {}
+    for span in trace.summary()["spans"]:
+        # Stages by their own name; LLM calls, tools etc. by kind (their names are model/tool ids)
+        name = span["name"] if span["kind"] in ("stage", "retrieval") else span["kind"]
+        name = _METRIC_NAME.sub("_", name)
+        totals[name] = totals.get(name, 0) + span["duration_ms"]
+    parts = [f"{name};dur={ms:.1f}" for name, ms in totals.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class TraceMiddleware:
+    """
+    Pure ASGI middleware (keeps StreamingResponse streaming) that opens a RequestTrace
+    per HTTP request, honours an incoming X-Trace-Id header and echoes it back, adds
+    a Server-Timing header and logs one JSON line per traced request.
+
+    With `X-Profile: 1` and a valid X-Admin-Token, the request is also run under the
+    sampling profiler; the response carries X-Profile-Id, and the flamegraph is at
+    GET /metrics/profiles/{id}.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        incoming = headers.get(TRACE_HEADER.encode(), b"").decode("latin-1")
+        trace = start_trace(incoming if _VALID_TRACE_ID.match(incoming) else None)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        profiling = False
+        if headers.get(PROFILE_HEADER.encode()) == b"1" and \
+                is_admin_token(headers.get(ADMIN_HEADER.encode(), b"").decode("latin-1")):
+            profiling = profiler.start(trace.trace_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                extra = [
+                    (TRACE_HEADER.encode(), trace.trace_id.encode()),
+                    (b"server-timing", server_timing(trace, time.perf_counter() - start).encode()),
+                ]
+                if profiling:
+                    extra.append((b"x-profile-id", trace.trace_id.encode()))
+                message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            route = scope.get("route")
+            # Use the route template, not the raw path, to keep label cardinality bounded
+            route_path = getattr(route, "path", "unmatched")
+            if profiling:
+                profiler.stop(label=f"{scope['method']} {route_path}")
+            HTTP_REQUEST_SECONDS.observe(duration, method=scope["method"], route=route_path, status=status["code"])
+            finish_trace(trace)
+
+            summary = trace.summary()
+            if summary["spans"] or profiling:
+                stages = {}
+                for span in summary["spans"]:
+                    key = f"{span['kind']}:{span['name']}"
+                    stages[key] = round(stages.get(key, 0) + span["duration_ms"], 2)
+                print(json.dumps({
+                    "event": "request",
+                    "trace_id": trace.trace_id,
+                    "method": scope["method"],
+                    "route": route_path,
+                    "status": status["code"],
+                    "duration_ms": round(duration * 1000, 2),
+                    "stages_ms": stages,
+                    "totals_ms": summary["totals_ms"],
+                    "prompt_tokens": summary["prompt_tokens"],
+                    "completion_tokens": summary["completion_tokens"],
+                    "retries": summary["retries"],
+                    "profiled": profiling,
+                }))
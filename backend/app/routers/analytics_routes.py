@@ -1,19 +1,29 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request
+from fastapi.responses import StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from app.services.data_handler import data_handler
 from app.services.analysis import analysis_service
+from app.services.sql_engine import sql_engine
+from app.services.timeseries import timeseries, AGGREGATES
 from app.services.ai_engine import ai_engine
 from app.services.report_service import report_service
-from app.services.rag_service import rag_service
+from app.services.report_builder import report_builder
+from app.services.dashboard_service import dashboard_service
+from app.services.rag_service import rag_service, collection_name, DOCS_DIR
+from app.services.ingestion import SUPPORTED_EXTENSIONS
+from app.services.streaming import StreamEvent, wants_sse, sse_response_body, SSE_HEADERS
 from app.schemas import VizRequest, ModelRequest, ChatRequest
-from app.database import get_db, PinnedChart
+from app.database import get_db
+from app.utils import FastJSONResponse, CompressedJSONRoute
 from pydantic import BaseModel
+from typing import Optional
+import hashlib
 import json
 import os
-from datetime import datetime
 
-router = APIRouter()
+# Chart and dashboard payloads are large: orjson encoding plus gzip/brotli (see app/utils.py)
+router = APIRouter(route_class=CompressedJSONRoute, default_response_class=FastJSONResponse)
 
 # --- Schemas ---
 class DriverRequest(BaseModel):
@@ -28,7 +38,8 @@ class PinChartRequest(BaseModel):
     session_id: str
     title: str
     chart_type: str
-    chart_config: dict
+    chart_config: Optional[dict] = None
+    spec: Optional[dict] = None # Live pin: chart spec instead of rendered data
 
 class RAGQueryRequest(BaseModel):
     session_id: str
@@ -48,8 +59,14 @@ async def connect_database(req: SQLConnectRequest):
     return {"status": "connected"}
 
 @router.post("/sql/query")
-async def query_database(req: RAGQueryRequest): 
-    response = ai_engine.analyze_sql(req.query, req.session_id)
+async def query_database(req: RAGQueryRequest, request: Request): 
+    if wants_sse(request):
+        return StreamingResponse(
+            sse_response_body(ai_engine.analyze_sql_events(req.query, req.session_id)),
+            media_type="text/event-stream", headers=SSE_HEADERS
+        )
+    # LLM calls block; keep them off the event loop so concurrent requests can queue in the gateway
+    response = await run_in_threadpool(ai_engine.analyze_sql, req.query, req.session_id)
     return {"role": "assistant", "content": response}
 
 @router.get("/sql/tables/{session_id}")
@@ -65,73 +82,159 @@ async def get_sql_columns(session_id: str, table_name: str):
     return result
 
 @router.post("/rag/upload")
-async def upload_document(session_id: str, file: UploadFile = File(...)):
+async def upload_document(session_id: str, file: UploadFile = File(...), doc_id: str = None):
+    """Adds a document to the session's knowledge base; an existing doc_id (default: file name) is replaced."""
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported document type '{ext}'")
+
     try:
-        os.makedirs("temp_docs", exist_ok=True)
-        file_path = f"temp_docs/{file.filename}"
+        # One directory per session: same-named files from different sessions no longer
+        # overwrite each other, and the janitor can collect them with the session
+        doc_dir = os.path.join(DOCS_DIR, collection_name(session_id))
+        os.makedirs(doc_dir, exist_ok=True)
+        file_path = os.path.join(doc_dir, os.path.basename(file.filename))
         with open(file_path, "wb") as f:
             f.write(file.file.read())
+
+        # Parsing and embedding are CPU-bound; keep them off the event loop
+        stats = await run_in_threadpool(rag_service.process_file, file_path, session_id, doc_id)
         
-        num_chunks = rag_service.process_file(file_path, session_id)
-        
-        return {"status": "indexed", "chunks": num_chunks}
+        return {"status": "indexed", "doc_id": stats["doc_id"], "chunks": stats["chunks"], "stats": stats}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/rag/documents/{session_id}")
+async def list_documents(session_id: str):
+    return {"documents": await run_in_threadpool(rag_service.list_documents, session_id)}
+
+@router.delete("/rag/documents/{session_id}/{doc_id}")
+async def remove_document(session_id: str, doc_id: str):
+    removed = await run_in_threadpool(rag_service.remove_document, session_id, doc_id)
+    if removed is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"status": "removed", "doc_id": doc_id, "chunks_removed": removed}
+
+def _rag_events(query: str, session_id: str):
+    yield StreamEvent("step_started", {"step": 1})
+    yield StreamEvent("tool_running", {"tool": "retrieval", "input": query})
+    context = rag_service.query_document(query, session_id)
+    yield StreamEvent("tool_finished", {"tool": "retrieval"})
+    if not context:
+        yield StreamEvent("token", "I couldn't find relevant information in the document.")
+        return
+    yield StreamEvent("step_started", {"step": 2})
+    yield from ai_engine.analyze_document_stream(context, query, session_id, events=True)
+
 @router.post("/rag/query")
-async def query_document(req: RAGQueryRequest):
-    context = rag_service.query_document(req.query, req.session_id)
+async def query_document(req: RAGQueryRequest, request: Request):
+    """
+    Streams the answer as plain text like /chat/query (SSE with `Accept: text/event-stream`).
+    Clients that send `Accept: application/json` get the full answer as one JSON message.
+    """
+    if wants_sse(request):
+        return StreamingResponse(
+            sse_response_body(_rag_events(req.query, req.session_id)),
+            media_type="text/event-stream", headers=SSE_HEADERS
+        )
+    context = await run_in_threadpool(rag_service.query_document, req.query, req.session_id)
+    wants_json = "application/json" in request.headers.get("accept", "")
     if not context:
-        return {"role": "assistant", "content": "I couldn't find relevant information in the document."}
-    
-    response = ai_engine.analyze_document(context, req.query)
-    return {"role": "assistant", "content": response}
+        message = "I couldn't find relevant information in the document."
+        if wants_json:
+            return {"role": "assistant", "content": message}
+        return StreamingResponse(iter([message]), media_type="text/plain")
+
+    if wants_json:
+        response = await run_in_threadpool(ai_engine.analyze_document, context, req.query, req.session_id)
+        return {"role": "assistant", "content": response}
+    return StreamingResponse(
+        ai_engine.analyze_document_stream(context, req.query, req.session_id),
+        media_type="text/plain"
+    )
 
 @router.post("/dashboard/pin")
 async def pin_item(req: PinChartRequest, db: Session = Depends(get_db)):
-    new_pin = PinnedChart(
-        session_id=req.session_id,
-        title=req.title,
-        chart_type=req.chart_type,
-        chart_config=json.dumps(req.chart_config),
-        timestamp=datetime.now().isoformat()
-    )
-    db.add(new_pin)
-    db.commit()
-    return {"status": "pinned", "id": new_pin.id}
+    if req.chart_config is None and req.spec is None:
+        raise HTTPException(status_code=400, detail="Either chart_config or spec is required.")
+    try:
+        new_pin = await run_in_threadpool(
+            dashboard_service.pin, db, req.session_id, req.title, req.chart_type, req.chart_config, req.spec
+        )
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "pinned", "id": new_pin.id, "live": req.spec is not None}
+
+@router.post("/dashboard/{session_id}/refresh")
+async def refresh_dashboard(session_id: str, force: bool = False, db: Session = Depends(get_db)):
+    """Re-renders live pins whose source changed; returns refreshed/unchanged/failed pin ids."""
+    return await run_in_threadpool(dashboard_service.refresh, db, session_id, force)
 
 @router.get("/dashboard/{session_id}")
-async def get_pinned_items(session_id: str, db: Session = Depends(get_db)):
-    charts = db.query(PinnedChart).filter(PinnedChart.session_id == session_id).all()
-    return [
-        {
-            "id": c.id,
-            "title": c.title,
-            "chart_type": c.chart_type,
-            "chart_config": json.loads(c.chart_config),
-            "timestamp": c.timestamp
-        }
-        for c in charts
-    ]
+async def get_pinned_items(session_id: str, offset: int = 0, limit: int = None, db: Session = Depends(get_db)):
+    """One page of pin metadata. Chart payloads are fetched per pin from /dashboard/{session_id}/pin/{pin_id}."""
+    return await run_in_threadpool(dashboard_service.list_pins, db, session_id, max(offset, 0), limit)
+
+@router.get("/dashboard/{session_id}/pin/{pin_id}")
+async def get_pin_payload(session_id: str, pin_id: int, request: Request, db: Session = Depends(get_db)):
+    try:
+        # Scoped to the session: pin ids are sequential, session ids are not guessable
+        result = await run_in_threadpool(dashboard_service.payload, db, session_id, pin_id)
+    except (ValueError, FileNotFoundError) as e:
+        # Live pin whose source is gone (session expired, database disconnected)
+        raise HTTPException(status_code=409, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Pin not found.")
+    data, tag = result
+    # Browsers revalidate with the ETag, so an unchanged chart costs a 304 and no body
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    # Compressed responses carry the weak form of the tag (W/"...")
+    if request.headers.get("if-none-match", "").removeprefix("W/") == tag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="application/json", headers=headers)
 
 @router.delete("/dashboard/{pin_id}")
 async def delete_pin(pin_id: int, db: Session = Depends(get_db)):
-    db.query(PinnedChart).filter(PinnedChart.id == pin_id).delete()
-    db.commit()
+    dashboard_service.delete(db, pin_id)
     return {"status": "deleted"}
 
 # 4. Reporting (Multi-Source FIX)
+def _pdf_response(data: bytes, download_name: str) -> StreamingResponse:
+    """Streams in-memory PDF bytes; nothing is written to disk."""
+    def chunks(size=64 * 1024):
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+    return StreamingResponse(
+        chunks(), media_type='application/pdf',
+        headers={
+            "Content-Disposition": f'attachment; filename="{download_name}"',
+            "Content-Length": str(len(data)),
+        }
+    )
+
+def _render_csv_report(session_id: str, filename: str, pins: list) -> bytes:
+    df = data_handler.load_dataset(session_id)
+    # Overview, summary statistics and correlations come from the SQL engine when it has the dataset
+    profile = sql_engine.profile(session_id) if sql_engine.table(session_id) is not None else None
+    data, _ = report_builder.build(df, filename, pins, profile)
+    return data
+
 @router.get("/report/{data_type}/{session_id}")
-async def download_report_multi_source(data_type: str, session_id: str):
+async def download_report_multi_source(data_type: str, session_id: str, db: Session = Depends(get_db)):
     """Generates the full data report based on data_type (CSV, SQL, RAG)."""
     filename = f"{data_type}_report_{session_id[:8]}"
     
     if data_type == 'CSV':
         try:
-            # CSV: Requires DataFrame loaded via data_handler
-            df = data_handler.load_dataset(session_id)
-            path = report_service.generate_pdf(df, filename)
-            return FileResponse(path, media_type='application/pdf', filename=f"Executive_Report_{data_type}.pdf")
+            # Cached per dataset version and set of pins, so re-downloads skip loading and rendering
+            # Both can hit disk, load datasets or run pin SQL, so they stay off the event loop
+            version = await run_in_threadpool(data_handler.dataset_version, session_id)
+            pins = await run_in_threadpool(dashboard_service.load_pins, db, session_id)
+            pins_key = hashlib.sha1(json.dumps([(p["id"], p["version"]) for p in pins]).encode()).hexdigest()
+            data = await report_service.render(
+                ("CSV", session_id, version, pins_key), "csv", _render_csv_report, session_id, filename, pins
+            )
+            return _pdf_response(data, f"Executive_Report_{data_type}.pdf")
         except FileNotFoundError:
             raise HTTPException(status_code=404, detail="CSV dataset not found.")
         except Exception as e:
@@ -142,12 +245,13 @@ async def download_report_multi_source(data_type: str, session_id: str):
         # SQL/RAG: Uses AI to generate a text summary, which we then PDF.
         try:
             # AI Engine generates a descriptive text summary based on the schema/index
-            summary_text = ai_engine.generate_text_summary(session_id, data_type)
+            summary_text = await run_in_threadpool(ai_engine.generate_text_summary, session_id, data_type)
             
-            # Use the new generic text report creator
-            path = report_service.generate_text_report(summary_text, filename)
+            # The summary reflects the current schema/index, so it doubles as the version
+            key = (data_type, session_id, hashlib.sha1(summary_text.encode()).hexdigest())
+            data = await report_service.render(key, "text", report_service.generate_text_report, summary_text, filename)
             
-            return FileResponse(path, media_type='application/pdf', filename=f"AI_Summary_{data_type}.pdf")
+            return _pdf_response(data, f"AI_Summary_{data_type}.pdf")
 
         except Exception as e:
             print(f"AI Report Generation Error ({data_type}): {e}")
@@ -159,25 +263,25 @@ async def download_report_multi_source(data_type: str, session_id: str):
 @router.post("/report/chat")
 async def download_chat_report(req: ChatExportRequest):
     try:
-        path = report_service.generate_chat_pdf(req.messages, req.session_id)
-        return FileResponse(
-            path, 
-            media_type='application/pdf', 
-            filename="Selected_Insights.pdf"
-        )
+        key = ("chat", hashlib.sha1(json.dumps(req.messages, sort_keys=True, default=str).encode()).hexdigest())
+        data = await report_service.render(key, "chat", report_service.generate_chat_pdf, req.messages, req.session_id)
+        return _pdf_response(data, "Selected_Insights.pdf")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/insights/{session_id}")
 async def get_auto_insights(session_id: str):
-    df = data_handler.load_dataset(session_id)
-    return {"insights": analysis_service.get_auto_insights(df)}
+    def insights():
+        if sql_engine.table(session_id) is not None:
+            return analysis_service.insights_from_profile(sql_engine.profile(session_id))
+        return analysis_service.get_auto_insights(data_handler.load_dataset(session_id))
+    return {"insights": await run_in_threadpool(insights)}
 
 @router.get("/suggestions/{session_id}")
 async def get_chat_suggestions(session_id: str):
     try:
         df = data_handler.load_dataset(session_id)
-        suggestions = ai_engine.get_suggestions(df)
+        suggestions = await run_in_threadpool(ai_engine.get_suggestions, df, session_id)
         return {"suggestions": suggestions}
     except:
         return {"suggestions": []}
@@ -185,15 +289,37 @@ async def get_chat_suggestions(session_id: str):
 @router.post("/visualize")
 async def generate_visualization(request: VizRequest):
     try:
-        df = data_handler.load_dataset(request.session_id)
-        chart_json = analysis_service.generate_chart_json(
-            df, request.chart_type, request.x_axis, request.y_axis, request.color_by, request.size_by
-        )
+        args = (request.chart_type, request.x_axis, request.y_axis, request.color_by, request.size_by)
+        if await run_in_threadpool(sql_engine.table, request.session_id) is not None:
+            # Aggregations run in the SQL engine; the dataset is never loaded into pandas
+            chart_json = await run_in_threadpool(analysis_service.generate_pushdown_chart, request.session_id, *args)
+        else:
+            df = data_handler.load_dataset(request.session_id)
+            chart_json = analysis_service.generate_chart_json(df, *args)
         if not chart_json: raise HTTPException(status_code=400)
-        return chart_json
+        return FastJSONResponse(chart_json)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/timeseries/{session_id}")
+async def get_timeseries(session_id: str, date: str, value: str, start: str = None, end: str = None,
+                         width: int = None, agg: str = "mean", figure: bool = False):
+    """
+    `value` over `date` between start and end at the finest resolution that fits `width`
+    points (the chart's pixel width). figure=true returns a Plotly figure like /visualize.
+    """
+    if agg not in AGGREGATES:
+        raise HTTPException(status_code=400, detail=f"agg must be one of {list(AGGREGATES)}")
+    try:
+        series = await run_in_threadpool(timeseries.series, session_id, date, value, start, end, width)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if figure:
+        return FastJSONResponse(await run_in_threadpool(analysis_service.timeseries_chart, series, agg))
+    return FastJSONResponse(series)
+
 @router.post("/model")
 async def run_model(request: ModelRequest):
     try:
@@ -1,13 +1,15 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.services.data_handler import data_handler
 from app.services.ai_engine import ai_engine
+from app.services.streaming import StreamEvent, wants_sse, sse_response_body, SSE_HEADERS
 from app.schemas import ChatRequest
 
 router = APIRouter()
 
 @router.post("/query")
-async def ask_ai(request: ChatRequest):
+async def ask_ai(request: ChatRequest, http_request: Request):
+    sse = wants_sse(http_request)
     try:
         # 1. Attempt to load the dataset
         # If the session has no file, this will raise an error
@@ -15,10 +17,21 @@ async def ask_ai(request: ChatRequest):
             df = data_handler.load_dataset(request.session_id)
         except Exception:
             # If no data found, return a helpful message stream instead of crashing
+            message = "I cannot find any uploaded data for this session. Please go to 'Data Sources' and upload a CSV file first."
+            if sse:
+                return StreamingResponse(sse_response_body([StreamEvent("error", message)]), media_type="text/event-stream", headers=SSE_HEADERS)
             def error_stream():
-                yield "I cannot find any uploaded data for this session. Please go to 'Data Sources' and upload a CSV file first."
+                yield message
             return StreamingResponse(error_stream(), media_type="text/plain")
         
+        if sse:
+            # Typed progress events; the answer starts flowing as soon as the agent reaches it
+            return StreamingResponse(
+                sse_response_body(ai_engine.analyze_stream(df, request.query, request.session_id, events=True)),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+        
         # 2. If data exists, start the AI stream
         # We use the new analyze_stream method from ai_engine
         return StreamingResponse(
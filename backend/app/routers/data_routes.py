@@ -1,15 +1,17 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from app.services.data_handler import data_handler
 from app.services.analysis import analysis_service
+from app.services.timeseries import timeseries
 from app.schemas import DatasetMeta, ColumnInfo
+from app.utils import FastJSONResponse, CompressedJSONRoute
 import pandas as pd
 import numpy as np
 
-router = APIRouter()
+router = APIRouter(route_class=CompressedJSONRoute, default_response_class=FastJSONResponse)
 
 @router.post("/upload", response_model=DatasetMeta)
 async def upload_file(file: UploadFile = File(...)):
-    if not file.filename.endswith(('.csv', '.xlsx', '.json')):
+    if not file.filename.endswith(('.csv', '.xlsx', '.json', '.parquet')):
         raise HTTPException(status_code=400, detail="Invalid file type")
     
     try:
@@ -17,8 +19,11 @@ async def upload_file(file: UploadFile = File(...)):
         df = data_handler.load_dataset(session_id)
         
         numeric = analysis_service.get_numeric_cols(df)
-        categorical = df.select_dtypes(include=['object']).columns.tolist()
-        date_cols = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+        date_cols = data_handler.date_columns(df)
+        categorical = [col for col in df.select_dtypes(include=['object']).columns if col not in date_cols]
+        data_handler.set_date_columns(session_id, date_cols)
+        # Time-series rollups for the date columns are built in the background
+        timeseries.build_async(session_id)
         
         return DatasetMeta(
             filename=file.filename,
@@ -37,6 +42,6 @@ async def upload_file(file: UploadFile = File(...)):
 async def get_columns(session_id: str):
     try:
         df = data_handler.load_dataset(session_id)
-        return data_handler.get_column_details(df)
+        return FastJSONResponse(data_handler.get_column_details(df))
     except Exception as e:
         raise HTTPException(status_code=404, detail="Session not found")
\ No newline at end of file
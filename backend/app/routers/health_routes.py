@@ -0,0 +1,43 @@
+from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from app.database import engine
+from app.lifecycle import startup
+from app.services.state_store import state
+
+router = APIRouter()
+
+@router.get("/health/live")
+async def liveness():
+    """The process is up and the event loop is responsive. Never checks dependencies."""
+    return {"status": "alive"}
+
+def _check_dependencies() -> dict:
+    checks = {}
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        checks["database"] = "ok"
+    except Exception as e:
+        checks["database"] = f"error: {e}"
+    try:
+        state.get("health", "ping")
+        checks["state"] = "ok"
+    except Exception as e:
+        checks["state"] = f"error: {e}"
+    return checks
+
+@router.get("/health/ready")
+async def readiness():
+    """200 once startup and warmup are done and the database and state store answer; 503 otherwise."""
+    if not startup.ready:
+        return JSONResponse({"status": "starting", "warmup": startup.warmup}, status_code=503)
+    checks = await run_in_threadpool(_check_dependencies)
+    ok = all(v == "ok" for v in checks.values())
+    return JSONResponse({"status": "ready" if ok else "degraded", "checks": checks}, status_code=200 if ok else 503)
+
+@router.get("/health/startup")
+async def startup_report():
+    """Startup time breakdown: module imports, lifespan phases and warmup tasks."""
+    return startup.report()
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import PlainTextResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from app.services.telemetry import REGISTRY, get_trace
+from app.services.janitor import janitor
+from app.services.profiler import profiler
+from app.security import require_admin
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format 0.0.4)."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/metrics/traces/{trace_id}")
+async def get_request_trace(trace_id: str):
+    """Per-step breakdown of a recent request, looked up by its X-Trace-Id."""
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found or expired")
+    return trace.summary()
+
+@router.get("/metrics/janitor")
+async def janitor_status():
+    """Disk footprint per artifact kind and the last janitor sweep."""
+    return janitor.last_report or {"status": "no sweep yet"}
+
+@router.post("/metrics/janitor/run", dependencies=[Depends(require_admin)])
+async def run_janitor():
+    """Runs a janitor sweep now (deletes expired artifacts) and returns its report."""
+    return await run_in_threadpool(janitor.run)
+
+@router.get("/metrics/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Recent request profiles (send `X-Profile: 1` with the admin token to capture one)."""
+    return {"profiles": profiler.list()}
+
+@router.get("/metrics/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, format: str = "svg"):
+    """Flamegraph of a profiled request: svg, or folded stacks for flamegraph.pl/speedscope."""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found or expired")
+    if format == "folded":
+        return Response(profile.folded(), media_type="text/plain",
+                        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'})
+    if format != "svg":
+        raise HTTPException(status_code=400, detail="format must be svg or folded")
+    return Response(profile.svg(), media_type="image/svg+xml",
+                    headers={"Content-Disposition": f'inline; filename="profile-{profile_id}.svg"'})
@@ -0,0 +1,18 @@
+from fastapi import Header, HTTPException
+from app.config import settings
+import hmac
+
+ADMIN_HEADER = "x-admin-token"
+
+
+def is_admin_token(token: str) -> bool:
+    """Constant-time check against ADMIN_TOKEN; always False when no token is configured."""
+    return bool(settings.ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, settings.ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: str = Header(default="")):
+    """Dependency for admin-only routes."""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
@@ -1,24 +1,26 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
-from langchain_community.agent_toolkits import create_sql_agent
-from langchain_community.utilities import SQLDatabase
 from langchain_core.callbacks import BaseCallbackHandler
-try:
-    # Use classic or community memory depending on availability
-    from langchain_classic.memory import ConversationBufferMemory
-except ImportError:
-    from langchain_community.memory import ConversationBufferMemory
-
-from langchain_core.callbacks import BaseCallbackHandler
-from langchain_community.agent_toolkits import create_sql_agent
-from langchain_community.utilities import SQLDatabase
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import messages_from_dict, message_to_dict
 import pandas as pd
 from app.config import settings
+from app.services.llm_provider import get_llm_provider
+from app.services.llm_gateway import llm_gateway
+from app.services.sandbox import sandbox_pool, SandboxedPythonTool
+from app.services.sql_engine import sql_engine, SessionSQLTool
+from app.services.rag_service import rag_service
+from app.services.state_store import state, STATE_REBUILDS
+from app.services.streaming import FinalAnswerScanner, StreamEvent, drain_queue, HEARTBEAT_SECONDS
+from app.services.telemetry import (
+    current_trace, timed, timed_stage, LLM_CALL_SECONDS, LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS,
+    LLM_ERRORS, LLM_RETRIES, AGENT_STEPS, TOOL_SECONDS, TOOL_ERRORS
+)
 import json
 import queue
 import threading
+import time
+import contextvars
 from decimal import Decimal
-import re # <-- ADDED IMPORT FOR REGEX
+import re
 import ast
 from sqlalchemy import inspect
 import os
@@ -38,47 +40,269 @@ class FinalAnswerCallbackHandler(BaseCallbackHandler):
     """
     Handles streaming output from the agent, filtering for the final answer
     and putting tokens into a queue for real-time response.
+
+    With events=True it puts StreamEvents instead of raw tokens, including step and
+    tool progress, so the SSE endpoints can show activity before the final answer.
+    stream_answer=False suppresses answer tokens (e.g. chart JSON sent as one event).
     """
-    def __init__(self, q):
+    def __init__(self, q, events: bool = False, stream_answer: bool = True):
         self.q = q
-        self.buffer = ""
-        self.final_answer_reached = False
+        self.events = events
+        self.stream_answer = stream_answer
+        self.scanner = FinalAnswerScanner()
+        self.steps = 0
+        self.streamed = False
+
+    @property
+    def final_answer_reached(self) -> bool:
+        return self.scanner.found
+
+    def _emit(self, event: str, data):
+        if self.events:
+            self.q.put(StreamEvent(event, data))
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.steps += 1
+        self.scanner.reset()
+        self._emit("step_started", {"step": self.steps})
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.on_llm_start(serialized, messages, **kwargs)
 
     def on_llm_new_token(self, token: str, **kwargs) -> None:
-        if not self.final_answer_reached:
-            self.buffer += token
-            # Detect the start of the final answer
-            if "Final Answer:" in self.buffer:
-                self.final_answer_reached = True
-                clean_token = self.buffer.split("Final Answer:")[-1]
-                if clean_token.strip():
-                    self.q.put(clean_token)
-                self.buffer = "" 
-        else:
-            self.q.put(token)
+        was_reached = self.scanner.found
+        text = self.scanner.feed(token)
+        if not text or not self.stream_answer:
+            return
+        # Skip whitespace-only output right after the marker
+        if not was_reached and not text.strip():
+            return
+        self.streamed = True
+        self.q.put(StreamEvent("token", text) if self.events else text)
 
     def on_tool_start(self, serialized, input_str, **kwargs):
-        pass
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._emit("tool_running", {"tool": name, "input": str(input_str)[:500]})
+
+    def on_tool_end(self, output, **kwargs):
+        self._emit("tool_finished", {"tool": kwargs.get("name") or "tool"})
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Records per-step LLM latency, token usage, tool durations and retries
+    into Prometheus metrics and the current request trace.
+    """
+    def __init__(self, trace=None):
+        self.trace = trace if trace is not None else current_trace()
+        self._runs = {}
+
+    def _model_name(self, serialized, kwargs) -> str:
+        params = kwargs.get("invocation_params") or {}
+        metadata = kwargs.get("metadata") or {}
+        return params.get("model") or metadata.get("ls_model_name") or (serialized or {}).get("name") or "llm"
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = {"start": time.perf_counter(), "model": self._model_name(serialized, kwargs), "first_token": None}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.on_llm_start(serialized, messages, run_id=run_id, **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run and run["first_token"] is None and token:
+            run["first_token"] = time.perf_counter() - run["start"]
+            LLM_FIRST_TOKEN_SECONDS.observe(run["first_token"], model=run["model"])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if not run:
+            return
+        duration = time.perf_counter() - run["start"]
+        prompt_tokens, completion_tokens = self._token_usage(response)
+        LLM_CALL_SECONDS.observe(duration, model=run["model"])
+        LLM_TOKENS.inc(prompt_tokens, model=run["model"], kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, model=run["model"], kind="completion")
+        if self.trace is not None:
+            self.trace.add_span(
+                "llm", run["model"], duration,
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                first_token_ms=round(run["first_token"] * 1000, 2) if run["first_token"] is not None else None
+            )
+
+    def _token_usage(self, response) -> tuple:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for gen in generations:
+                meta = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += meta.get("input_tokens", 0)
+                completion_tokens += meta.get("output_tokens", 0)
+        return prompt_tokens, completion_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        LLM_ERRORS.inc(model=run["model"] if run else "llm")
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        AGENT_STEPS.inc(tool=action.tool)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._runs[run_id] = {"start": time.perf_counter(), "tool": name}
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if not run:
+            return
+        duration = time.perf_counter() - run["start"]
+        TOOL_SECONDS.observe(duration, tool=run["tool"])
+        if self.trace is not None:
+            self.trace.add_span("tool", run["tool"], duration)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run:
+            TOOL_ERRORS.inc(tool=run["tool"])
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        LLM_RETRIES.inc()
+        if self.trace is not None:
+            self.trace.retries += 1
+
+class SharedChatHistory(BaseChatMessageHistory):
+    """Chat memory kept in the shared state store, so every worker sees the whole conversation."""
+
+    def __init__(self, session_id: str, max_messages: int):
+        self.session_id = session_id
+        self.max_messages = max_messages
+
+    @property
+    def messages(self):
+        return messages_from_dict(state.items("chat", self.session_id))
+
+    def add_messages(self, messages) -> None:
+        state.append("chat", self.session_id, [message_to_dict(m) for m in messages], max_items=self.max_messages)
+
+    def clear(self) -> None:
+        state.delete("chat", self.session_id)
+
+
+def _conversation_memory():
+    try:
+        # Use classic or community memory depending on availability
+        from langchain_classic.memory import ConversationBufferMemory
+    except ImportError:
+        from langchain_community.memory import ConversationBufferMemory
+    return ConversationBufferMemory
+
+
+def _secret_box():
+    """Fernet cipher keyed by STATE_SECRET_KEY, or None when no key (or no cryptography) is available."""
+    if not settings.STATE_SECRET_KEY:
+        return None
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:  # optional: without it, secrets stay in process
+        return None
+    import base64
+    import hashlib
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(settings.STATE_SECRET_KEY.encode()).digest()))
+
+
+class SQLEngineRegistry:
+    """
+    session_id -> SQLDatabase. Connection strings are stored in the shared state store
+    encrypted with STATE_SECRET_KEY, and each worker opens its own engine the first time
+    it sees the session. Without a key only the credential-free URL is stored, so the
+    session stays on the worker that connected it.
+    """
+
+    def __init__(self):
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def connect(self, session_id: str, connection_string: str) -> "SQLDatabase":
+        from langchain_community.utilities import SQLDatabase
+        from sqlalchemy.engine import make_url
+        db = SQLDatabase.from_uri(connection_string)
+        record = {"url": make_url(connection_string).render_as_string(hide_password=True)}
+        box = _secret_box()
+        if box is not None:
+            record["uri_encrypted"] = box.encrypt(connection_string.encode()).decode()
+        state.set("sql", session_id, record)
+        with self._lock:
+            self._engines[session_id] = db
+        return db
+
+    def _stored_uri(self, session_id: str):
+        record = state.get("sql", session_id) or {}
+        box = _secret_box()
+        if box is None or "uri_encrypted" not in record:
+            return None
+        from cryptography.fernet import InvalidToken
+        try:
+            return box.decrypt(record["uri_encrypted"].encode()).decode()
+        except InvalidToken:  # key rotated since the session connected
+            return None
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._engines:
+                return True
+        return self._stored_uri(session_id) is not None
+
+    def __getitem__(self, session_id: str) -> "SQLDatabase":
+        with self._lock:
+            db = self._engines.get(session_id)
+        if db is not None:
+            return db
+        uri = self._stored_uri(session_id)
+        if uri is None:
+            raise KeyError(session_id)
+        from langchain_community.utilities import SQLDatabase
+        db = SQLDatabase.from_uri(uri)
+        STATE_REBUILDS.inc(kind="sql_engine")
+        with self._lock:
+            return self._engines.setdefault(session_id, db)
+
 
 class AIEngine:
     def __init__(self):
+        # Per-worker caches; the state behind them lives in the shared state store
         self.sessions = {}
-        self.sql_engines = {}
-        
-        if settings.GEMINI_API_KEY:
-            self.llm = ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash", 
-                google_api_key=settings.GEMINI_API_KEY,
-                temperature=0,
-                convert_system_message_to_human=True,
-                streaming=True
-            )
-        else:
-            self.llm = None
+        self.sql_engines = SQLEngineRegistry()
+        self._llm = None
+        self._llm_lock = threading.Lock()
+
+    @property
+    def llm(self):
+        # Provider is chosen by settings.LLM_PROVIDER (Gemini, or the offline fake).
+        # Every call goes through the gateway for coalescing, fair queuing and rate limiting.
+        # Created on first use: the provider SDK is a slow import.
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    self._llm = llm_gateway.wrap(get_llm_provider().create_chat_model())
+        return self._llm
+
+    def warmup(self):
+        """
+        Imports the agent toolkits and memory (most of langchain, seconds of import
+        time) and creates the chat model, ahead of the first request.
+        """
+        import langchain_experimental.agents.agent_toolkits
+        import langchain_community.agent_toolkits
+        import langchain_community.utilities
+        _conversation_memory()
+        return self.llm
 
     def _get_memory(self, session_id: str):
         if session_id not in self.sessions:
+            ConversationBufferMemory = _conversation_memory()
             self.sessions[session_id] = ConversationBufferMemory(
+                chat_memory=SharedChatHistory(session_id, settings.STATE_CHAT_HISTORY_MAX),
                 memory_key="chat_history",
                 return_messages=True,
                 input_key="input",
@@ -86,29 +310,55 @@ class AIEngine:
             )
         return self.sessions[session_id]
 
-    def analyze_stream(self, df: pd.DataFrame, query: str, session_id: str):
+    def analyze_stream(self, df: pd.DataFrame, query: str, session_id: str, events: bool = False):
+        """
+        Streams the pandas agent's final answer as text tokens, or as StreamEvents
+        (step/tool progress, answer tokens, heartbeats) when events=True.
+        """
+        def message(event, text):
+            return StreamEvent(event, text) if events else text
+
         if not self.llm:
-            yield "System Error: AI API Key is missing."
+            yield message("error", "System Error: AI API Key is missing.")
             return
 
         q = queue.Queue()
-        handler = FinalAnswerCallbackHandler(q)
+        handler = FinalAnswerCallbackHandler(q, events=events)
+        tracer = TracingCallbackHandler()
         
         try:
             memory = self._get_memory(session_id)
-            agent = create_pandas_dataframe_agent(
-                self.llm,
-                df,
-                verbose=True,
-                allow_dangerous_code=True,
-                agent_type="zero-shot-react-description",
-                agent_executor_kwargs={
-                    "memory": memory,
-                    "handle_parsing_errors": True
-                }
-            )
+            # Plain filters and group-bys go to the SQL engine instead of agent-written pandas
+            extra_tools = [SessionSQLTool.for_session(session_id)] if sql_engine.table(session_id) is not None else []
+            with timed("agent_init"):
+                from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
+                agent = create_pandas_dataframe_agent(
+                    self.llm,
+                    df,
+                    verbose=True,
+                    allow_dangerous_code=True,
+                    agent_type="zero-shot-react-description",
+                    extra_tools=extra_tools,
+                    agent_executor_kwargs={
+                        "memory": memory,
+                        "handle_parsing_errors": True
+                    }
+                )
+            if settings.SANDBOX_ENABLED:
+                # Agent code runs in the worker pool against a memory-mapped copy of df
+                try:
+                    with timed("sandbox_export"):
+                        arrow_path = sandbox_pool.export_dataframe(session_id, df)
+                except Exception as e:
+                    # Keep the chat working with the in-process tool rather than failing it
+                    print(f"Sandbox export failed for {session_id}, using the in-process tool: {e}")
+                else:
+                    agent.tools = [
+                        SandboxedPythonTool(arrow_path=arrow_path) if t.name == "python_repl_ast" else t
+                        for t in agent.tools
+                    ]
         except Exception as e:
-            yield f"Error initializing AI agent: {str(e)}"
+            yield message("error", f"Error initializing AI agent: {str(e)}")
             return
 
         def run_agent():
@@ -116,46 +366,50 @@ class AIEngine:
                 enhanced_query = f"""
                 Question: {query}
                 INSTRUCTIONS:
-                1. Use Python to find the answer.
+                1. Use Python to find the answer{" (or sql_query for filtering, grouping and aggregating)" if extra_tools else ""}.
                 2. Your final response MUST start with "Final Answer:." 
                 3. Everything before that is hidden.
                 """
-                agent.invoke({"input": enhanced_query}, config={"callbacks": [handler]})
+                with llm_gateway.session(session_id), timed("agent_run"):
+                    agent.invoke({"input": enhanced_query}, config={"callbacks": [handler, tracer]})
             except Exception as e:
-                q.put(f"Error: {str(e)}")
+                q.put(message("error", f"Error: {str(e)}"))
             finally:
                 q.put(None)
 
-        thread = threading.Thread(target=run_agent)
+        # Run in a copy of the current context so stage timers land in this request's trace
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(run_agent,))
         thread.start()
 
-        while True:
-            token = q.get()
-            if token is None: break
-            yield token
+        yield from drain_queue(q, HEARTBEAT_SECONDS if events else None)
 
     def connect_sql(self, session_id: str, connection_string: str):
         try:
-            db = SQLDatabase.from_uri(connection_string)
-            self.sql_engines[session_id] = db
+            with timed("sql_connect"):
+                self.sql_engines.connect(session_id, connection_string)
             return True
         except Exception as e:
             print(f"SQL Connection Failed: {e}")
             return False
 
-    def analyze_sql(self, query: str, session_id: str) -> str:
+    def is_chart_query(self, query: str) -> bool:
+        return any(w in query.lower() for w in ['plot', 'chart', 'graph', 'visualize'])
+
+    @timed_stage("sql_agent")
+    def analyze_sql(self, query: str, session_id: str, callbacks: list = None) -> str:
         if session_id not in self.sql_engines:
             return "No active database connection."
         
         try:
             db = self.sql_engines[session_id]
+            from langchain_community.agent_toolkits import create_sql_agent
             agent_executor = create_sql_agent(
                 self.llm, db=db, verbose=True,
                 agent_type="zero-shot-react-description",
                 handle_parsing_errors=True
             )
             
-            is_chart = any(w in query.lower() for w in ['plot', 'chart', 'graph', 'visualize'])
+            is_chart = self.is_chart_query(query)
             
             if is_chart:
                 # Prompt instructs the LLM to return JSON
@@ -178,7 +432,8 @@ class AIEngine:
                 prompt = f"{query}\nProvide a direct answer without showing the SQL query."
 
             try:
-                response = agent_executor.invoke(prompt)
+                with llm_gateway.session(session_id):
+                    response = agent_executor.invoke(prompt, config={"callbacks": [TracingCallbackHandler()] + (callbacks or [])})
                 raw_output = response['output']
 
                 if is_chart:
@@ -218,9 +473,73 @@ class AIEngine:
         except Exception as e:
             return f"SQL System Error: {str(e)}"
 
-    def analyze_document(self, context: str, query: str) -> str:
-        prompt = f"Context: {context}\n\nQuestion: {query}\nHelpful Answer:"
-        response = self.llm.invoke(prompt)
+    def analyze_sql_events(self, query: str, session_id: str):
+        """SSE variant of analyze_sql: progress events, then answer tokens or a chart event."""
+        is_chart = self.is_chart_query(query)
+        q = queue.Queue()
+        handler = FinalAnswerCallbackHandler(q, events=True, stream_answer=not is_chart)
+        result = {}
+
+        def run_agent():
+            try:
+                result["content"] = self.analyze_sql(query, session_id, callbacks=[handler])
+            finally:
+                q.put(None)
+
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(run_agent,))
+        thread.start()
+        yield from drain_queue(q, HEARTBEAT_SECONDS)
+
+        content = result.get("content", "")
+        if is_chart:
+            try:
+                yield StreamEvent("chart", json.loads(content))
+                return
+            except (TypeError, ValueError):
+                pass
+        if not handler.streamed:
+            # Errors and unparsed answers never went through the token stream
+            yield StreamEvent("token", content)
+
+    def _document_prompt(self, context: str, query: str) -> str:
+        return f"Context: {context}\n\nQuestion: {query}\nHelpful Answer:"
+
+    def analyze_document_stream(self, context: str, query: str, session_id: str = None, events: bool = False):
+        """
+        Streaming variant of analyze_document: yields answer text as the model produces
+        it, or token StreamEvents (plus heartbeats) when events=True.
+        """
+        def message(event, text):
+            return StreamEvent(event, text) if events else text
+
+        if not self.llm:
+            yield message("error", "System Error: AI API Key is missing.")
+            return
+
+        q = queue.Queue()
+        prompt = self._document_prompt(context, query)
+
+        def run_llm():
+            # The gateway session is a contextvar, so the whole stream runs in one thread
+            try:
+                with llm_gateway.session(session_id):
+                    for chunk in self.llm.stream(prompt, config={"callbacks": [TracingCallbackHandler()]}):
+                        if isinstance(chunk.content, str) and chunk.content:
+                            q.put(message("token", chunk.content))
+            except Exception as e:
+                q.put(message("error", f"Error: {str(e)}"))
+            finally:
+                q.put(None)
+
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(run_llm,))
+        thread.start()
+        yield from drain_queue(q, HEARTBEAT_SECONDS if events else None)
+
+    @timed_stage("document_answer")
+    def analyze_document(self, context: str, query: str, session_id: str = None) -> str:
+        prompt = self._document_prompt(context, query)
+        with llm_gateway.session(session_id):
+            response = self.llm.invoke(prompt, config={"callbacks": [TracingCallbackHandler()]})
         # Some LLM clients return a response object, others a string. Handle both.
         if hasattr(response, 'content'):
             return response.content
@@ -251,11 +570,13 @@ class AIEngine:
         # Safely parse JSON
         return json.loads(json_str)
 
-    def get_suggestions(self, df: pd.DataFrame) -> list:
+    @timed_stage("suggestions")
+    def get_suggestions(self, df: pd.DataFrame, session_id: str = None) -> list:
         try:
             cols = ", ".join(df.columns.astype(str))
             prompt = f"Generate 3 short business questions for columns: [{cols}]. Return ONLY a JSON array of strings."
-            response = self.llm.invoke(prompt)
+            with llm_gateway.session(session_id):
+                response = self.llm.invoke(prompt, config={"callbacks": [TracingCallbackHandler()]})
             
             # FIX 2: Use robust JSON cleaning utility
             return self._clean_and_load_json(response.content if hasattr(response, 'content') else str(response))
@@ -264,6 +585,7 @@ class AIEngine:
             print(f"Error generating CSV suggestions: {e}")
             return ["Analyze trends", "Show outliers", "Summarize data"]
 
+    @timed_stage("suggestions")
     def get_sql_suggestions(self, session_id: str) -> list:
         if session_id not in self.sql_engines: return ["Database not connected."]
         try:
@@ -281,7 +603,8 @@ class AIEngine:
             Generate 3 short business questions that can be answered using SQL against this schema.
             Return ONLY a JSON array of strings.
             """
-            response = self.llm.invoke(prompt)
+            with llm_gateway.session(session_id):
+                response = self.llm.invoke(prompt, config={"callbacks": [TracingCallbackHandler()]})
             
             # FIX 3: Use robust JSON cleaning utility
             return self._clean_and_load_json(response.content if hasattr(response, 'content') else str(response))
@@ -290,6 +613,7 @@ class AIEngine:
             print(f"Error generating SQL suggestions: {e}")
             return [f"Error generating SQL suggestions: {str(e)}"]
 
+    @timed_stage("suggestions")
     def get_rag_suggestions(self) -> list:
         try:
             prompt = """
@@ -297,7 +621,7 @@ class AIEngine:
             they might ask to extract key information. 
             Return ONLY a JSON array of strings.
             """
-            response = self.llm.invoke(prompt)
+            response = self.llm.invoke(prompt, config={"callbacks": [TracingCallbackHandler()]})
             
             # FIX 4: Use robust JSON cleaning utility
             return self._clean_and_load_json(response.content if hasattr(response, 'content') else str(response))
@@ -306,6 +630,7 @@ class AIEngine:
             print(f"Error generating RAG suggestions: {e}")
             return ["Summarize key risks.", "List Q4 objectives.", "What are the compliance requirements?"]
         
+    @timed_stage("text_summary")
     def generate_text_summary(self, session_id: str, data_type: str):
         """Generates a text summary for non-CSV data sources."""
         if data_type == 'SQL' and session_id in self.sql_engines:
@@ -320,7 +645,7 @@ class AIEngine:
             This report confirms that the SQL Agent is active and ready to query the live database schema.
             Use the Chat interface to extract specific insights or visualize trends from these tables.
             """
-        elif data_type == 'RAG' and os.path.exists(f"./chroma_db/{session_id}"):
+        elif data_type == 'RAG' and rag_service.has_collection(session_id):
             return f"""
             *** Document Knowledge Base Summary ***
             
@@ -333,6 +658,7 @@ class AIEngine:
         return f"No active {data_type} data source found."
     
 
+    @timed_stage("sql_schema")
     def get_sql_tables(self, session_id: str) -> list:
         if session_id not in self.sql_engines: return []
         try:
@@ -342,6 +668,7 @@ class AIEngine:
             print(f"Error getting tables: {e}")
             return []
 
+    @timed_stage("sql_schema")
     def get_sql_columns(self, session_id: str, table_name: str) -> dict:
         if session_id not in self.sql_engines:
             return {"error": "No SQL connection"}
@@ -1,27 +1,47 @@
 import pandas as pd
 import numpy as np
-from scipy import stats
-from sklearn.ensemble import IsolationForest, RandomForestRegressor, RandomForestClassifier
-from sklearn.preprocessing import LabelEncoder
-import json
-import plotly.express as px
-import plotly.utils
+from app.services.telemetry import timed, timed_stage
+from app.services.sql_engine import sql_engine, ident, is_numeric, is_temporal
+from app.services.timeseries import timeseries
+
+# sklearn and plotly take about a second to import between them, so they are imported
+# by the methods that use them (see warmup) instead of when the app starts
+
+HISTOGRAM_BINS = 50
+
+
+def _not_null(columns: list) -> str:
+    return " AND ".join(f"{ident(c)} IS NOT NULL" for c in columns if c)
 
 class AnalysisService:
-    
+
+    def warmup(self):
+        """Imports the modelling and charting libraries ahead of the first request."""
+        import sklearn.ensemble
+        import sklearn.preprocessing
+        import plotly.express
+
     def get_numeric_cols(self, df):
         return df.select_dtypes(include=[np.number]).columns.tolist()
 
+    @timed_stage("auto_insights")
     def get_auto_insights(self, df: pd.DataFrame):
-        insights = []
         numeric_cols = self.get_numeric_cols(df)
-        
-        missing_data = df.isnull().sum()
-        if missing_data.sum() > 0:
-            insights.append(f"Dataset has {missing_data.sum()} missing values.")
+        corr_matrix = df[numeric_cols].corr() if len(numeric_cols) > 1 else None
+        return self._insights(int(df.isnull().sum().sum()), corr_matrix)
+
+    @timed_stage("auto_insights")
+    def insights_from_profile(self, profile: dict):
+        """Same insights from SQL engine statistics (sql_engine.profile) instead of a DataFrame."""
+        corr_matrix = profile["corr"] if len(profile["numeric"]) > 1 else None
+        return self._insights(sum(profile["null_counts"].values()), corr_matrix)
+
+    def _insights(self, missing: int, corr_matrix):
+        insights = []
+        if missing > 0:
+            insights.append(f"Dataset has {missing} missing values.")
             
-        if len(numeric_cols) > 1:
-            corr_matrix = df[numeric_cols].corr()
+        if corr_matrix is not None:
             # Find high correlations (positive or negative)
             high_corr = np.where(np.abs(corr_matrix) > 0.8)
             pairs = [(corr_matrix.index[x], corr_matrix.columns[y]) 
@@ -31,70 +51,207 @@ class AnalysisService:
         
         return insights
 
+    @timed_stage("outlier_detection")
     def detect_outliers(self, df: pd.DataFrame, column: str):
         numeric_cols = self.get_numeric_cols(df)
         if column in numeric_cols:
             data = df[[column]].dropna()
             if len(data) > 10:
+                from sklearn.ensemble import IsolationForest
                 iso_forest = IsolationForest(contamination=0.1, random_state=42)
                 preds = iso_forest.fit_predict(data)
                 outliers = data[preds == -1]
                 return outliers.index.tolist(), len(outliers)
         return [], 0
 
+    @timed_stage("chart_build")
     def generate_chart_json(self, df: pd.DataFrame, chart_type: str, x: str, y: str, color=None, size=None):
         try:
             # Basic error handling for None values
             color = None if color == "None" else color
             size = None if size == "None" else size
-            
-            # Define a vibrant color sequence
-            colors = px.colors.qualitative.Bold 
-
-            fig = None
-
-            if chart_type == "Scatter Plot":
-                fig = px.scatter(df, x=x, y=y, color=color, size=size, 
-                               template="plotly_white", color_discrete_sequence=colors)
-            elif chart_type == "Line Chart":
-                fig = px.line(df, x=x, y=y, color=color, 
-                            template="plotly_white", color_discrete_sequence=colors)
-            elif chart_type == "Bar Chart":
-                fig = px.bar(df, x=x, y=y, color=color, 
-                           template="plotly_white", color_discrete_sequence=colors)
-            elif chart_type == "Box Plot":
-                fig = px.box(df, x=x, y=y, color=color, 
+            return self._chart_payload(self._figure(df, chart_type, x, y, color, size))
+        except Exception as e:
+            print(f"Chart Error: {e}")
+            return {"error": str(e)}
+
+    def _figure(self, df: pd.DataFrame, chart_type: str, x: str, y: str, color=None, size=None):
+        import plotly.express as px
+        # Define a vibrant color sequence
+        colors = px.colors.qualitative.Bold 
+
+        fig = None
+
+        if chart_type == "Scatter Plot":
+            fig = px.scatter(df, x=x, y=y, color=color, size=size, 
                            template="plotly_white", color_discrete_sequence=colors)
-            elif chart_type == "Histogram":
-                fig = px.histogram(df, x=x, color=color, 
-                                 template="plotly_white", color_discrete_sequence=colors)
-            elif chart_type == "Correlation Heatmap":
-                num_cols = self.get_numeric_cols(df)
-                if len(num_cols) > 1:
-                    corr = df[num_cols].corr()
-                    fig = px.imshow(corr, text_auto=True, color_continuous_scale='RdBu_r')
-                else:
-                    return None
-            
-            if fig:
-                # Ensure layout is clean and responsive
-                fig.update_layout(
-                    margin=dict(l=20, r=20, t=40, b=20),
-                    autosize=True,
-                    font=dict(family="Inter, sans-serif", color="#1e293b")
-                )
-                return json.loads(json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder))
+        elif chart_type == "Line Chart":
+            fig = px.line(df, x=x, y=y, color=color, 
+                        template="plotly_white", color_discrete_sequence=colors)
+        elif chart_type == "Bar Chart":
+            fig = px.bar(df, x=x, y=y, color=color, 
+                       template="plotly_white", color_discrete_sequence=colors)
+        elif chart_type == "Box Plot":
+            fig = px.box(df, x=x, y=y, color=color, 
+                       template="plotly_white", color_discrete_sequence=colors)
+        elif chart_type == "Histogram":
+            fig = px.histogram(df, x=x, color=color, 
+                             template="plotly_white", color_discrete_sequence=colors)
+        elif chart_type == "Correlation Heatmap":
+            num_cols = self.get_numeric_cols(df)
+            if len(num_cols) > 1:
+                fig = self._heatmap(df[num_cols].corr())
+        return fig
+
+    def _heatmap(self, corr: pd.DataFrame):
+        import plotly.express as px
+        return px.imshow(corr, text_auto=True, color_continuous_scale='RdBu_r')
+
+    def _chart_payload(self, fig):
+        if not fig:
             return None
-            
+        # Ensure layout is clean and responsive
+        fig.update_layout(
+            margin=dict(l=20, r=20, t=40, b=20),
+            autosize=True,
+            font=dict(family="Inter, sans-serif", color="#1e293b")
+        )
+        # Plain dict with the NumPy arrays left in place (numeric ones already
+        # base64-packed by Plotly); app.utils.dumps encodes it in one pass
+        with timed("chart_serialize"):
+            return fig.to_plotly_json()
+
+    @timed_stage("chart_build")
+    def generate_pushdown_chart(self, session_id: str, chart_type: str, x: str, y: str, color=None, size=None):
+        """
+        generate_chart_json for an uploaded dataset registered in the SQL engine. Bar charts,
+        histograms, box plots and the heatmap are aggregated in SQL, so only the aggregates
+        reach plotly (and the browser); scatter and line charts read just the columns they plot.
+        """
+        try:
+            # The UI sends "None" for unused axes
+            x, y, color, size = (None if v == "None" else v for v in (x, y, color, size))
+            table = sql_engine.table(session_id)
+            for col in (x, y, color, size):
+                if col and col not in table.columns:
+                    raise ValueError(f"Column '{col}' not found in the dataset.")
+            numeric = lambda col: bool(col) and is_numeric(table.columns[col])
+            groups = [c for c in dict.fromkeys((x, color)) if c]
+
+            if chart_type == "Bar Chart" and numeric(y) and y not in groups:
+                # px.bar stacks one segment per row; the bar heights are the per-group sums
+                df = sql_engine.query(session_id, self._grouped_sql(groups, f"sum({ident(y)}) AS {ident(y)}"), kind="chart")
+                return self._chart_payload(self._figure(df, chart_type, x, y, color))
+            if chart_type == "Histogram" and numeric(x) and "count" not in groups:
+                return self._chart_payload(self._binned_histogram(session_id, x, color))
+            if chart_type == "Histogram" and not is_temporal(table.columns[x]) and "count" not in groups:
+                df = sql_engine.query(session_id, self._grouped_sql(groups, "count(*) AS count"), kind="chart")
+                return self._chart_payload(self._figure(df, "Bar Chart", x, "count", color))
+            if chart_type == "Box Plot" and numeric(y) and y not in groups:
+                return self._chart_payload(self._box_from_quartiles(session_id, x, y, color))
+            if chart_type == "Line Chart" and numeric(y) and not color and not size \
+                    and x in timeseries.date_columns(session_id):
+                # Served from the rollups at the resolution that fits the chart; zoom re-queries them
+                return self.timeseries_chart(timeseries.series(session_id, x, y))
+            if chart_type == "Correlation Heatmap":
+                corr = sql_engine.profile(session_id)["corr"]
+                return self._chart_payload(self._heatmap(corr) if len(corr) > 1 else None)
+
+            # Everything else plots rows: read only the columns the chart uses
+            columns = [c for c in dict.fromkeys((x, y, color, size)) if c]
+            df = sql_engine.query(session_id, f"SELECT {', '.join(ident(c) for c in columns)} FROM df", kind="chart")
+            return self._chart_payload(self._figure(df, chart_type, x, y, color, size))
         except Exception as e:
             print(f"Chart Error: {e}")
             return {"error": str(e)}
 
+    def timeseries_chart(self, series: dict, agg: str = "mean"):
+        """Line of one aggregate per bucket; averaged series get a min-max band so spikes stay visible."""
+        import plotly.express as px
+        import plotly.graph_objects as go
+        color = px.colors.qualitative.Bold[0]
+        fig = go.Figure()
+        if agg == "mean" and series["resolution"] != "raw":
+            band = color.replace("rgb(", "rgba(").replace(")", ", 0.18)")
+            fig.add_trace(go.Scatter(x=series["x"], y=series["max"], mode="lines", line=dict(width=0),
+                                     hoverinfo="skip", showlegend=False))
+            fig.add_trace(go.Scatter(x=series["x"], y=series["min"], mode="lines", line=dict(width=0),
+                                     fill="tonexty", fillcolor=band, hoverinfo="skip", showlegend=False))
+        fig.add_trace(go.Scatter(x=series["x"], y=series[agg], mode="lines", line=dict(color=color),
+                                 name=f"{agg} of {series['value']}"))
+        resolution = "raw data" if series["resolution"] == "raw" else f"per {series['resolution']}"
+        fig.update_layout(
+            template="plotly_white", showlegend=False,
+            xaxis_title=f"{series['date']} ({resolution})", yaxis_title=series["value"],
+            # Lets the client re-query /timeseries at a finer resolution when the user zooms
+            meta={"timeseries": {k: series[k] for k in ("date", "value", "resolution", "width")} | {"agg": agg}},
+        )
+        return self._chart_payload(fig)
+
+    def _grouped_sql(self, groups: list, aggregate: str) -> str:
+        keys = ", ".join(ident(c) for c in groups)
+        # Rows with a missing x or colour are not drawn by plotly either
+        return f"SELECT {keys}, {aggregate} FROM df WHERE {_not_null(groups)} GROUP BY {keys} ORDER BY {keys}"
+
+    def _binned_histogram(self, session_id: str, x: str, color=None):
+        import plotly.express as px
+        col = ident(x)
+        lo, hi = sql_engine.query(session_id, f"SELECT min({col}), max({col}) FROM df", kind="chart").iloc[0]
+        if pd.isna(lo):
+            return None
+        width = (float(hi) - float(lo)) / HISTOGRAM_BINS or 1.0
+        keys = "__bin" + (f", {ident(color)}" if color else "")
+        df = sql_engine.query(session_id, (
+            f"SELECT least(floor(({col} - ?) / ?), ?)::INTEGER AS __bin{', ' + ident(color) if color else ''}, "
+            f"count(*) AS count FROM df WHERE {_not_null([x, color])} GROUP BY {keys} ORDER BY {keys}"
+        ), [float(lo), width, HISTOGRAM_BINS - 1], kind="chart")
+        df[x] = float(lo) + (df.pop("__bin") + 0.5) * width
+        fig = px.bar(df, x=x, y="count", color=color,
+                     template="plotly_white", color_discrete_sequence=px.colors.qualitative.Bold)
+        # Adjacent bars of the bin width, like px.histogram draws them
+        fig.update_traces(width=width)
+        fig.update_layout(bargap=0)
+        return fig
+
+    def _box_from_quartiles(self, session_id: str, x, y: str, color=None):
+        """Box plot from SQL quartiles and 1.5 IQR whiskers (outlier points are not drawn)."""
+        import plotly.express as px
+        import plotly.graph_objects as go
+        groups = [c for c in dict.fromkeys((x, color)) if c]
+        v = ident(y)
+        keys = ", ".join(f"s.{ident(c)}" for c in groups)
+        join = " AND ".join(f"d.{ident(c)} = s.{ident(c)}" for c in groups) or "true"
+        df = sql_engine.query(session_id, (
+            f"WITH s AS (SELECT {''.join(ident(c) + ', ' for c in groups)}quantile_cont({v}, 0.25) AS q1, "
+            f"median({v}) AS med, quantile_cont({v}, 0.75) AS q3 FROM df WHERE {_not_null(groups + [y])}"
+            f"{' GROUP BY ' + ', '.join(ident(c) for c in groups) if groups else ''}) "
+            f"SELECT {keys + ', ' if keys else ''}s.q1, s.med, s.q3, "
+            f"min(d.{v}) FILTER (WHERE d.{v} >= s.q1 - 1.5 * (s.q3 - s.q1)) AS lo, "
+            f"max(d.{v}) FILTER (WHERE d.{v} <= s.q3 + 1.5 * (s.q3 - s.q1)) AS hi "
+            f"FROM df d JOIN s ON {join} WHERE d.{v} IS NOT NULL "
+            f"GROUP BY {keys + ', ' if keys else ''}s.q1, s.med, s.q3"
+            f"{' ORDER BY ' + keys if keys else ''}"
+        ), kind="chart")
+        colors = px.colors.qualitative.Bold
+        fig = go.Figure()
+        traces = df.groupby(color, sort=True) if color else [(y, df)]
+        for i, (name, part) in enumerate(traces):
+            fig.add_trace(go.Box(
+                x=part[x] if x else None, q1=part["q1"], median=part["med"], q3=part["q3"],
+                lowerfence=part["lo"], upperfence=part["hi"], name=str(name), marker_color=colors[i % len(colors)],
+            ))
+        fig.update_layout(template="plotly_white", boxmode="group" if color else "overlay",
+                          xaxis_title=x, yaxis_title=y, legend_title_text=color or None, showlegend=bool(color))
+        return fig
+
+    @timed_stage("key_drivers")
     def calculate_key_drivers(self, df: pd.DataFrame, target_col: str):
         """
         Performs Root Cause Analysis using Random Forest Feature Importance.
         Identifies which columns (drivers) have the most impact on the target_col.
         """
+        from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
+        from sklearn.preprocessing import LabelEncoder
         try:
             df_clean = df.dropna()
             if df_clean.empty:
@@ -126,7 +283,8 @@ class AnalysisService:
                 model = RandomForestClassifier(n_estimators=100, random_state=42)
                 task_type = "Classification"
 
-            model.fit(X, y)
+            with timed("drivers_fit"):
+                model.fit(X, y)
 
             # Get Feature Importance
             importances = model.feature_importances_
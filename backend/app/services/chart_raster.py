@@ -0,0 +1,253 @@
+"""
+Plotly figure JSON -> PNG for the PDF report.
+
+The default renderer draws the figure with matplotlib (Agg), so it works on a stock
+install with no browser. It covers the trace types the app produces: bar, scatter/line
+(including filled bands), histogram, box (raw values or precomputed quartiles), pie and
+heatmap. REPORT_CHART_RENDERER=kaleido uses Plotly's own renderer instead, for exact
+styling; Kaleido 1.x needs a Chrome binary (`plotly_get_chrome`).
+"""
+from app.config import settings
+import base64
+import io
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+# Plotly's default qualitative colours, used for traces without an explicit colour
+DEFAULT_COLORS = ["#636efa", "#EF553B", "#00cc96", "#ab63fa", "#FFA15A",
+                  "#19d3f3", "#FF6692", "#B6E880", "#FF97FF", "#FECB52"]
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def _color(value, default):
+    """Plotly colour strings ("rgb(1, 2, 3)", "rgba(...)", "#hex", names) as matplotlib colours."""
+    if not isinstance(value, str):
+        return default
+    match = re.match(r"rgba?\(([^)]*)\)", value.replace(" ", ""))
+    if match:
+        parts = [float(p) for p in match.group(1).split(",")]
+        return tuple(p / 255 for p in parts[:3]) + (tuple(parts[3:4]) or (1.0,))
+    return value
+
+
+def _values(array):
+    """Trace data as an array; ISO date strings become datetimes so time axes are continuous."""
+    if array is None:
+        return None
+    values = np.asarray(array)
+    if values.dtype.kind in "OU" and len(values) and isinstance(values[0], str) and _ISO_DATE.match(values[0]):
+        parsed = pd.to_datetime(pd.Series(values), errors="coerce", format="ISO8601")
+        if parsed.notna().all():
+            return parsed.to_numpy()
+    return values
+
+
+def _decode_typed_arrays(obj):
+    """Plotly >= 6 serialises NumPy arrays as {"dtype": "f8", "bdata": <base64>, "shape": "r, c"}."""
+    if isinstance(obj, dict):
+        if "bdata" in obj and "dtype" in obj:
+            values = np.frombuffer(base64.b64decode(obj["bdata"]), dtype=np.dtype(obj["dtype"]).newbyteorder("<"))
+            shape = obj.get("shape")
+            return values.reshape([int(n) for n in str(shape).split(",")]) if shape else values
+        return {k: _decode_typed_arrays(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_decode_typed_arrays(v) for v in obj]
+    return obj
+
+
+def _title(obj) -> str:
+    title = getattr(obj, "title", None)
+    return (getattr(title, "text", None) or "") if title is not None else ""
+
+
+def _categories(traces, axis: str) -> list:
+    """Union of the traces' category values along an axis, in first-seen order."""
+    seen = {}
+    for trace in traces:
+        for value in (getattr(trace, axis) if getattr(trace, axis) is not None else [trace.name]):
+            seen.setdefault(str(value), None)
+    return list(seen)
+
+
+def _draw_bars(ax, traces, layout, colors):
+    horizontal = traces[0].orientation == "h"
+    cat_axis, val_axis = ("y", "x") if horizontal else ("x", "y")
+    first = _values(getattr(traces[0], cat_axis))
+    numeric = first is not None and first.dtype.kind in "iufM"
+    categories = None if numeric else _categories(traces, cat_axis)
+    mode = layout.barmode or "group"
+    offsets = {}
+    for i, trace in enumerate(traces):
+        cats, vals = _values(getattr(trace, cat_axis)), np.asarray(getattr(trace, val_axis), dtype=float)
+        color = _color(trace.marker.color, colors[i % len(colors)])
+        if numeric:
+            positions, width = cats, trace.width if trace.width is not None else None
+        else:
+            positions = np.array([categories.index(str(c)) for c in cats], dtype=float)
+            width = 0.8
+            if mode == "group" and len(traces) > 1:
+                width = 0.8 / len(traces)
+                positions = positions - 0.4 + width * (i + 0.5)
+        kwargs = {"color": color, "label": trace.name}
+        if width is not None:
+            kwargs["width" if not horizontal else "height"] = width
+        if mode in ("stack", "relative"):
+            # "relative" stacks positive and negative values on their own side of zero
+            base = []
+            for p, v in zip(positions.tolist(), vals):
+                key = (p, mode == "relative" and v < 0)
+                base.append(offsets.get(key, 0.0))
+                offsets[key] = base[-1] + v
+            kwargs["left" if horizontal else "bottom"] = np.array(base)
+        (ax.barh if horizontal else ax.bar)(positions, vals, **kwargs)
+    if categories is not None:
+        (ax.set_yticks if horizontal else ax.set_xticks)(range(len(categories)))
+        (ax.set_yticklabels if horizontal else ax.set_xticklabels)(
+            [c[:20] for c in categories], rotation=0 if horizontal else (45 if len(categories) > 8 else 0),
+            ha="right" if len(categories) > 8 and not horizontal else "center")
+
+
+def _draw_box(ax, traces, layout, colors):
+    from matplotlib import cbook
+    categories = _categories(traces, "x") if traces[0].x is not None else [t.name or str(i) for i, t in enumerate(traces)]
+    grouped = (layout.boxmode == "group") and len(traces) > 1
+    width = 0.8 / len(traces) if grouped else 0.6
+    for i, trace in enumerate(traces):
+        stats, positions = [], []
+        if trace.q1 is not None:
+            keys = [str(v) for v in trace.x] if trace.x is not None else [categories[i]]
+            for j, key in enumerate(keys):
+                stats.append({"q1": trace.q1[j], "med": trace.median[j], "q3": trace.q3[j],
+                              "whislo": trace.lowerfence[j], "whishi": trace.upperfence[j], "fliers": []})
+                positions.append(categories.index(key))
+        else:
+            y = pd.Series(np.asarray(trace.y, dtype=float))
+            keys = pd.Series([str(v) for v in trace.x]) if trace.x is not None else pd.Series([categories[i]] * len(y))
+            for key, part in y.groupby(keys, sort=False):
+                stats.append(cbook.boxplot_stats(part.dropna().to_numpy())[0])
+                positions.append(categories.index(key))
+        positions = np.array(positions, dtype=float)
+        if grouped:
+            positions = positions - 0.4 + width * (i + 0.5)
+        color = _color(trace.marker.color, colors[i % len(colors)])
+        artists = ax.bxp(stats, positions=positions, widths=width * 0.9, patch_artist=True, manage_ticks=False,
+                         medianprops={"color": "black"})
+        for patch in artists["boxes"]:
+            patch.set_facecolor(color)
+            patch.set_alpha(0.6)
+        if trace.name:
+            artists["boxes"][0].set_label(trace.name)
+    ax.set_xticks(range(len(categories)))
+    ax.set_xticklabels([c[:20] for c in categories])
+
+
+def _draw_scatter(ax, trace, color, previous):
+    x, y = _values(trace.x), np.asarray(trace.y, dtype=float)
+    if x is None:
+        x = np.arange(len(y))
+    mode = trace.mode or ("lines" if len(y) > 20 else "lines+markers")
+    line_color = _color(trace.line.color, None) or _color(trace.marker.color, color)
+    if trace.fill == "tonexty" and previous is not None:
+        ax.fill_between(x, previous, y, color=_color(trace.fillcolor, line_color), linewidth=0)
+    if "lines" in mode and (trace.line.width is None or trace.line.width > 0):
+        ax.plot(x, y, color=line_color, linewidth=trace.line.width or 1.5, label=trace.name)
+    if "markers" in mode:
+        sizes = trace.marker.size
+        if sizes is not None and np.ndim(sizes):
+            sizes = np.asarray(sizes, dtype=float)
+            span = np.nanmax(sizes) - np.nanmin(sizes) or 1.0
+            sizes = 10 + 190 * (sizes - np.nanmin(sizes)) / span
+        else:
+            sizes = (sizes or 6) ** 2
+        ax.scatter(x, y, s=sizes, color=_color(trace.marker.color, color) if isinstance(trace.marker.color, str) else color,
+                   alpha=0.7, label=None if "lines" in mode else trace.name, edgecolors="none")
+    return y
+
+
+def _draw_heatmap(ax, trace, fig):
+    z = np.asarray(trace.z, dtype=float)
+    lo, hi = np.nanmin(z), np.nanmax(z)
+    cmap = "viridis"
+    if -1 <= lo and hi <= 1:
+        cmap, lo, hi = "RdBu_r", -1, 1  # correlations
+    elif lo < 0 < hi:
+        cmap, lo, hi = "RdBu_r", -max(-lo, hi), max(-lo, hi)
+    image = ax.imshow(z, cmap=cmap, vmin=lo, vmax=hi, aspect="auto")
+    fig.colorbar(image, ax=ax)
+    if trace.x is not None:
+        ax.set_xticks(range(len(trace.x)))
+        ax.set_xticklabels([str(v)[:15] for v in trace.x], rotation=45, ha="right")
+    if trace.y is not None:
+        ax.set_yticks(range(len(trace.y)))
+        ax.set_yticklabels([str(v)[:15] for v in trace.y])
+    if z.size <= 225:
+        for (r, c), value in np.ndenumerate(z):
+            if np.isfinite(value):
+                ax.text(c, r, f"{value:.2f}", ha="center", va="center", fontsize=7)
+
+
+def rasterize_matplotlib(figure, width: int, height: int) -> bytes:
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    dpi = 100
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    layout, traces = figure.layout, list(figure.data)
+    colors = list(layout.colorway or DEFAULT_COLORS)
+    if not traces:
+        raise ValueError("figure has no traces")
+
+    kinds = {trace.type for trace in traces}
+    if kinds - {"bar", "scatter", "scattergl", "histogram", "box", "pie", "heatmap"}:
+        raise ValueError(f"unsupported trace type(s) {sorted(kinds)}")
+    if "pie" in kinds:
+        trace = traces[0]
+        ax.pie(np.asarray(trace.values, dtype=float), labels=[str(v)[:20] for v in trace.labels],
+               autopct="%1.1f%%", colors=colors)
+        ax.axis("equal")
+    elif "heatmap" in kinds:
+        _draw_heatmap(ax, traces[0], fig)
+    else:
+        bars = [t for t in traces if t.type == "bar"]
+        if bars:
+            _draw_bars(ax, bars, layout, colors)
+        boxes = [t for t in traces if t.type == "box"]
+        if boxes:
+            _draw_box(ax, boxes, layout, colors)
+        previous = None
+        for i, trace in enumerate(traces):
+            if trace.type == "histogram":
+                values = _values(trace.x if trace.x is not None else trace.y)
+                ax.hist(values, bins=trace.nbinsx or "auto", color=_color(trace.marker.color, colors[i % len(colors)]),
+                        alpha=0.75 if len(traces) > 1 else 1.0, label=trace.name)
+            elif trace.type in ("scatter", "scattergl"):
+                previous = _draw_scatter(ax, trace, colors[i % len(colors)], previous)
+        ax.set_xlabel(_title(layout.xaxis))
+        ax.set_ylabel(_title(layout.yaxis))
+        ax.grid(True, alpha=0.3)
+        named = [t for t in traces if t.name and t.showlegend is not False]
+        if len(named) > 1 and layout.showlegend is not False:
+            ax.legend(fontsize=8, title=_title(layout.legend) or None)
+    if _title(layout):
+        ax.set_title(_title(layout))
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def rasterize_chart(fig_json: str, width: int, height: int) -> bytes:
+    """Runs in a worker process: Plotly JSON -> PNG bytes."""
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    if settings.REPORT_CHART_RENDERER == "kaleido":
+        fig = pio.from_json(fig_json, skip_invalid=True)
+        fig.update_layout(template="plotly_white", width=width, height=height)
+        return fig.to_image(format="png", width=width, height=height)
+    fig = go.Figure(_decode_typed_arrays(json.loads(fig_json)), skip_invalid=True)
+    return rasterize_matplotlib(fig, width, height)
@@ -0,0 +1,130 @@
+"""
+Assembles retrieved chunks into the prompt context for analyze_document.
+
+1. Near-duplicates (repeated boilerplate, headers) are dropped by embedding similarity.
+2. Chunks that are adjacent in the same document are merged, removing the splitter's
+   chunk overlap so the shared text is only sent once.
+3. The result is packed best-first into a token budget.
+"""
+from app.services.telemetry import REGISTRY
+import numpy as np
+
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "rag_context_tokens", "Estimated prompt context size before and after packing", ["stage"],
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+CONTEXT_DROPPED = REGISTRY.counter("rag_context_chunks_dropped_total", "Retrieved chunks left out of the prompt", ["reason"])
+
+# Below this many tokens a truncated tail chunk is not worth including
+MIN_PARTIAL_TOKENS = 50
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text, same estimate as the fake provider
+    return max(1, len(text) // 4)
+
+
+def _overlap(a: str, b: str, max_chars: int) -> int:
+    """Length of the longest suffix of a that is a prefix of b."""
+    for size in range(min(len(a), len(b), max_chars), 0, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def _position(doc):
+    meta = doc.metadata or {}
+    return meta.get("doc_id") or meta.get("source"), meta.get("page"), meta.get("chunk_index")
+
+
+def drop_near_duplicates(docs: list, vectors: list, threshold: float) -> tuple:
+    """Keeps the best-ranked of any group of chunks whose cosine similarity >= threshold."""
+    if len(docs) < 2:
+        return docs, 0
+    m = np.asarray(vectors, dtype=np.float32)
+    m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    sims = m @ m.T
+    kept = []
+    for i in range(len(docs)):
+        if all(sims[i, j] < threshold for j in kept):
+            kept.append(i)
+    return [docs[i] for i in kept], len(docs) - len(kept)
+
+
+def merge_adjacent(docs: list, max_overlap_chars: int) -> tuple:
+    """
+    Merges chunks that follow each other on the same page (chunk_index n and n+1).
+    Returns merged texts in best-rank order and the number of merges.
+    """
+    groups = []  # [best rank, [(chunk_index, text)], key]
+    by_page = {}
+    for rank, doc in enumerate(docs):
+        source, page, index = _position(doc)
+        key = (source, page)
+        if source is not None and index is not None and key in by_page:
+            group = by_page[key]
+            group[1].append((index, doc.page_content))
+        else:
+            group = [rank, [(index, doc.page_content)], key]
+            groups.append(group)
+            if source is not None and index is not None:
+                by_page[key] = group
+
+    texts, merges = [], 0
+    for _, parts, _ in groups:
+        parts.sort(key=lambda p: p[0] if p[0] is not None else 0)
+        # Split the page group wherever chunk indexes are not consecutive
+        current_index, current = parts[0]
+        for index, text in parts[1:]:
+            if current_index is not None and index == current_index + 1:
+                cut = _overlap(current, text, max_overlap_chars)
+                current += ("" if cut else "\n") + text[cut:]
+                merges += 1
+            else:
+                texts.append(current)
+                current = text
+            current_index = index
+        texts.append(current)
+    return texts, merges
+
+
+def pack_context(docs: list, embeddings, token_budget: int, dedup_threshold: float = 0.95,
+                 max_overlap_chars: int = 200) -> tuple:
+    """
+    Returns (context string, stats). docs must be best-first; embeddings is used only
+    for near-duplicate detection (chunk vectors are normally served from the cache).
+    """
+    stats = {"chunks": len(docs), "duplicates": 0, "merged": 0, "truncated": 0, "over_budget": 0}
+    raw_tokens = sum(estimate_tokens(d.page_content) for d in docs)
+
+    if embeddings is not None and len(docs) > 1:
+        vectors = embeddings.embed_documents([d.page_content for d in docs])
+        docs, stats["duplicates"] = drop_near_duplicates(docs, vectors, dedup_threshold)
+    texts, stats["merged"] = merge_adjacent(docs, max_overlap_chars)
+
+    packed, used = [], 0
+    for position, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if used + tokens <= token_budget:
+            packed.append(text)
+            used += tokens
+            continue
+        remaining = token_budget - used
+        if remaining >= MIN_PARTIAL_TOKENS:
+            # Cut at the last sentence end inside the budget
+            cut = text[:remaining * 4]
+            end = max(cut.rfind(". "), cut.rfind("\n"))
+            packed.append(cut[:end + 1] if end > len(cut) // 2 else cut)
+            used += estimate_tokens(packed[-1])
+            stats["truncated"] += 1
+            stats["over_budget"] += len(texts) - position - 1
+            break
+        else:
+            stats["over_budget"] += 1
+
+    stats.update(tokens_before=raw_tokens, tokens_after=used)
+    CONTEXT_TOKENS.observe(raw_tokens, stage="retrieved")
+    CONTEXT_TOKENS.observe(used, stage="packed")
+    CONTEXT_DROPPED.inc(stats["duplicates"], reason="duplicate")
+    CONTEXT_DROPPED.inc(stats["over_budget"], reason="budget")
+    return "\n\n".join(packed), stats
@@ -0,0 +1,368 @@
+"""
+Pinned chart storage and retrieval for the dashboard.
+
+Chart configs are full Plotly figures (data arrays included), so they are stored
+compressed and never loaded for the dashboard listing: pages of pins carry metadata
+only, and each chart's payload is fetched on its own (when the card scrolls into view)
+and served from an LRU of decompressed JSON bytes.
+
+Live pins store a chart spec instead of data:
+    {"source": "csv", "session_id": ..., "chart": {chart_type, x_axis, y_axis, color_by, size_by}}
+    {"source": "sql", "session_id": ..., "sql": "SELECT ...", "chart": {...}}
+plus an optional "aggregation" (sum/mean/count/min/max/median) of y by x (and color).
+They are rendered on demand and re-rendered by refresh() only when their source
+version (dataset file version, or a hash of the query result) has changed.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import PinnedChart, compress_config, config_json
+from app.services.ai_engine import ai_engine
+from app.services.analysis import analysis_service
+from app.services.data_handler import data_handler
+from app.services.telemetry import REGISTRY, timed
+from app.utils import dumps
+import contextvars
+import hashlib
+import json
+import re
+import threading
+import time
+
+import pandas as pd
+
+PAYLOAD_CACHE = REGISTRY.counter("dashboard_payload_cache_total", "Pinned chart payload cache lookups", ["result"])
+PAYLOAD_CACHE_BYTES = REGISTRY.gauge("dashboard_payload_cache_bytes", "Bytes held by the pinned chart payload cache")
+PIN_REFRESH = REGISTRY.counter("dashboard_pin_refresh_total", "Live pin refresh outcomes", ["result"])
+SOURCE_CACHE = REGISTRY.counter("dashboard_source_cache_total", "Live pin dataset/query cache lookups", ["source", "result"])
+
+# Text pins are a few hundred bytes; sending them with the listing saves a request each
+INLINE_TYPES = {"text"}
+
+SOURCES = {"csv", "sql"}
+AGGREGATIONS = {"sum", "mean", "count", "min", "max", "median"}
+WRITE_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|upsert|drop|alter|create|truncate|grant|revoke|copy|call|exec|execute|attach|pragma|vacuum)\b",
+    re.IGNORECASE,
+)
+
+
+def etag(pin_id: int, version: str) -> str:
+    return f'"{pin_id}-{version}"'
+
+
+def validate_spec(spec: dict):
+    """Raises ValueError for specs that cannot be rendered (checked at pin time)."""
+    if spec.get("source") not in SOURCES:
+        raise ValueError(f"spec.source must be one of {sorted(SOURCES)}")
+    if not spec.get("session_id"):
+        raise ValueError("spec.session_id is required")
+    chart = spec.get("chart") or {}
+    if not chart.get("chart_type") or not chart.get("x_axis"):
+        raise ValueError("spec.chart needs at least chart_type and x_axis")
+    if spec.get("aggregation") and spec["aggregation"] not in AGGREGATIONS:
+        raise ValueError(f"spec.aggregation must be one of {sorted(AGGREGATIONS)}")
+    if spec["source"] == "sql":
+        sql = (spec.get("sql") or "").strip().rstrip(";")
+        # Pins re-run their query on every refresh, so only single read-only statements.
+        # A data-modifying CTE (WITH d AS (DELETE ...) SELECT ...) starts with WITH too;
+        # the query also runs in a read-only transaction (_read_only), this is the early check.
+        if not sql.lower().startswith(("select", "with")) or ";" in sql or WRITE_KEYWORDS.search(sql):
+            raise ValueError("spec.sql must be a single read-only SELECT statement")
+
+
+@contextmanager
+def _read_only(conn):
+    """
+    Puts the connection's transaction in read-only mode where the database supports it
+    (PostgreSQL, MySQL/MariaDB, SQLite), so a pin query can never change the user's data.
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        conn.exec_driver_sql("PRAGMA query_only = ON")
+        try:
+            yield
+        finally:
+            conn.exec_driver_sql("PRAGMA query_only = OFF")  # the connection goes back to the pool
+        return
+    if dialect in ("postgresql", "mysql", "mariadb"):
+        conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+    yield
+
+
+def _frame_version(df: pd.DataFrame) -> str:
+    hashed = pd.util.hash_pandas_object(df, index=False).values
+    return hashlib.sha1(hashed.tobytes() + ",".join(map(str, df.columns)).encode()).hexdigest()[:16]
+
+
+def _aggregate(df: pd.DataFrame, chart: dict, how: str) -> pd.DataFrame:
+    keys = [c for c in (chart.get("x_axis"), chart.get("color_by")) if c and c != "None"]
+    y = chart.get("y_axis")
+    if how == "count" or not y:
+        return df.groupby(keys, dropna=False).size().reset_index(name=y or "count")
+    return df.groupby(keys, dropna=False)[y].agg(how).reset_index()
+
+
+class DashboardService:
+    def __init__(self, cache_bytes: int):
+        self.max_bytes = cache_bytes
+        self._payloads = OrderedDict()  # (pin id, version) -> JSON bytes
+        self._size = 0
+        self._lock = threading.Lock()
+        # Live pin sources: datasets by (session, file version), query results by (session, sql)
+        self._frames = OrderedDict()
+        self._queries = OrderedDict()
+        # Striped so the number of locks stays fixed however many sources are seen
+        self._source_locks = [threading.Lock() for _ in range(64)]
+        self._refresh_pool = ThreadPoolExecutor(max_workers=settings.DASHBOARD_REFRESH_WORKERS, thread_name_prefix="pin-refresh")
+
+    # --- Payload cache ---
+    def _cached(self, key):
+        with self._lock:
+            data = self._payloads.get(key)
+            if data is not None:
+                self._payloads.move_to_end(key)
+        PAYLOAD_CACHE.inc(result="hit" if data is not None else "miss")
+        return data
+
+    def _store(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._payloads:
+                self._size -= len(self._payloads.pop(key))
+            self._payloads[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._payloads.popitem(last=False)
+                self._size -= len(evicted)
+            PAYLOAD_CACHE_BYTES.set(self._size)
+
+    def _evict(self, pin_id: int):
+        with self._lock:
+            for key in [k for k in self._payloads if k[0] == pin_id]:
+                self._size -= len(self._payloads.pop(key))
+            PAYLOAD_CACHE_BYTES.set(self._size)
+
+    # --- Live pin sources ---
+    def _source_lock(self, key) -> threading.Lock:
+        return self._source_locks[hash(key) % len(self._source_locks)]
+
+    def _csv_frame(self, session_id: str) -> tuple:
+        """(dataframe, version). Shared read-only between pins; never mutate it."""
+        version = data_handler.dataset_version(session_id)
+        key = (session_id, version)
+        # Per-source lock: pins refreshed in parallel load each dataset once
+        with self._source_lock(("csv", session_id)):
+            with self._lock:
+                df = self._frames.get(key)
+                if df is not None:
+                    self._frames.move_to_end(key)
+            SOURCE_CACHE.inc(source="csv", result="hit" if df is not None else "miss")
+            if df is None:
+                df = data_handler.load_dataset(session_id)
+                with self._lock:
+                    self._frames[key] = df
+                    while len(self._frames) > settings.DASHBOARD_FRAME_CACHE:
+                        self._frames.popitem(last=False)
+        return df, version
+
+    def _sql_frame(self, session_id: str, sql: str) -> tuple:
+        """(query result, hash of the result). Results are reused for DASHBOARD_QUERY_TTL_SECONDS."""
+        if session_id not in ai_engine.sql_engines:
+            raise ValueError("Database not connected.")
+        key = (session_id, sql)
+        with self._source_lock(("sql",) + key):
+            with self._lock:
+                cached = self._queries.get(key)
+            if cached and time.monotonic() - cached[0] < settings.DASHBOARD_QUERY_TTL_SECONDS:
+                SOURCE_CACHE.inc(source="sql", result="hit")
+                return cached[1], cached[2]
+            SOURCE_CACHE.inc(source="sql", result="miss")
+            with timed("pin_sql_query"):
+                with ai_engine.sql_engines[session_id]._engine.connect() as conn, _read_only(conn):
+                    df = pd.read_sql(text(sql), conn)
+                    conn.rollback()
+            version = _frame_version(df)
+            now = time.monotonic()
+            with self._lock:
+                self._queries.pop(key, None)
+                self._queries[key] = (now, df, version)
+                # Drop expired results, then the oldest beyond DASHBOARD_QUERY_CACHE
+                for old in [k for k, v in self._queries.items() if now - v[0] >= settings.DASHBOARD_QUERY_TTL_SECONDS]:
+                    del self._queries[old]
+                while len(self._queries) > settings.DASHBOARD_QUERY_CACHE:
+                    self._queries.popitem(last=False)
+        return df, version
+
+    def _source(self, spec: dict) -> tuple:
+        if spec["source"] == "csv":
+            return self._csv_frame(spec["session_id"])
+        return self._sql_frame(spec["session_id"], spec["sql"].strip().rstrip(";"))
+
+    def _render(self, spec: dict, df: pd.DataFrame) -> bytes:
+        chart = spec["chart"]
+        if spec.get("aggregation"):
+            df = _aggregate(df, chart, spec["aggregation"])
+        with timed("pin_render"):
+            fig = analysis_service.generate_chart_json(
+                df, chart["chart_type"], chart["x_axis"], chart.get("y_axis"), chart.get("color_by"), chart.get("size_by")
+            )
+        if not fig:
+            raise ValueError("Chart could not be rendered from the spec.")
+        return dumps(fig)
+
+    def _refresh_one(self, spec: dict, stored_version: str, force: bool) -> tuple:
+        """Runs on the refresh pool: (status, version, payload or None)."""
+        df, version = self._source(spec)
+        if version == stored_version and not force:
+            return "unchanged", version, None
+        return "refreshed", version, self._render(spec, df)
+
+    # --- Pins ---
+    def pin(self, db: Session, session_id: str, title: str, chart_type: str, config: dict = None, spec: dict = None) -> PinnedChart:
+        pin = PinnedChart(session_id=session_id, title=title, chart_type=chart_type, timestamp=datetime.now().isoformat())
+        if spec:
+            # A live pin may only read its own session's dataset or database
+            if spec.get("session_id", session_id) != session_id:
+                raise ValueError("spec.session_id must be the session the pin belongs to")
+            spec = {**spec, "session_id": session_id}
+            validate_spec(spec)
+            # Render once now so a bad spec fails here and not on the dashboard
+            df, version = self._source(spec)
+            data = self._render(spec, df)
+            pin.spec = json.dumps(spec)
+            pin.source_version = version
+            pin.refreshed_at = pin.timestamp
+            pin.size_bytes = len(data)
+        else:
+            pin.chart_blob, pin.size_bytes = compress_config(config or {})
+        db.add(pin)
+        db.commit()
+        if spec:
+            self._store((pin.id, pin.source_version), data)
+        return pin
+
+    def delete(self, db: Session, pin_id: int):
+        db.query(PinnedChart).filter(PinnedChart.id == pin_id).delete()
+        db.commit()
+        self._evict(pin_id)
+
+    def list_pins(self, db: Session, session_id: str, offset: int = 0, limit: int = None) -> dict:
+        """One page of pin metadata; chart payloads are left out (see payload())."""
+        limit = min(limit or settings.DASHBOARD_PAGE_SIZE, settings.DASHBOARD_MAX_PAGE_SIZE)
+        base = db.query(PinnedChart).filter(PinnedChart.session_id == session_id)
+        rows = (
+            db.query(PinnedChart.id, PinnedChart.title, PinnedChart.chart_type, PinnedChart.timestamp,
+                     PinnedChart.size_bytes, PinnedChart.source_version, PinnedChart.refreshed_at,
+                     PinnedChart.spec.isnot(None).label("live"))
+            .filter(PinnedChart.session_id == session_id)
+            .order_by(PinnedChart.id)
+            .offset(offset).limit(limit).all()
+        )
+        items = [
+            {"id": r.id, "title": r.title, "chart_type": r.chart_type, "timestamp": r.timestamp,
+             "size_bytes": r.size_bytes, "live": bool(r.live), "refreshed_at": r.refreshed_at,
+             "etag": etag(r.id, r.source_version or r.timestamp)}
+            for r in rows
+        ]
+        inline = [item for item in items if item["chart_type"] in INLINE_TYPES]
+        if inline:
+            pins = db.query(PinnedChart).filter(PinnedChart.id.in_([item["id"] for item in inline])).all()
+            configs = {p.id: json.loads(config_json(p)) for p in pins}
+            for item in inline:
+                item["chart_config"] = configs.get(item["id"], {})
+        return {"total": base.count(), "offset": offset, "limit": limit, "items": items}
+
+    def payload(self, db: Session, session_id: str, pin_id: int):
+        """Returns (JSON bytes, etag) of a pin's chart config, or None if the session has no such pin."""
+        row = (
+            db.query(PinnedChart.timestamp, PinnedChart.spec, PinnedChart.source_version)
+            .filter(PinnedChart.id == pin_id, PinnedChart.session_id == session_id)
+            .first()
+        )
+        if row is None:
+            return None
+        version = row.source_version or row.timestamp
+        data = self._cached((pin_id, version))
+        if data is not None:
+            return data, etag(pin_id, version)
+        if row.spec is None:
+            data = config_json(db.query(PinnedChart).filter(PinnedChart.id == pin_id).first())
+        else:
+            # Not cached (restart or eviction): render from the current source
+            spec = json.loads(row.spec)
+            df, version = self._source(spec)
+            data = self._render(spec, df)
+            if version != row.source_version:
+                self._record_refresh(db, pin_id, version, len(data))
+                db.commit()
+        self._store((pin_id, version), data)
+        return data, etag(pin_id, version)
+
+    def _record_refresh(self, db: Session, pin_id: int, version: str, size: int):
+        db.query(PinnedChart).filter(PinnedChart.id == pin_id).update(
+            {"source_version": version, "refreshed_at": datetime.now().isoformat(), "size_bytes": size}
+        )
+        self._evict(pin_id)
+
+    def refresh(self, db: Session, session_id: str, force: bool = False) -> dict:
+        """
+        Re-renders the session's live pins in parallel. Pins whose source version has not
+        changed are skipped; pins sharing a dataset or query load it once.
+        """
+        start = time.perf_counter()
+        rows = (
+            db.query(PinnedChart.id, PinnedChart.spec, PinnedChart.source_version)
+            .filter(PinnedChart.session_id == session_id, PinnedChart.spec.isnot(None))
+            .all()
+        )
+        futures = {
+            row.id: self._refresh_pool.submit(
+                contextvars.copy_context().run, self._refresh_one, json.loads(row.spec), row.source_version, force
+            )
+            for row in rows
+        }
+        result = {"refreshed": [], "unchanged": [], "failed": {}}
+        for pin_id, future in futures.items():
+            try:
+                status, version, data = future.result()
+            except Exception as e:
+                result["failed"][pin_id] = str(e)
+                PIN_REFRESH.inc(result="failed")
+                continue
+            if status == "refreshed":
+                self._record_refresh(db, pin_id, version, len(data))
+                self._store((pin_id, version), data)
+            result[status].append(pin_id)
+            PIN_REFRESH.inc(result=status)
+        db.commit()
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        print(f"Dashboard refresh {session_id}: {len(result['refreshed'])} refreshed, "
+              f"{len(result['unchanged'])} unchanged, {len(result['failed'])} failed in {result['seconds']}s")
+        return result
+
+    def load_pins(self, db: Session, session_id: str) -> list:
+        """All pins of a session with decoded configs (report generation)."""
+        pins = []
+        for pin in db.query(PinnedChart).filter(PinnedChart.session_id == session_id).order_by(PinnedChart.id).all():
+            version = pin.source_version or pin.timestamp
+            try:
+                if pin.spec is not None:
+                    data, tag = self.payload(db, session_id, pin.id)
+                    config, version = json.loads(data), tag.strip('"')
+                else:
+                    config = json.loads(config_json(pin))
+            except Exception as e:
+                print(f"Pin {pin.id} could not be loaded for the report: {e}")
+                config = {}
+            pins.append({"id": pin.id, "title": pin.title, "chart_type": pin.chart_type,
+                         "chart_config": config, "version": version})
+        return pins
+
+
+dashboard_service = DashboardService(settings.DASHBOARD_CACHE_MB * 1024 * 1024)
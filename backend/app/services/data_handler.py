@@ -3,11 +3,15 @@ import numpy as np
 import os
 import uuid
 from app.config import settings
+from app.services.telemetry import timed, timed_stage
+from app.services.state_store import state, activity, STATE_REBUILDS
+from datetime import datetime
 
 class DataHandler:
     def __init__(self):
         self.upload_dir = settings.UPLOAD_DIR
 
+    @timed_stage("clean_data")
     def clean_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """Replicates the clean_data logic from GemChat.py"""
         df_cleaned = df.dropna(axis=1, how='all')
@@ -15,31 +19,105 @@ class DataHandler:
         df_cleaned = df_cleaned.dropna(axis=1, thresh=threshold)
         return df_cleaned
 
+    @timed_stage("upload_save")
     def save_uploaded_file(self, file, filename) -> str:
         session_id = str(uuid.uuid4())
         file_path = os.path.join(self.upload_dir, f"{session_id}_{filename}")
         
         with open(file_path, "wb") as f:
             f.write(file.read())
+
+        # Publish to the shared store so any worker can serve this session
+        artifact = f"uploads/{os.path.basename(file_path)}"
+        state.put_artifact(artifact, file_path)
+        state.set("sessions", session_id, {
+            "kind": "csv", "filename": filename, "artifact": artifact, "created_at": datetime.now().isoformat(),
+        })
             
         return session_id, file_path
 
-    def load_dataset(self, session_id: str) -> pd.DataFrame:
-        """Finds and loads a dataframe based on session ID"""
+    @timed_stage("dataset_lookup")
+    def dataset_path(self, session_id: str) -> str:
+        # Marks the session as in use for the janitor (app/services/janitor.py)
+        activity.touch(session_id)
+        record = state.get("sessions", session_id)
+        if record and record.get("artifact"):
+            # The registry names the file, so no directory scan is needed
+            path = os.path.join(self.upload_dir, os.path.basename(record["artifact"]))
+            if os.path.exists(path):
+                return path
+            # Uploaded through another worker (or evicted locally): fetch it from the shared store
+            if state.sync_artifact(record["artifact"], path):
+                STATE_REBUILDS.inc(kind="dataset")
+                return path
+        # Uploads from before the session registry existed
         for fname in os.listdir(self.upload_dir):
-            if fname.startswith(session_id):
-                file_path = os.path.join(self.upload_dir, fname)
-                if fname.endswith('.csv'):
-                    df = pd.read_csv(file_path)
-                elif fname.endswith('.xlsx'):
-                    df = pd.read_excel(file_path)
-                elif fname.endswith('.json'):
-                    df = pd.read_json(file_path)
-                else:
-                    raise ValueError("Unsupported file format")
-                return self.clean_data(df)
+            # .part files are fetches from the shared store still in progress
+            if fname.startswith(session_id) and not fname.endswith(".part"):
+                return os.path.join(self.upload_dir, fname)
         raise FileNotFoundError("Session expired or file not found")
 
+    def dataset_version(self, session_id: str) -> str:
+        """Cheap change marker for the session's file (mtime + size), for cache keys."""
+        stat = os.stat(self.dataset_path(session_id))
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def load_dataset(self, session_id: str) -> pd.DataFrame:
+        """Finds and loads a dataframe based on session ID"""
+        with timed("dataset_load"):
+            return self._load_dataset(session_id)
+
+    def _load_dataset(self, session_id: str) -> pd.DataFrame:
+        file_path = self.dataset_path(session_id)
+        fname = os.path.basename(file_path)
+        with timed("dataset_parse"):
+            if fname.endswith('.csv'):
+                df = pd.read_csv(file_path)
+            elif fname.endswith('.xlsx'):
+                df = pd.read_excel(file_path)
+            elif fname.endswith('.json'):
+                df = pd.read_json(file_path)
+            elif fname.endswith('.parquet'):
+                df = pd.read_parquet(file_path)
+            else:
+                raise ValueError("Unsupported file format")
+        return self.clean_data(df)
+
+    @timed_stage("date_detection")
+    def date_columns(self, df: pd.DataFrame, sample: int = 500) -> list:
+        """
+        Datetime columns, plus text columns whose values (on a sample) mostly parse as
+        dates: read_csv leaves "2024-01-31" or "31/01/2024 10:00" as plain strings.
+        """
+        dates = []
+        for col in df.columns:
+            col_data = df[col]
+            if pd.api.types.is_datetime64_any_dtype(col_data):
+                dates.append(col)
+                continue
+            if not (pd.api.types.is_object_dtype(col_data) or pd.api.types.is_string_dtype(col_data)):
+                continue
+            values = col_data.dropna()
+            if values.empty:
+                continue
+            text = values.sample(min(sample, len(values)), random_state=0).astype(str)
+            # Numbers parse as dates too, and so do bare month names: require digits around a separator
+            if text.str.fullmatch(r"[+-]?\d+(\.\d+)?").mean() > 0.5:
+                continue
+            if text.str.contains(r"\d[-/.:\s]\d|\d[-/.\s][A-Za-z]").mean() < 0.95:
+                continue
+            parsed = pd.to_datetime(text, errors="coerce", format="mixed")
+            if parsed.notna().mean() >= 0.95:
+                dates.append(col)
+        return dates
+
+    def set_date_columns(self, session_id: str, date_cols: list):
+        """Records the detected date columns with the session, for the rollup builder."""
+        record = state.get("sessions", session_id)
+        if record is not None:
+            state.set("sessions", session_id, {**record, "date_cols": date_cols})
+
+    @timed_stage("column_details")
     def get_column_details(self, df: pd.DataFrame):
         """Replicates create_column_helper logic"""
         details = []
@@ -0,0 +1,116 @@
+"""
+Content-addressed cache in front of the embedding model.
+
+Document vectors are stored on disk (SQLite) keyed by (model name, sha256 of the chunk
+text), so re-indexing a revised document only embeds the chunks that changed.
+Query vectors are kept in a small in-memory LRU since users tend to repeat questions.
+"""
+from langchain_core.embeddings import Embeddings
+from app.services.telemetry import REGISTRY
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+EMBED_CACHE_HITS = REGISTRY.counter("embedding_cache_hits_total", "Embeddings served from cache", ["kind"])
+EMBED_CACHE_MISSES = REGISTRY.counter("embedding_cache_misses_total", "Embeddings computed by the model", ["kind"])
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """On-disk (model, text hash) -> float32 vector table."""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, model: str, hashes: list) -> dict:
+        found = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, items: dict):
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()],
+            )
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps any LangChain Embeddings; drop-in for Chroma's embedding_function."""
+
+    def __init__(self, inner: Embeddings, store: EmbeddingStore, query_cache_size: int = 1024):
+        self.inner = inner
+        self.store = store
+        self.model_name = getattr(inner, "model_name", None) or type(inner).__name__
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list) -> list:
+        hashes = [text_hash(t) for t in texts]
+        cached = self.store.get_many(self.model_name, list(set(hashes)))
+
+        # Embed each distinct missing text once, even if it repeats within the batch
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        if missing:
+            vectors = self.inner.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.store.put_many(self.model_name, fresh)
+            cached.update(fresh)
+
+        EMBED_CACHE_HITS.inc(len(texts) - len(missing), kind="document")
+        EMBED_CACHE_MISSES.inc(len(missing), kind="document")
+        return [list(cached[h]) for h in hashes]
+
+    def embed_query(self, text: str) -> list:
+        key = text_hash(text)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                EMBED_CACHE_HITS.inc(kind="query")
+                return list(vector)
+
+        vector = self.inner.embed_query(text)
+        EMBED_CACHE_MISSES.inc(kind="query")
+        with self._lock:
+            self._queries[key] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return list(vector)
@@ -0,0 +1,353 @@
+"""
+Disk janitor: deletes what sessions leave behind on local disk once it expires, and
+keeps the total under a quota.
+
+Artifact kinds and their TTLs (JANITOR_*_TTL_HOURS):
+    uploads    uploaded datasets in temp_uploads, and their copies in the shared store
+    exports    Arrow exports of datasets for the sandbox, Parquet copies for the SQL
+               engine and time-series rollups (all recreated on demand)
+    documents  raw RAG documents in temp_docs (only needed while they are ingested)
+    vectors    Chroma collections, quantized indexes and BM25 keyword indexes
+
+Everything is grouped by session and aged by the session's last access, as recorded
+in the shared state store by any worker (file mtimes for sessions from before that).
+Sessions accessed within JANITOR_IN_USE_MINUTES, or leased by a running ingest, are
+never touched. Over quota, whole sessions are evicted least recently used first.
+"""
+from collections import namedtuple
+from app.config import settings
+from app.services.telemetry import REGISTRY
+from app.services.state_store import state, activity, SQLiteStateBackend
+from app.services.rag_service import rag_service, collection_name, CHROMA_DIR, INDEX_DIR, KEYWORD_DIR, DOCS_DIR
+from app.services.sandbox import ARROW_DIR
+from app.services.sql_engine import SQL_DIR
+from app.services.timeseries import ROLLUP_DIR
+import os
+import re
+import shutil
+import threading
+import time
+
+JANITOR_RECLAIMED = REGISTRY.counter("janitor_bytes_reclaimed_total", "Bytes deleted by the disk janitor", ["kind", "reason"])
+JANITOR_DELETED = REGISTRY.counter("janitor_artifacts_deleted_total", "Artifacts deleted by the disk janitor", ["kind", "reason"])
+JANITOR_FOOTPRINT = REGISTRY.gauge("janitor_footprint_bytes", "Local disk used by session artifacts, as of the last sweep", ["kind"])
+JANITOR_IN_USE = REGISTRY.gauge("janitor_sessions_in_use", "Sessions skipped by the last sweep because they are in use")
+JANITOR_RUN_SECONDS = REGISTRY.histogram("janitor_run_seconds", "Duration of a janitor sweep")
+
+KINDS = ("uploads", "exports", "documents", "vectors")
+UUID_PREFIX = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+# Over quota, evict down to this fraction of it so the next upload does not trigger another round
+LOW_WATERMARK = 0.9
+
+# key: the session's collection_name (or "file:<path>" for files no session owns);
+# on_disk: counts toward the local footprint (shared-store copies in Redis do not)
+Artifact = namedtuple("Artifact", ["kind", "key", "session_id", "label", "size", "mtime", "on_disk", "remove"])
+
+
+def _path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # removed while we walked
+    return total
+
+
+def _remove_path(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _entries(path: str) -> list:
+    try:
+        return list(os.scandir(path))
+    except FileNotFoundError:
+        return []
+
+
+def _upload_session(filename: str):
+    match = UUID_PREFIX.match(filename)
+    return match.group(0) if match else None
+
+
+def _owned_by(session_id: str) -> tuple:
+    return session_id, collection_name(session_id) if session_id else None
+
+
+class Janitor:
+    def __init__(self, interval: float = 900, quota_bytes: int = 0, in_use_seconds: float = 1800, ttls: dict = None):
+        self.interval = interval
+        self.quota_bytes = quota_bytes
+        self.in_use_seconds = in_use_seconds
+        self.ttls = ttls or {}  # kind -> seconds; missing or 0 = never expires
+        self.last_report = None
+        self._sessions = {}  # collection_name -> session ids, refreshed every sweep
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+
+    # --- Background thread ---
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            # Every worker runs a janitor; a short shared lease keeps them from sweeping
+            # at the same time (a lost race only means a redundant sweep)
+            if state.get("janitor", "lease"):
+                continue
+            state.set("janitor", "lease", os.getpid(), ttl=self.interval / 2)
+            try:
+                self.run()
+            except Exception as e:
+                print(f"Janitor sweep failed: {e}")
+
+    # --- Scan ---
+    def _drop_vectors(self, key: str, path: str = None):
+        # Open handles and cached retrievals go first, so nothing keeps reading deleted files
+        rag_service.drop_collection(key, self._sessions_of(key))
+        if path:
+            _remove_path(path)
+
+    def _file_artifacts(self, kind: str, directory: str, key_of, suffix: str = None, files_only: bool = False) -> list:
+        """key_of(entry name) -> (session_id or None, group key or None)."""
+        found = []
+        for entry in _entries(directory):
+            if (suffix and not entry.name.endswith(suffix)) or (files_only and not entry.is_file()):
+                continue
+            session_id, key = key_of(entry.name)
+            path = entry.path
+            if kind == "vectors":
+                remove = lambda k=key, p=path: self._drop_vectors(k, p)
+            else:
+                remove = lambda p=path: _remove_path(p)
+            found.append(Artifact(kind, key or f"file:{path}", session_id, path, _path_size(path),
+                                  entry.stat().st_mtime, True, remove))
+        return found
+
+    def _shared_artifacts(self) -> list:
+        found = []
+        on_disk = isinstance(state, SQLiteStateBackend)
+        for name in state.keys("artifacts"):
+            info = state.artifact_info(name) or {}
+            folder, _, base = name.partition("/")
+            if folder == "uploads":
+                kind, (session_id, key) = "uploads", _owned_by(_upload_session(base))
+            elif folder == "keyword_index":
+                kind, session_id, key = "vectors", None, base[:-len(".json")]
+            else:
+                continue
+            size = info.get("size", 0)
+            if on_disk:
+                try:
+                    # Usually a hard link to the local copy, which is already counted
+                    if os.stat(state._artifact_path(name)).st_nlink > 1:
+                        size = 0
+                except (OSError, ValueError):
+                    continue
+            found.append(Artifact(kind, key or f"file:{name}", session_id, f"state:{name}", size,
+                                  info.get("stored_at", 0), on_disk, lambda n=name: state.delete_artifact(n)))
+        return found
+
+    def _chroma_artifacts(self) -> list:
+        if rag_service.backend != "chroma":
+            return []
+        on_disk = not settings.RAG_CHROMA_URL
+        if on_disk and not os.path.isdir(CHROMA_DIR):
+            return []
+        found, legacy_bytes = [], 0
+        if on_disk:
+            for entry in _entries(CHROMA_DIR):
+                # Pre-shared-client sessions had their own persist directory
+                if entry.is_dir() and os.path.exists(os.path.join(entry.path, "chroma.sqlite3")):
+                    size = _path_size(entry.path)
+                    legacy_bytes += size
+                    key = collection_name(entry.name)
+                    found.append(Artifact("vectors", key, entry.name, entry.path, size, entry.stat().st_mtime, True,
+                                          lambda k=key, p=entry.path: self._drop_vectors(k, p)))
+
+        counts = {}
+        for collection in rag_service.client.list_collections():
+            name = getattr(collection, "name", collection)
+            if name.startswith("session_"):
+                try:
+                    counts[name] = rag_service.client.get_collection(name).count()
+                except Exception:
+                    counts[name] = 0
+        # Collections share one database, so their size is estimated from their share of its records
+        shared_bytes = max(0, _path_size(CHROMA_DIR) - legacy_bytes) if on_disk else 0
+        total = sum(counts.values())
+        for name, count in counts.items():
+            size = int(shared_bytes * count / total) if total else 0
+            found.append(Artifact("vectors", name, None, f"chroma:{name}", size, 0, on_disk,
+                                  lambda n=name: self._drop_vectors(n)))
+        return found
+
+    def scan(self) -> list:
+        artifacts = []
+        # files_only: the export directories (arrow, duckdb, rollups) live inside the upload directory
+        artifacts += self._file_artifacts(
+            "uploads", settings.UPLOAD_DIR, lambda f: _owned_by(_upload_session(f)), files_only=True)
+        artifacts += self._file_artifacts("exports", ARROW_DIR, lambda f: _owned_by(f.rsplit("_", 1)[0]))
+        artifacts += self._file_artifacts("exports", SQL_DIR, lambda f: _owned_by(f.rsplit("_", 1)[0]))
+        artifacts += self._file_artifacts("exports", ROLLUP_DIR, lambda f: _owned_by(f.rsplit("_", 1)[0]))
+        # Per-session directories; loose files are from before documents were kept per session
+        artifacts += self._file_artifacts(
+            "documents", DOCS_DIR, lambda f: (None, f if f.startswith("session_") else None))
+        artifacts += self._file_artifacts("vectors", INDEX_DIR, lambda f: (None, f))
+        artifacts += self._file_artifacts("vectors", KEYWORD_DIR, lambda f: (None, f[:-len(".json")]), suffix=".json")
+        artifacts += self._shared_artifacts()
+        artifacts += self._chroma_artifacts()
+        return artifacts
+
+    def _known_sessions(self) -> dict:
+        """collection_name -> session ids, from every place that records sessions."""
+        names = {}
+        for sid in set(activity.sessions()) | set(state.keys("sessions")) | set(rag_service.known_sessions()):
+            names.setdefault(collection_name(sid), set()).add(sid)
+        return names
+
+    def _sessions_of(self, key: str) -> set:
+        return self._sessions.get(key, set())
+
+    # --- Sweep ---
+    def run(self) -> dict:
+        """One sweep: TTL expiry, then quota eviction. Returns a report (also kept as last_report)."""
+        with self._run_lock:
+            start = time.time()
+            self._sessions = self._known_sessions()
+            artifacts = self.scan()
+
+            groups = {}
+            for a in artifacts:
+                groups.setdefault(a.key, []).append(a)
+                if a.session_id:
+                    self._sessions.setdefault(a.key, set()).add(a.session_id)
+
+            now = time.time()
+            last_access, in_use = {}, set()
+            for key, items in groups.items():
+                sids = self._sessions_of(key)
+                recorded = max([activity.last_access(sid) for sid in sids] + [0])
+                last = max([recorded] + [a.mtime for a in items])
+                if not last:
+                    # Nothing dates it (e.g. a Chroma collection from before access tracking):
+                    # start its clock now rather than treating it as infinitely old
+                    last = state.get("janitor_seen", key)
+                    if last is None:
+                        last = now
+                        state.set("janitor_seen", key, now)
+                last_access[key] = last
+                if any(activity.leased(sid) for sid in sids) or now - last < self.in_use_seconds:
+                    in_use.add(key)
+
+            reclaimed = {kind: 0 for kind in KINDS}
+            removed = []
+
+            def delete(a, reason):
+                try:
+                    a.remove()
+                except Exception as e:
+                    print(f"Janitor could not delete {a.label}: {e}")
+                    return
+                reclaimed[a.kind] += a.size
+                JANITOR_RECLAIMED.inc(a.size, kind=a.kind, reason=reason)
+                JANITOR_DELETED.inc(kind=a.kind, reason=reason)
+                removed.append(a)
+
+            # 1. TTLs, per artifact
+            for key, items in groups.items():
+                if key in in_use:
+                    continue
+                age = now - last_access[key]
+                for a in items:
+                    ttl = self.ttls.get(a.kind)
+                    if ttl and age > ttl:
+                        delete(a, "ttl")
+
+            # 2. Quota, whole sessions, least recently used first
+            gone = {id(a) for a in removed}
+            remaining = [a for a in artifacts if id(a) not in gone]
+            footprint = sum(a.size for a in remaining if a.on_disk)
+            evicted = 0
+            if self.quota_bytes and footprint > self.quota_bytes:
+                target = self.quota_bytes * LOW_WATERMARK
+                for key in sorted(groups, key=lambda k: last_access[k]):
+                    if footprint <= target:
+                        break
+                    if key in in_use:
+                        continue
+                    items = [a for a in groups[key] if id(a) not in gone]
+                    if not items:
+                        continue
+                    for a in items:
+                        delete(a, "quota")
+                        gone.add(id(a))
+                        if a.on_disk:
+                            footprint -= a.size
+                    evicted += 1
+                remaining = [a for a in artifacts if id(a) not in gone]
+
+            # Sessions with nothing left on disk are forgotten everywhere
+            left = {a.key for a in remaining}
+            for key in {a.key for a in removed} - left:
+                for sid in self._sessions_of(key):
+                    activity.forget(sid)
+                    state.delete("sessions", sid)
+                state.delete("janitor_seen", key)
+
+            footprint_by_kind = {kind: 0 for kind in KINDS}
+            for a in remaining:
+                if a.on_disk:
+                    footprint_by_kind[a.kind] += a.size
+            for kind, size in footprint_by_kind.items():
+                JANITOR_FOOTPRINT.set(size, kind=kind)
+            JANITOR_IN_USE.set(len(in_use))
+            JANITOR_RUN_SECONDS.observe(time.time() - start)
+
+            self.last_report = {
+                "finished_at": time.time(),
+                "seconds": round(time.time() - start, 3),
+                "deleted": len(removed),
+                "sessions_evicted": evicted,
+                "sessions_in_use": len(in_use),
+                "bytes_reclaimed": reclaimed,
+                "footprint_bytes": footprint_by_kind,
+                "quota_bytes": self.quota_bytes,
+            }
+            if removed:
+                print(f"Janitor: deleted {len(removed)} artifacts, reclaimed {sum(reclaimed.values()) / 1e6:.1f} MB "
+                      f"({evicted} sessions evicted over quota)")
+            return self.last_report
+
+
+janitor = Janitor(
+    interval=settings.JANITOR_INTERVAL_SECONDS,
+    quota_bytes=int(settings.JANITOR_DISK_QUOTA_GB * 1024 ** 3),
+    in_use_seconds=settings.JANITOR_IN_USE_MINUTES * 60,
+    ttls={
+        "uploads": settings.JANITOR_UPLOAD_TTL_HOURS * 3600,
+        "exports": settings.JANITOR_EXPORT_TTL_HOURS * 3600,
+        "documents": settings.JANITOR_DOCUMENT_TTL_HOURS * 3600,
+        "vectors": settings.JANITOR_VECTOR_TTL_HOURS * 3600,
+    },
+)
@@ -0,0 +1,137 @@
+"""
+BM25 inverted index kept next to each session's vector store.
+
+Dense retrieval is weak on exact identifiers (clause 4.2.1, SKU-1043, EBITDA); a keyword
+index catches those. Postings are updated incrementally as chunks are added or removed
+and persisted as one JSON file per session.
+"""
+from collections import defaultdict
+import json
+import math
+import os
+import re
+import threading
+
+# Keeps dotted/hyphenated identifiers (4.2.1, sku-1043, v2.0) together as one token
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[./_-][a-z0-9]+)*")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "were", "what", "which", "with",
+}
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        # Also index the parts so "SKU 1043" still matches "SKU-1043". Dotted tokens
+        # (clause 12.3, v2.0) stay whole: "12" and "3" on their own are noise.
+        parts = re.split(r"[/_-]", token)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p and p not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {chunk_id: term frequency}
+        self.lengths = {}                  # chunk_id -> token count
+        self._total_length = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(path)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _load(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        self.postings = defaultdict(dict, data["postings"])
+        self.lengths = data["lengths"]
+        self._total_length = sum(self.lengths.values())
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            payload = {"postings": self.postings, "lengths": self.lengths}
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(payload, f)
+            os.replace(tmp, self.path)
+
+    def add(self, ids: list, texts: list):
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                if chunk_id in self.lengths:
+                    self._remove(chunk_id)
+                tokens = tokenize(text)
+                counts = defaultdict(int)
+                for token in tokens:
+                    counts[token] += 1
+                for token, tf in counts.items():
+                    self.postings[token][chunk_id] = tf
+                self.lengths[chunk_id] = len(tokens)
+                self._total_length += len(tokens)
+
+    def _remove(self, chunk_id: str):
+        # Postings are not indexed by chunk, so a removal scans the vocabulary;
+        # fine for per-session corpora and removals only happen on re-index
+        for term in list(self.postings):
+            docs = self.postings[term]
+            if docs.pop(chunk_id, None) is not None and not docs:
+                del self.postings[term]
+        self._total_length -= self.lengths.pop(chunk_id, 0)
+
+    def remove(self, ids: list):
+        ids = set(ids) & set(self.lengths)
+        if not ids:
+            return
+        with self._lock:
+            for term in list(self.postings):
+                docs = self.postings[term]
+                for chunk_id in ids & docs.keys():
+                    del docs[chunk_id]
+                if not docs:
+                    del self.postings[term]
+            for chunk_id in ids:
+                self._total_length -= self.lengths.pop(chunk_id, 0)
+
+    def search(self, query: str, k: int = 10) -> list:
+        """Returns [(chunk_id, score)] best first."""
+        with self._lock:
+            n = len(self.lengths)
+            if not n:
+                return []
+            avg_len = self._total_length / n or 1
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for chunk_id, tf in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / avg_len)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int, c: int = 60) -> list:
+    """Fuses several best-first id lists; c=60 is the constant from the original RRF paper."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] += 1 / (c + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
@@ -0,0 +1,349 @@
+"""
+Admission control in front of the chat model.
+
+- Single-flight: identical in-flight prompts share one upstream call.
+- Fair queuing: a global concurrency cap, granted round-robin across sessions,
+  with a per-session in-flight limit.
+- Token bucket: requests-per-minute limit matching the provider quota.
+"""
+from langchain_core.language_models.chat_models import BaseChatModel
+from app.config import settings
+from app.services.telemetry import REGISTRY, current_trace
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+import contextvars
+import hashlib
+import json
+import threading
+import time
+
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("llm_gateway_queue_wait_seconds", "Time an LLM call waited for admission", ["reason"])
+QUEUE_DEPTH = REGISTRY.gauge("llm_gateway_queue_depth", "LLM calls waiting for admission")
+INFLIGHT = REGISTRY.gauge("llm_gateway_inflight", "LLM calls currently running upstream")
+COALESCED = REGISTRY.counter("llm_gateway_coalesced_total", "LLM calls served by an identical in-flight call")
+ADMITTED = REGISTRY.counter("llm_gateway_admitted_total", "LLM calls admitted upstream")
+
+_current_session: ContextVar = ContextVar("llm_session", default="anonymous")
+
+
+class _Abandoned(Exception):
+    """The upstream call was cancelled before it finished; followers retry it themselves."""
+
+
+class _Flight:
+    """One upstream call that identical concurrent callers can wait on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.chunks = []
+        self.subscribers = 1  # the leader; join() counts followers, follow() releases on exit
+        self._cond = threading.Condition()
+
+    def push(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, result):
+        with self._cond:
+            self.result = result
+            self.done.set()
+            self._cond.notify_all()
+
+    def fail(self, error):
+        with self._cond:
+            self.error = error
+            self.done.set()
+            self._cond.notify_all()
+
+    def abandon(self):
+        with self._cond:
+            self.abandoned = True
+            self.done.set()
+            self._cond.notify_all()
+
+    def wait(self):
+        self.done.wait()
+        if self.abandoned:
+            raise _Abandoned()
+        if self.error is not None:
+            raise self.error
+        # Each subscriber gets its own copy: callbacks and parsers may mutate the message
+        return self.result.model_copy(deep=True)
+
+    def follow(self):
+        """Yields the stream chunks as they arrive, so every subscriber streams."""
+        i = 0
+        try:
+            while True:
+                with self._cond:
+                    while i >= len(self.chunks) and not self.done.is_set():
+                        self._cond.wait()
+                    pending = self.chunks[i:]
+                    finished = self.done.is_set()
+                for chunk in pending:
+                    yield chunk.model_copy(deep=True)
+                i += len(pending)
+                if finished and i >= len(self.chunks):
+                    break
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+        if self.abandoned:
+            raise _Abandoned()
+        if self.error is not None:
+            raise self.error
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int, per_session: int, rate_per_minute: float, burst: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_session = max(1, per_session)
+        self.rate_per_sec = rate_per_minute / 60 if rate_per_minute > 0 else 0
+        self.burst = max(1, burst)
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_session = {}
+        self._waiting = {}          # session -> deque of tickets
+        self._round_robin = deque() # sessions with waiting tickets, in service order
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    # --- Session context ---
+    @contextmanager
+    def session(self, session_id: str):
+        """Attributes LLM calls made inside the block to session_id for fair queuing."""
+        token = _current_session.set(session_id or "anonymous")
+        try:
+            yield
+        finally:
+            _current_session.reset(token)
+
+    # --- Token bucket ---
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate_per_sec:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate_per_sec)
+        self._last_refill = now
+
+    def _token_wait(self) -> float:
+        if not self.rate_per_sec or self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate_per_sec
+
+    # --- Fair admission ---
+    def _next_ticket(self):
+        """Head ticket of the first session (in round-robin order) that is under its in-flight limit."""
+        for session in self._round_robin:
+            if self._active_by_session.get(session, 0) < self.per_session:
+                return session, self._waiting[session][0]
+        return None, None
+
+    def _grant(self, session):
+        self._waiting[session].popleft()
+        self._round_robin.remove(session)
+        if self._waiting[session]:
+            self._round_robin.append(session)
+        else:
+            del self._waiting[session]
+        self._active += 1
+        self._active_by_session[session] = self._active_by_session.get(session, 0) + 1
+        if self.rate_per_sec:
+            self._tokens -= 1
+
+    @contextmanager
+    def slot(self):
+        session = _current_session.get()
+        ticket = object()
+        start = time.perf_counter()
+        throttled = False
+
+        with self._cond:
+            if session not in self._waiting:
+                self._waiting[session] = deque()
+                self._round_robin.append(session)
+            self._waiting[session].append(ticket)
+            QUEUE_DEPTH.inc()
+            while True:
+                self._refill()
+                _, head = self._next_ticket()
+                if self._active < self.max_concurrency and head is ticket:
+                    wait = self._token_wait()
+                    if wait == 0:
+                        self._grant(session)
+                        # The next ticket may be admissible right away (spare slots and tokens)
+                        self._cond.notify_all()
+                        break
+                    throttled = True
+                    self._cond.wait(timeout=wait)
+                else:
+                    self._cond.wait(timeout=1.0)
+            QUEUE_DEPTH.dec()
+
+        waited = time.perf_counter() - start
+        QUEUE_WAIT_SECONDS.observe(waited, reason="rate_limit" if throttled else "concurrency")
+        ADMITTED.inc()
+        INFLIGHT.inc()
+        trace = current_trace()
+        if trace is not None and waited > 0.001:
+            trace.add_span("queue", "llm_gateway", waited, throttled=throttled)
+
+        try:
+            yield
+        finally:
+            INFLIGHT.dec()
+            with self._cond:
+                self._active -= 1
+                self._active_by_session[session] -= 1
+                if not self._active_by_session[session]:
+                    del self._active_by_session[session]
+                self._cond.notify_all()
+
+    # --- Single-flight ---
+    def join(self, key: str):
+        """Returns (flight, is_leader). Followers should wait on the flight instead of calling upstream."""
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                COALESCED.inc()
+                with flight._cond:
+                    flight.subscribers += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def leave(self, key: str, flight: _Flight):
+        """Stops new callers from joining flight (a newer flight for the same key stays)."""
+        with self._flights_lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def prompt_key(self, model, mode, messages, stop, kwargs) -> str:
+        """mode ("generate"/"stream") is part of the key: the two calls share results of different shapes."""
+        payload = json.dumps({
+            "model": model,
+            "mode": mode,
+            "messages": [[m.type, m.content] for m in messages],
+            "stop": stop,
+            "kwargs": {k: repr(v) for k, v in sorted(kwargs.items())},
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": sum(len(q) for q in self._waiting.values()),
+                "waiting_sessions": len(self._waiting),
+                "tokens": round(self._tokens, 2),
+                "inflight_prompts": len(self._flights),
+            }
+
+    def wrap(self, llm):
+        if llm is None:
+            return None
+        return GatewayChatModel(inner=llm, gateway=self, streaming=bool(getattr(llm, "streaming", False)))
+
+
+class GatewayChatModel(BaseChatModel):
+    """Chat model wrapper that routes every upstream call through an LLMGateway."""
+    inner: Any
+    gateway: Any
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gateway-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.inner._identifying_params
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        # Report the wrapped model's name to callbacks/tracing
+        return self.inner._get_ls_params(stop=stop, **kwargs)
+
+    def _key(self, mode, messages, stop, kwargs) -> str:
+        return self.gateway.prompt_key(self.inner._llm_type, mode, messages, stop, kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self._key("generate", messages, stop, kwargs)
+        flight, leader = self.gateway.join(key)
+        if not leader:
+            try:
+                return flight.wait()
+            except _Abandoned:
+                # The leader was cancelled (e.g. interrupted): make the call ourselves
+                return self._generate(messages, stop=stop, **kwargs)
+        try:
+            with self.gateway.slot():
+                result = self.inner._generate(messages, stop=stop, **kwargs)
+            flight.finish(result)
+            return result
+        except Exception as e:
+            flight.fail(e)
+            raise
+        except BaseException:
+            # Not an error of the call itself, so followers should not inherit it
+            self.gateway.leave(key, flight)
+            flight.abandon()
+            raise
+        finally:
+            self.gateway.leave(key, flight)
+
+    def _pump(self, flight: _Flight, key: str, messages, stop, kwargs):
+        """Runs the upstream stream into the flight; stops early once nobody is listening."""
+        try:
+            with self.gateway.slot():
+                for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+                    flight.push(chunk)
+                    if flight.subscribers <= 0:
+                        self.gateway.leave(key, flight)
+                        flight.abandon()
+                        return
+            flight.finish(flight.chunks)
+        except Exception as e:
+            flight.fail(e)
+        except BaseException:
+            self.gateway.leave(key, flight)
+            flight.abandon()
+            raise
+        finally:
+            self.gateway.leave(key, flight)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self._key("stream", messages, stop, kwargs)
+        flight, leader = self.gateway.join(key)
+        if leader:
+            # The upstream call runs on its own thread, so a leader whose client disconnects
+            # does not cut off the followers streaming the same answer. Same context: the
+            # session (fair queuing) and the request trace carry over.
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(self._pump, flight, key, messages, stop, kwargs),
+                             name="llm-stream", daemon=True).start()
+        # run_manager is not forwarded: BaseChatModel already emits on_llm_new_token per chunk
+        streamed = False
+        try:
+            for chunk in flight.follow():
+                streamed = True
+                yield chunk
+        except _Abandoned:
+            if streamed:
+                raise RuntimeError("The model call was cancelled mid-stream.")
+            yield from self._stream(messages, stop=stop, **kwargs)
+
+
+llm_gateway = LLMGateway(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    per_session=settings.LLM_MAX_INFLIGHT_PER_SESSION,
+    rate_per_minute=settings.LLM_RATE_LIMIT_RPM,
+    burst=settings.LLM_RATE_LIMIT_BURST,
+)
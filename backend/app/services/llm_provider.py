@@ -0,0 +1,174 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from app.config import settings
+import json
+import re
+import time
+
+
+# Scripted ReAct traces used by the fake provider when no FAKE_LLM_TRACES file is set.
+# A trace is picked by the first `match` regex found in the prompt; `turns` are replayed
+# one per agent step (the step is the number of Observations already in the scratchpad).
+DEFAULT_TRACES = [
+    {
+        "name": "suggestions",
+        "match": r"JSON array of strings",
+        "turns": ['["What is the average value per category?", "Which records are outliers?", "How has the total changed over time?"]']
+    },
+    {
+        "name": "sql_chart",
+        "match": r"sql_db_query[\s\S]*wants a visualization",
+        "turns": [
+            " I should list the tables first.\nAction: sql_db_list_tables\nAction Input: ",
+            'I now know the final answer.\nFinal Answer: {"chart_type": "bar", "x": ["A", "B", "C"], "y": [3, 2, 1], "title": "Rows per Group", "x_label": "Group", "y_label": "Rows"}'
+        ]
+    },
+    {
+        "name": "sql",
+        "match": r"sql_db_query",
+        "turns": [
+            " I should list the tables first.\nAction: sql_db_list_tables\nAction Input: ",
+            "I now know the final answer.\nFinal Answer: The database contains the tables listed above and is ready for analysis."
+        ]
+    },
+    {
+        "name": "pandas",
+        "match": r"python_repl_ast",
+        "turns": [
+            "Thought: I should check the size of the dataframe.\nAction: python_repl_ast\nAction Input: df.shape",
+            "Thought: I now know the final answer.\nFinal Answer: The dataset shape is shown above. The data looks complete and ready for deeper analysis."
+        ]
+    },
+    {
+        "name": "rag",
+        "match": r"Helpful Answer:",
+        "turns": ["Based on the provided context, the document covers the requested topic. The key points are summarised in the retrieved sections."]
+    },
+    {
+        "name": "fallback",
+        "match": r"",
+        "turns": ["Final Answer: No scripted response matched this prompt."]
+    },
+]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for Gemini. Replays scripted ReAct traces token by token
+    with a configurable latency, so the chat, SQL and RAG paths can be exercised offline.
+    """
+    traces: list = DEFAULT_TRACES
+    token_latency: float = 0.0
+    first_token_latency: float = 0.0
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def _prompt_text(self, messages) -> str:
+        return "\n".join(m.content if isinstance(m.content, str) else str(m.content) for m in messages)
+
+    def _pick_response(self, messages, stop=None) -> str:
+        text = self._prompt_text(messages)
+        trace = next((t for t in self.traces if re.search(t["match"], text)), None)
+        if trace is None:
+            return ""
+
+        # Agents append "Observation: ..." to the scratchpad after "Begin!" once per tool call
+        step = text.rsplit("Begin!", 1)[-1].count("Observation:")
+        response = trace["turns"][min(step, len(trace["turns"]) - 1)]
+
+        for s in stop or []:
+            if s in response:
+                response = response.split(s)[0]
+        return response
+
+    def _usage(self, messages, response: str) -> dict:
+        # Rough 4-chars-per-token estimate, good enough for metrics and budgets
+        input_tokens = len(self._prompt_text(messages)) // 4
+        output_tokens = len(response) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        response = self._pick_response(messages, stop)
+        time.sleep(self.first_token_latency + self.token_latency * len(_tokenize(response)))
+        message = AIMessage(content=response, usage_metadata=self._usage(messages, response))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        response = self._pick_response(messages, stop)
+        time.sleep(self.first_token_latency)
+        tokens = _tokenize(response)
+        for i, token in enumerate(tokens):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            usage = self._usage(messages, response) if i == len(tokens) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token, usage_metadata=usage))
+
+
+def _tokenize(text: str) -> list:
+    """Splits text into word-sized pseudo tokens, keeping whitespace attached."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+class LLMProvider:
+    """Base class for chat model providers. Subclasses return a LangChain chat model or None."""
+    name = "base"
+
+    def create_chat_model(self):
+        raise NotImplementedError
+
+    def create_embeddings(self):
+        """Embedding model for RAG. FastEmbed uses "BAAI/bge-small-en-v1.5" (ONNX, downloaded on first use)."""
+        from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+        return FastEmbedEmbeddings()
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def create_chat_model(self):
+        if not settings.GEMINI_API_KEY:
+            return None
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash",
+            google_api_key=settings.GEMINI_API_KEY,
+            temperature=0,
+            convert_system_message_to_human=True,
+            streaming=True
+        )
+
+
+class FakeProvider(LLMProvider):
+    name = "fake"
+
+    def create_chat_model(self):
+        traces = DEFAULT_TRACES
+        if settings.FAKE_LLM_TRACES:
+            with open(settings.FAKE_LLM_TRACES) as f:
+                traces = json.load(f)
+        return ScriptedChatModel(
+            traces=traces,
+            token_latency=settings.FAKE_LLM_TOKEN_LATENCY_MS / 1000,
+            first_token_latency=settings.FAKE_LLM_FIRST_TOKEN_MS / 1000
+        )
+
+    def create_embeddings(self):
+        # Hash-seeded vectors of bge-small's size: no model download, so RAG runs offline
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        return DeterministicFakeEmbedding(size=384)
+
+
+PROVIDERS = {
+    GeminiProvider.name: GeminiProvider,
+    FakeProvider.name: FakeProvider,
+}
+
+def get_llm_provider(name: str = None) -> LLMProvider:
+    name = (name or settings.LLM_PROVIDER).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{name}'. Available: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]()
@@ -0,0 +1,191 @@
+"""
+On-demand sampling profiler for single requests.
+
+A background thread snapshots every thread's Python stack (sys._current_frames) at a
+fixed interval while the request runs. Stacks are kept in "folded" form
+(frame;frame;frame count), which flamegraph.pl, speedscope and most other viewers
+read directly, and can be rendered here as a self-contained SVG flamegraph.
+
+All threads of the worker are sampled (the request's work may run on the event loop,
+the threadpool or agent threads), so concurrent requests show up too: profile on a
+quiet worker. Idle threads (waiting on a lock, queue or selector) are left out.
+"""
+from collections import Counter, OrderedDict
+from html import escape
+from app.config import settings
+from app.services.telemetry import REGISTRY
+import os
+import sys
+import threading
+import time
+
+PROFILES_TAKEN = REGISTRY.counter("profiles_taken_total", "Request sampling profiles captured")
+
+# Leaf frames that mean "this thread is waiting for work", not doing any
+IDLE_FRAMES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("connection.py", "_poll"),
+}
+
+
+def _short_path(path: str) -> str:
+    # "app/services/x.py" for our code, "pandas/core/frame.py" for libraries
+    index = path.rfind(os.sep + "app" + os.sep)
+    if index != -1:
+        return path[index + 1:]
+    index = path.rfind("site-packages" + os.sep)
+    if index != -1:
+        return path[index + len("site-packages" + os.sep):]
+    return os.path.basename(path)
+
+
+class Profile:
+    def __init__(self, profile_id: str, interval: float):
+        self.profile_id = profile_id
+        self.interval = interval
+        self.stacks = Counter()  # "thread;frame;...;frame" -> samples
+        self.samples = 0
+        self.started = time.time()
+        self.duration = 0.0
+        self.label = ""
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        return {
+            "profile_id": self.profile_id,
+            "label": self.label,
+            "started": self.started,
+            "duration_ms": round(self.duration * 1000, 2),
+            "interval_ms": round(self.interval * 1000, 2),
+            "samples": self.samples,
+        }
+
+    def svg(self, width: int = 1200, row: int = 17) -> str:
+        """Classic flamegraph (root at the bottom), one rectangle per frame with a tooltip."""
+        tree = {"children": OrderedDict(), "count": 0}
+        for stack, count in self.stacks.items():
+            node = tree
+            node["count"] += count
+            for frame in stack.split(";"):
+                node = node["children"].setdefault(frame, {"children": OrderedDict(), "count": 0})
+                node["count"] += count
+
+        def depth(node):
+            return 1 + max((depth(c) for c in node["children"].values()), default=0)
+
+        total = max(tree["count"], 1)
+        height = (depth(tree) + 1) * row + 40
+        scale = (width - 20) / total
+        rects = []
+
+        def draw(node, name, x, level):
+            w = node["count"] * scale
+            if w < 0.3:
+                return
+            y = height - (level + 1) * row - 10
+            pct = 100.0 * node["count"] / total
+            # Warm colours keyed by name, so a function keeps its colour across the graph
+            h = sum(map(ord, name)) % 60
+            label = name if len(name) * 7 < w else (name[:int(w / 7) - 2] + ".." if w > 30 else "")
+            rects.append(
+                f'<g><title>{escape(name)} ({node["count"]} samples, {pct:.1f}%)</title>'
+                f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="hsl({h},85%,60%)" rx="2"/>'
+                f'<text x="{x + 3:.1f}" y="{y + row - 5}">{escape(label)}</text></g>'
+            )
+            cx = x
+            for child_name, child in node["children"].items():
+                draw(child, child_name, cx, level + 1)
+                cx += child["count"] * scale
+
+        draw(tree, f"all ({self.label})", 10, 0)
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="11">'
+            f'<rect width="100%" height="100%" fill="#fdfdfd"/>'
+            f'<text x="10" y="20" font-size="14">{escape(self.label)}: {self.samples} samples, '
+            f'{self.duration * 1000:.0f} ms, every {self.interval * 1000:.1f} ms</text>'
+            + "".join(rects) + "</svg>"
+        )
+
+
+class SamplingProfiler:
+    """One profile at a time per worker; finished profiles are kept in a small LRU."""
+
+    def __init__(self, interval: float = 0.005, max_seconds: float = 60, keep: int = 20):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.keep = keep
+        self._profiles = OrderedDict()
+        self._active = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, profile_id: str) -> bool:
+        """Starts sampling; False if another profile is already running."""
+        with self._lock:
+            if self._active is not None:
+                return False
+            self._active = Profile(profile_id, self.interval)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, args=(self._active,), name="profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, label: str = "") -> Profile:
+        with self._lock:
+            profile, thread = self._active, self._thread
+            self._active = self._thread = None
+        if profile is None:
+            return None
+        self._stop.set()
+        thread.join()
+        profile.label = label
+        with self._lock:
+            self._profiles[profile.profile_id] = profile
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+        PROFILES_TAKEN.inc()
+        return profile
+
+    def get(self, profile_id: str) -> Profile:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> list:
+        with self._lock:
+            return [p.summary() for p in reversed(self._profiles.values())]
+
+    def _sample(self, profile: Profile):
+        me = threading.get_ident()
+        names = {}
+        start = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            if time.perf_counter() - start > self.max_seconds:
+                break
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, f"thread-{ident}"))
+                profile.stacks[";".join(reversed(stack))] += 1
+            profile.samples += 1
+        profile.duration = time.perf_counter() - start
+
+
+profiler = SamplingProfiler(
+    interval=settings.PROFILE_INTERVAL_MS / 1000,
+    max_seconds=settings.PROFILE_MAX_SECONDS,
+    keep=settings.PROFILE_KEEP,
+)
@@ -1,60 +1,509 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from app.services.telemetry import timed, current_trace, REGISTRY
+from app.services.ingestion import ingestion_pipeline
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingStore
+from app.services.llm_provider import get_llm_provider
+from app.services.vector_index import QuantizedVectorIndex
+from app.services.keyword_index import BM25Index, reciprocal_rank_fusion
+from app.services.context_packer import pack_context
+from app.services.state_store import state, activity, STATE_REBUILDS
+from app.config import settings
+from app.database import SessionLocal, KnowledgeDocument
+from collections import OrderedDict
+import hashlib
 import os
-import shutil
+import re
+import json
+import threading
+import time
+from datetime import datetime
+
+RAG_QUERY_SECONDS = REGISTRY.histogram("rag_query_duration_seconds", "Retrieval latency by collection handle state", ["handle"])
+RAG_RETRIEVAL_SECONDS = REGISTRY.histogram("rag_retrieval_seconds", "Retrieval time by method", ["method"])
+RAG_KEYWORD_INDEX_SECONDS = REGISTRY.histogram("rag_keyword_index_build_seconds", "Time spent updating the BM25 index per ingest")
+RAG_RETRIEVAL_CACHE = REGISTRY.counter("rag_retrieval_cache_total", "Retrieval cache lookups", ["result"])
+RAG_OPEN_COLLECTIONS = REGISTRY.gauge("rag_open_collections", "Collection handles held in the RAG handle cache")
+
+CHROMA_DIR = "./chroma_db"
+INDEX_DIR = "./vector_index"
+KEYWORD_DIR = "./keyword_index"
+DOCS_DIR = "./temp_docs"  # raw uploaded documents, one directory per session
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation do not change what is retrieved."""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+def collection_name(session_id: str) -> str:
+    """Chroma names are limited to 3-63 chars of [a-zA-Z0-9._-]."""
+    name = "session_" + re.sub(r"[^a-zA-Z0-9_-]", "_", session_id)
+    if len(name) > 63:
+        name = "session_" + hashlib.sha1(session_id.encode()).hexdigest()
+    return name
+
 
 class RAGService:
-    def __init__(self):
+    def __init__(self, max_open_collections: int = 32, backend: str = "chroma", hybrid: bool = True, top_k: int = 3,
+                 retrieval_cache_size: int = 256):
         self.vector_db = None
-        # FastEmbedEmbeddings uses "BAAI/bge-small-en-v1.5" by default.
-        self.embeddings = FastEmbedEmbeddings()
-        
+        self._embeddings = None
+        self._embeddings_lock = threading.Lock()  # model load takes seconds; don't hold _lock for it
+        self.max_open_collections = max(1, max_open_collections)
+        self.backend = backend
+        self.hybrid = hybrid
+        self.top_k = top_k
+        self._client = None
+        self._handles = OrderedDict()  # session_id -> Chroma, least recently used first
+        self._legacy = set()           # sessions whose cached handle is a pre-shared-client directory
+        self._keyword = {}             # session_id -> BM25Index, evicted together with the handle
+        # Packed context per (session, collection version, normalized query); any write to a
+        # session's knowledge base bumps its version in the shared state store, so stale
+        # entries are never served, whichever worker did the write
+        self._seen_versions = {}  # session_id -> version this worker's handle/index reflect
+        self._retrieval_cache = OrderedDict()
+        self.retrieval_cache_size = retrieval_cache_size
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        """
+        The LLM provider's embedding model (FastEmbed, or a stub for the fake provider).
+        Cached by content hash so unchanged chunks are never re-embedded. Created on
+        first use (or by warmup): constructing it loads the ONNX model.
+        """
+        if self._embeddings is None:
+            with self._embeddings_lock:
+                if self._embeddings is None:
+                    self._embeddings = CachedEmbeddings(
+                        get_llm_provider().create_embeddings(),
+                        EmbeddingStore(settings.EMBED_CACHE_PATH),
+                        query_cache_size=settings.EMBED_QUERY_CACHE_SIZE,
+                    )
+        return self._embeddings
+
+    def warmup(self):
+        """Loads the embedding model and opens the vector store client ahead of the first request."""
+        self.embeddings.embed_query("warmup")
+        if self.backend == "chroma":
+            import langchain_chroma
+            return self.client
+
+    # --- Client and handle cache ---
+    @property
+    def client(self):
+        """One persistent client for every session; each session is a collection in it."""
+        if self._client is None:
+            import chromadb
+            with self._lock:
+                if self._client is None and settings.RAG_CHROMA_URL:
+                    # Shared Chroma server: every worker and node sees the same collections
+                    host, _, port = settings.RAG_CHROMA_URL.rpartition(":")
+                    self._client = chromadb.HttpClient(host=host or "localhost", port=int(port or 8000))
+                elif self._client is None:
+                    self._client = chromadb.PersistentClient(path=CHROMA_DIR)
+        return self._client
+
+    def _index_path(self, session_id: str) -> str:
+        return os.path.join(INDEX_DIR, collection_name(session_id))
+
+    def _collection_exists(self, session_id: str) -> bool:
+        if self.backend == "quantized":
+            return QuantizedVectorIndex.exists(self._index_path(session_id))
+        try:
+            self.client.get_collection(collection_name(session_id))
+            return True
+        except Exception:
+            return False
+
+    def _legacy_dir(self, session_id: str) -> str:
+        # Sessions indexed before the shared client had their own persist directory
+        path = os.path.join(CHROMA_DIR, session_id)
+        return path if os.path.isdir(path) else None
+
+    def get_collection(self, session_id: str, create: bool = False):
+        """
+        Returns (handle, was_cached). Handles are kept in an LRU bounded by
+        max_open_collections; evicted ones are simply reopened on next use.
+        """
+        activity.touch(session_id)
+        with self._lock:
+            handle = self._handles.get(session_id)
+            # Writes always go to the shared client, never to a legacy directory
+            if handle is not None and not (create and session_id in self._legacy):
+                self._handles.move_to_end(session_id)
+                return handle, True
+
+        from langchain_chroma import Chroma
+        legacy = False
+        if self.backend == "quantized":
+            if not (create or self._collection_exists(session_id)):
+                return None, False
+            handle = QuantizedVectorIndex(
+                self._index_path(session_id), self.embeddings,
+                dtype=settings.RAG_QUANT_DTYPE, rerank=settings.RAG_QUANT_RERANK,
+            )
+        elif create or self._collection_exists(session_id):
+            handle = Chroma(
+                client=self.client,
+                collection_name=collection_name(session_id),
+                embedding_function=self.embeddings,
+            )
+        elif self._legacy_dir(session_id):
+            handle = Chroma(persist_directory=self._legacy_dir(session_id), embedding_function=self.embeddings)
+            legacy = True
+        else:
+            return None, False
+
+        with self._lock:
+            if legacy:
+                self._legacy.add(session_id)
+            else:
+                self._legacy.discard(session_id)
+            self._handles[session_id] = handle
+            self._handles.move_to_end(session_id)
+            while len(self._handles) > self.max_open_collections:
+                evicted, _ = self._handles.popitem(last=False)
+                self._legacy.discard(evicted)
+                self._keyword.pop(evicted, None)
+            RAG_OPEN_COLLECTIONS.set(len(self._handles))
+        return handle, False
+
+    def has_collection(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._handles:
+                return True
+        if self._collection_exists(session_id):
+            return True
+        return self.backend == "chroma" and self._legacy_dir(session_id) is not None
+
+    def get_keyword_index(self, session_id: str, vector_db) -> BM25Index:
+        """BM25 index for the session; rebuilt from the vector store if it was never built."""
+        with self._lock:
+            index = self._keyword.get(session_id)
+        if index is not None:
+            return index
+
+        path = os.path.join(KEYWORD_DIR, f"{collection_name(session_id)}.json")
+        # Pull the latest copy if another worker rebuilt it
+        state.sync_artifact(self._keyword_artifact(session_id), path)
+        index = BM25Index(path)
+        if not BM25Index.exists(path):
+            # Sessions indexed before hybrid search existed
+            stored = vector_db.get(include=["documents"])
+            if stored["ids"]:
+                start = time.perf_counter()
+                index.add(stored["ids"], stored["documents"])
+                self._save_keyword_index(session_id, index)
+                print(f"Built keyword index for {session_id}: {len(index)} chunks in {time.perf_counter() - start:.3f}s")
+        with self._lock:
+            self._keyword[session_id] = index
+        return index
+
+    @staticmethod
+    def _keyword_artifact(session_id: str) -> str:
+        return f"keyword_index/{collection_name(session_id)}.json"
+
+    def _save_keyword_index(self, session_id: str, index: BM25Index):
+        index.save()
+        state.put_artifact(self._keyword_artifact(session_id), index.path)
+
+    # --- Ingestion ---
+    def process_file(self, file_path: str, session_id: str, doc_id: str = None) -> dict:
+        """
+        Adds a PDF, PPTX or text document to the session's knowledge base, or replaces
+        the document with the same doc_id (defaults to the file name).
+
+        Chunk ids are content hashes, so on replace only new or changed chunks are
+        embedded and written, and chunks that no longer exist are deleted. Other
+        documents in the collection are untouched.
+        """
+        doc_id = doc_id or os.path.basename(file_path)
+        # Held for the whole ingest so the janitor never collects a collection mid-write
+        with activity.lease(session_id):
+            return self._process_file(file_path, session_id, doc_id)
+
+    def _process_file(self, file_path: str, session_id: str, doc_id: str) -> dict:
+        self.vector_db, _ = self.get_collection(session_id, create=True)
+        vector_db = self.vector_db
+        existing = set(vector_db.get(where={"doc_id": doc_id}, include=[])["ids"])
+        keyword_index = self.get_keyword_index(session_id, vector_db)
+
+        seen = set()
+        added = 0
+        keyword_seconds = 0.0
+
+        def upsert(batch):
+            nonlocal added, keyword_seconds
+            new_docs, new_ids = [], []
+            for doc in batch:
+                chunk_id = self._chunk_id(doc_id, doc, seen)
+                seen.add(chunk_id)
+                if chunk_id not in existing:
+                    new_docs.append(doc)
+                    new_ids.append(chunk_id)
+            if new_docs:
+                vector_db.add_documents(new_docs, ids=new_ids)
+                added += len(new_docs)
+                t = time.perf_counter()
+                keyword_index.add(new_ids, [d.page_content for d in new_docs])
+                keyword_seconds += time.perf_counter() - t
+
+        stats = ingestion_pipeline.ingest(file_path, upsert, metadata={"doc_id": doc_id})
+
+        stale = list(existing - seen)
+        if stale:
+            vector_db.delete(ids=stale)
+        t = time.perf_counter()
+        keyword_index.remove(stale)
+        self._save_keyword_index(session_id, keyword_index)
+        keyword_seconds += time.perf_counter() - t
+        RAG_KEYWORD_INDEX_SECONDS.observe(keyword_seconds)
+        stats.update({
+            "doc_id": doc_id,
+            "added": added,
+            "unchanged": len(seen & existing),
+            "removed": len(stale),
+            "keyword_index_seconds": round(keyword_seconds, 4),
+        })
+        self._save_document(session_id, doc_id, file_path, stats)
+        self._bump_version(session_id)
+        return stats
+
+    @staticmethod
+    def _chunk_id(doc_id: str, doc, seen: set) -> str:
+        digest = hashlib.sha1(f"{doc_id}\0{doc.metadata.get('page')}\0{doc.page_content}".encode()).hexdigest()
+        chunk_id = digest[:24]
+        # Identical chunks on the same page still need distinct ids
+        n = 1
+        while chunk_id in seen:
+            chunk_id = f"{digest[:24]}-{n}"
+            n += 1
+        return chunk_id
+
+    def _save_document(self, session_id: str, doc_id: str, file_path: str, stats: dict):
+        db = SessionLocal()
+        try:
+            row = db.query(KnowledgeDocument).filter_by(session_id=session_id, doc_id=doc_id).first()
+            if row is None:
+                row = KnowledgeDocument(session_id=session_id, doc_id=doc_id)
+                db.add(row)
+            row.filename = os.path.basename(file_path)
+            row.format = stats["format"]
+            row.size_bytes = os.path.getsize(file_path)
+            row.pages = stats["pages"]
+            row.chunks = stats["chunks"]
+            row.stats = json.dumps(stats)
+            row.indexed_at = datetime.now().isoformat()
+            db.commit()
+        finally:
+            db.close()
+
+    def list_documents(self, session_id: str) -> list:
+        db = SessionLocal()
+        try:
+            rows = db.query(KnowledgeDocument).filter_by(session_id=session_id).order_by(KnowledgeDocument.id).all()
+            return [{
+                "doc_id": r.doc_id,
+                "filename": r.filename,
+                "format": r.format,
+                "size_bytes": r.size_bytes,
+                "pages": r.pages,
+                "chunks": r.chunks,
+                "indexed_at": r.indexed_at,
+                "last_ingest": json.loads(r.stats) if r.stats else None,
+            } for r in rows]
+        finally:
+            db.close()
+
+    def remove_document(self, session_id: str, doc_id: str):
+        """Deletes a document's chunks by metadata filter. Returns the number removed, or None if unknown."""
+        vector_db, _ = self.get_collection(session_id, create=True)
+        ids = vector_db.get(where={"doc_id": doc_id}, include=[])["ids"]
+        db = SessionLocal()
+        try:
+            row = db.query(KnowledgeDocument).filter_by(session_id=session_id, doc_id=doc_id).first()
+            if row is None and not ids:
+                return None
+            if ids:
+                vector_db.delete(where={"doc_id": doc_id})
+                self._bump_version(session_id)
+                keyword_index = self.get_keyword_index(session_id, vector_db)
+                keyword_index.remove(ids)
+                self._save_keyword_index(session_id, keyword_index)
+            if row is not None:
+                db.delete(row)
+                db.commit()
+        finally:
+            db.close()
+        return len(ids)
+
+    def drop_collection(self, name: str, session_ids: list = ()):
+        """
+        Deletes a collection (by collection_name) and forgets everything this worker
+        cached for it; used by the janitor. session_ids are the sessions known to map
+        to it, whose document records are removed and versions bumped so other
+        workers drop their handles too.
+        """
+        with self._lock:
+            for sid in [s for s in self._handles if collection_name(s) == name]:
+                del self._handles[sid]
+                self._legacy.discard(sid)
+            for sid in [s for s in self._keyword if collection_name(s) == name]:
+                del self._keyword[sid]
+            for key in [k for k in self._retrieval_cache if collection_name(k[0]) == name]:
+                del self._retrieval_cache[key]
+            RAG_OPEN_COLLECTIONS.set(len(self._handles))
+        if self.backend == "chroma":
+            try:
+                self.client.delete_collection(name)
+            except Exception:
+                pass  # already gone
+        if session_ids:
+            db = SessionLocal()
+            try:
+                db.query(KnowledgeDocument).filter(KnowledgeDocument.session_id.in_(list(session_ids))).delete(
+                    synchronize_session=False)
+                db.commit()
+            finally:
+                db.close()
+            for sid in session_ids:
+                self._bump_version(sid)
+
+    def known_sessions(self) -> list:
+        """Session ids with registered documents."""
+        db = SessionLocal()
+        try:
+            return [row[0] for row in db.query(KnowledgeDocument.session_id).distinct()]
+        finally:
+            db.close()
+
     def process_pdf(self, file_path: str, session_id: str):
+        """Kept for callers of the old PDF-only API."""
+        return self.process_file(file_path, session_id)["chunks"]
+
+    # --- Retrieval cache ---
+    def _bump_version(self, session_id: str):
+        version = state.incr("rag_versions", session_id)
+        with self._lock:
+            self._seen_versions[session_id] = version
+            for key in [k for k in self._retrieval_cache if k[0] == session_id]:
+                del self._retrieval_cache[key]
+
+    def _current_version(self, session_id: str) -> int:
         """
-        Ingests a PDF, chunks it, and stores it in a persistent ChromaDB collection.
-        """
-        # 1. Load PDF
-        loader = PyPDFLoader(file_path)
-        pages = loader.load()
-        
-        # 2. Split Text
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        docs = text_splitter.split_documents(pages)
-        
-        # 3. Store in Vector DB
-        persist_dir = f"./chroma_db/{session_id}"
-        
-        if os.path.exists(persist_dir):
-            shutil.rmtree(persist_dir)
-            
-        self.vector_db = Chroma.from_documents(
-            documents=docs, 
-            embedding=self.embeddings,
-            persist_directory=persist_dir
-        )
-        return len(docs)
+        Shared knowledge base version. If another worker changed the session since this
+        worker last looked, its handle and keyword index are dropped and reopened.
+        """
+        version = state.counter("rag_versions", session_id)
+        with self._lock:
+            seen = self._seen_versions.get(session_id)
+            self._seen_versions[session_id] = version
+            if seen is not None and seen != version and session_id in self._handles:
+                del self._handles[session_id]
+                self._legacy.discard(session_id)
+                self._keyword.pop(session_id, None)
+                RAG_OPEN_COLLECTIONS.set(len(self._handles))
+                STATE_REBUILDS.inc(kind="rag_handle")
+        return version
+
+    def _cache_key(self, session_id: str, query: str) -> tuple:
+        return (session_id, self._current_version(session_id), normalize_query(query))
 
+    # --- Retrieval ---
     def query_document(self, query: str, session_id: str):
         """
         Retrieves relevant context and returns documents.
         """
-        persist_dir = f"./chroma_db/{session_id}"
-        if not os.path.exists(persist_dir):
+        start = time.perf_counter()
+        key = self._cache_key(session_id, query)
+        with self._lock:
+            context = self._retrieval_cache.get(key)
+            if context is not None:
+                self._retrieval_cache.move_to_end(key)
+        if context is not None:
+            RAG_RETRIEVAL_CACHE.inc(result="hit")
+            trace = current_trace()
+            if trace is not None:
+                trace.add_span("retrieval", "cache_hit", time.perf_counter() - start, session=session_id)
+            return context
+        RAG_RETRIEVAL_CACHE.inc(result="miss")
+
+        vectordb, warm = self.get_collection(session_id)
+        if vectordb is None:
             return None
-            
-        # Load existing DB
-        vectordb = Chroma(persist_directory=persist_dir, embedding_function=self.embeddings)
-        
-        # Get retriever
-        retriever = vectordb.as_retriever(search_kwargs={"k": 3})
-        
-        # --- FIXED: Use .invoke() instead of .get_relevant_documents() ---
-        docs = retriever.invoke(query)
-        
-        # Combine context
-        context = "\n\n".join([d.page_content for d in docs])
+
+        with timed("retrieval"):
+            docs = self.retrieve(vectordb, query, session_id)
+
+        # Cold = the handle had to be opened for this query
+        elapsed = time.perf_counter() - start
+        handle_state = "warm" if warm else "cold"
+        RAG_QUERY_SECONDS.observe(elapsed, handle=handle_state)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_span("retrieval", f"vector_store_{handle_state}", elapsed, session=session_id)
+
+        # Dedupe, merge overlapping neighbours and fit the prompt budget
+        with timed("context_packing"):
+            context, pack_stats = pack_context(
+                docs, self.embeddings, settings.RAG_CONTEXT_TOKEN_BUDGET,
+                dedup_threshold=settings.RAG_DEDUP_THRESHOLD,
+                max_overlap_chars=settings.RAG_CHUNK_OVERLAP,
+            )
+        if trace is not None:
+            trace.add_span("context", "packed", 0, **pack_stats)
+
+        with self._lock:
+            # Skip caching if the knowledge base changed while we were retrieving
+            if key[1] == self._seen_versions.get(session_id, 0):
+                self._retrieval_cache[key] = context
+                while len(self._retrieval_cache) > self.retrieval_cache_size:
+                    self._retrieval_cache.popitem(last=False)
         return context
 
-rag_service = RAGService()
\ No newline at end of file
+    def retrieve(self, vectordb, query: str, session_id: str) -> list:
+        """
+        Top-k chunks for the query. In hybrid mode BM25 and vector search each return a
+        wider candidate list and reciprocal rank fusion picks the final k, so exact
+        identifiers are found without raising k (and the prompt size).
+        """
+        k = self.top_k
+        candidates = max(k * 4, 10) if self.hybrid else k
+
+        t = time.perf_counter()
+        vector_docs = vectordb.similarity_search(query, k=candidates)
+        RAG_RETRIEVAL_SECONDS.observe(time.perf_counter() - t, method="vector")
+        if not self.hybrid:
+            return vector_docs
+
+        t = time.perf_counter()
+        keyword_hits = self.get_keyword_index(session_id, vectordb).search(query, k=candidates)
+        RAG_RETRIEVAL_SECONDS.observe(time.perf_counter() - t, method="bm25")
+
+        t = time.perf_counter()
+        by_id = {d.id: d for d in vector_docs if d.id}
+        fused = reciprocal_rank_fusion([[d.id for d in vector_docs if d.id], [cid for cid, _ in keyword_hits]], k)
+        missing = [cid for cid in fused if cid not in by_id]
+        if missing:
+            stored = vectordb.get(ids=missing, include=["documents", "metadatas"])
+            for cid, text, meta in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+                by_id[cid] = Document(page_content=text, metadata=meta or {}, id=cid)
+        RAG_RETRIEVAL_SECONDS.observe(time.perf_counter() - t, method="fusion")
+        return [by_id[cid] for cid in fused if cid in by_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open_collections": len(self._handles),
+                "max_open_collections": self.max_open_collections,
+                "cached_retrievals": len(self._retrieval_cache),
+            }
+
+rag_service = RAGService(
+    max_open_collections=settings.RAG_MAX_OPEN_COLLECTIONS,
+    backend=settings.RAG_VECTOR_BACKEND,
+    hybrid=settings.RAG_HYBRID_SEARCH,
+    top_k=settings.RAG_TOP_K,
+    retrieval_cache_size=settings.RAG_RETRIEVAL_CACHE_SIZE,
+)
@@ -0,0 +1,305 @@
+"""
+Executive report builder for CSV sessions.
+
+Sections (overview, column profiles, correlations, key drivers, outliers, pinned
+charts and notes) are independent, so they are computed concurrently: data sections
+on a thread pool (pandas/numpy/sklearn release the GIL for the heavy parts) and
+pinned Plotly charts rasterized to PNG on a process pool (see chart_raster). The PDF is assembled in order once every section is ready.
+
+Each section produces a list of blocks (heading/text/table/image) rather than drawing
+directly, because FPDF is not thread-safe.
+"""
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from app.config import settings
+from app.services.analysis import analysis_service
+from app.services.chart_raster import rasterize_chart
+from app.services.report_service import PDFReport, _pdf_bytes
+from app.services.telemetry import REGISTRY, timed
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+
+SECTION_SECONDS = REGISTRY.histogram("report_section_seconds", "Executive report section build time", ["section"])
+
+MAX_PROFILE_COLUMNS = 40
+MAX_OUTLIER_COLUMNS = 12
+CHART_WIDTH, CHART_HEIGHT = 900, 500
+
+
+def _latin1(text) -> str:
+    # The core FPDF fonts are latin-1 only
+    return str(text).encode("latin-1", "replace").decode("latin-1")
+
+
+def _fmt(value) -> str:
+    if isinstance(value, (float, np.floating)):
+        return f"{value:,.4g}" if abs(value) < 1e6 else f"{value:,.0f}"
+    if isinstance(value, (int, np.integer)):
+        return f"{value:,}"
+    return str(value)
+
+
+class ReportBuilder:
+    def __init__(self, section_workers: int, chart_workers: int):
+        self.section_workers = max(1, section_workers)
+        self.chart_workers = max(1, chart_workers)
+        self._sections = ThreadPoolExecutor(max_workers=self.section_workers, thread_name_prefix="report-section")
+        self._charts = None
+        self._charts_lock = threading.Lock()
+
+    def _chart_pool(self) -> ProcessPoolExecutor:
+        with self._charts_lock:
+            if self._charts is None:
+                self._charts = ProcessPoolExecutor(max_workers=self.chart_workers, mp_context=mp.get_context("spawn"))
+            return self._charts
+
+    # --- Sections: each returns a list of blocks ---
+    def section_overview(self, df: pd.DataFrame, filename: str, profile: dict = None) -> list:
+        if profile:
+            rows, columns, numeric = profile["rows"], len(profile["columns"]), len(profile["numeric"])
+            missing, duplicates = sum(profile["null_counts"].values()), profile["duplicates"]
+        else:
+            rows, columns, numeric = len(df), len(df.columns), len(df.select_dtypes(include=["number"]).columns)
+            missing, duplicates = int(df.isnull().sum().sum()), int(df.duplicated().sum())
+        blocks = [("heading", "1. Dataset Overview"), ("bullets", [
+            f"Filename: {filename}",
+            f"Total Records: {rows:,}",
+            f"Total Columns: {columns} ({numeric} numeric)",
+            f"Missing Values: {missing:,}",
+            f"Duplicate Rows: {duplicates:,}",
+        ])]
+        insights = analysis_service.insights_from_profile(profile) if profile else analysis_service.get_auto_insights(df)
+        if insights:
+            blocks.append(("subheading", "Automatic insights"))
+            blocks.append(("bullets", insights))
+        return blocks
+
+    def section_numeric_summary(self, df: pd.DataFrame, profile: dict = None) -> list:
+        blocks = [("heading", "2. Key Numeric Statistics")]
+        if profile:
+            desc = profile["stats"]
+        else:
+            numeric_df = df.select_dtypes(include=["number"])
+            desc = numeric_df.describe().T if not numeric_df.empty else numeric_df
+        if desc.empty:
+            return blocks + [("text", "No numeric columns found.")]
+        rows = [[name, _fmt(r["mean"]), _fmt(r["std"]), _fmt(r["min"]), _fmt(r["50%"]), _fmt(r["max"])]
+                for name, r in desc.iterrows()]
+        return blocks + [("table", ["Feature", "Mean", "Std", "Min", "Median", "Max"], rows)]
+
+    def section_column_profiles(self, df: pd.DataFrame) -> list:
+        blocks = [("heading", "3. Column Profiles")]
+        for col in list(df.columns)[:MAX_PROFILE_COLUMNS]:
+            s = df[col]
+            lines = [f"Type: {s.dtype}", f"Non-null: {int(s.count()):,} ({s.notna().mean():.1%})",
+                     f"Distinct values: {int(s.nunique()):,}"]
+            if pd.api.types.is_numeric_dtype(s) and s.notna().any():
+                q = s.quantile([0.05, 0.25, 0.5, 0.75, 0.95])
+                lines.append("Percentiles 5/25/50/75/95: " + " / ".join(_fmt(v) for v in q.values))
+                lines.append(f"Skew: {_fmt(s.skew())}")
+                blocks += [("subheading", col), ("bullets", lines)]
+            else:
+                top = s.astype(str).value_counts().head(5)
+                blocks += [("subheading", col), ("bullets", lines),
+                           ("table", ["Top value", "Count", "Share"],
+                            [[str(v)[:40], f"{c:,}", f"{c / max(len(s), 1):.1%}"] for v, c in top.items()])]
+        if len(df.columns) > MAX_PROFILE_COLUMNS:
+            blocks.append(("text", f"{len(df.columns) - MAX_PROFILE_COLUMNS} more columns not profiled."))
+        return blocks
+
+    def _corr(self, df: pd.DataFrame, profile: dict = None):
+        """Pearson correlation matrix of the numeric columns, or None with fewer than two."""
+        if profile:
+            return profile["corr"] if len(profile["numeric"]) > 1 else None
+        numeric = df.select_dtypes(include=["number"])
+        return numeric.corr() if numeric.shape[1] > 1 else None
+
+    def section_correlations(self, df: pd.DataFrame, profile: dict = None) -> list:
+        blocks = [("heading", "4. Correlations")]
+        corr = self._corr(df, profile)
+        if corr is None:
+            return blocks + [("text", "Fewer than two numeric columns; no correlations to report.")]
+        upper = corr.where(np.triu(np.ones(corr.shape, dtype=bool), k=1)).stack()
+        top = upper.reindex(upper.abs().sort_values(ascending=False).index).head(15)
+        rows = [[a, b, f"{v:+.3f}", "strong" if abs(v) > 0.7 else "moderate" if abs(v) > 0.4 else "weak"]
+                for (a, b), v in top.items()]
+        return blocks + [("text", "Strongest pairwise Pearson correlations:"),
+                         ("table", ["Column A", "Column B", "r", "Strength"], rows)]
+
+    def section_drivers(self, df: pd.DataFrame, profile: dict = None) -> list:
+        blocks = [("heading", "5. Key Drivers")]
+        corr = self._corr(df, profile)
+        if corr is None:
+            return blocks + [("text", "Not enough numeric columns to model drivers.")]
+        # Use the numeric column most connected to the others as the target
+        target = corr.abs().sum().idxmax()
+        result = analysis_service.calculate_key_drivers(df, target)
+        if "error" in result:
+            return blocks + [("text", f"Driver analysis for '{target}' failed: {result['error']}")]
+        rows = [[d["feature"], f"{d['importance']:.1%}"] for d in result["drivers"]]
+        return blocks + [("text", f"Top drivers of '{target}' ({result['task_type']}, random forest feature importance):"),
+                         ("table", ["Feature", "Importance"], rows)]
+
+    def outlier_row(self, df: pd.DataFrame, col: str) -> list:
+        # One task per column: Isolation Forest dominates report time on wide datasets
+        _, count = analysis_service.detect_outliers(df, col)
+        s = df[col].dropna()
+        q1, q3 = s.quantile(0.25), s.quantile(0.75)
+        iqr_count = int(((s < q1 - 1.5 * (q3 - q1)) | (s > q3 + 1.5 * (q3 - q1))).sum())
+        return [col, f"{count:,}", f"{iqr_count:,}", f"{iqr_count / max(len(s), 1):.1%}"]
+
+    def section_outliers(self, rows: list) -> list:
+        blocks = [("heading", "6. Outliers")]
+        if not rows:
+            return blocks + [("text", "No numeric columns to check.")]
+        return blocks + [("text", "Isolation Forest (10% contamination) and 1.5x IQR rule per column:"),
+                         ("table", ["Column", "Isolation Forest", "IQR outliers", "IQR share"], rows)]
+
+    def section_pins(self, pins: list) -> list:
+        """Pinned charts are rasterized in parallel on the chart pool; text pins become notes."""
+        blocks = [("heading", "7. Pinned Charts & Notes")]
+        charts = [p for p in pins if isinstance(p.get("chart_config"), dict) and p["chart_config"].get("data")]
+        notes = [p for p in pins if p.get("chart_type") == "text"]
+        if not charts and not notes:
+            return blocks + [("text", "Nothing pinned to the dashboard for this session.")]
+
+        futures = []
+        if charts:
+            pool = self._chart_pool()
+            futures = [pool.submit(rasterize_chart, json.dumps(p["chart_config"]), CHART_WIDTH, CHART_HEIGHT) for p in charts]
+        for pin, future in zip(charts, futures):
+            try:
+                blocks.append(("image", future.result(timeout=120), pin.get("title") or "Chart"))
+            except Exception as e:
+                # Unsupported trace type or the figure failed to render; keep the rest of the report
+                blocks.append(("text", f"[Chart '{pin.get('title')}' could not be rendered: {type(e).__name__}: {e}]"))
+        for pin in notes:
+            blocks += [("subheading", pin.get("title") or "Note"), ("text", pin["chart_config"].get("text", ""))]
+        return blocks
+
+    # --- Assembly ---
+    def _draw(self, pdf: PDFReport, blocks: list, tmpdir: str):
+        for block in blocks:
+            kind = block[0]
+            if kind == "heading":
+                if pdf.get_y() > 230:
+                    pdf.add_page()
+                pdf.ln(3)
+                pdf.set_font("Arial", "B", 12)
+                pdf.cell(0, 10, _latin1(block[1]), 0, 1)
+            elif kind == "subheading":
+                pdf.set_font("Arial", "B", 10)
+                pdf.cell(0, 7, _latin1(block[1]), 0, 1)
+            elif kind == "text":
+                pdf.set_font("Arial", "", 10)
+                pdf.multi_cell(0, 6, _latin1(block[1]))
+            elif kind == "bullets":
+                pdf.set_font("Arial", "", 10)
+                for item in block[1]:
+                    pdf.multi_cell(0, 6, _latin1(f"- {item}"))
+                pdf.ln(2)
+            elif kind == "table":
+                headers, rows = block[1], block[2]
+                width = 190 / len(headers)
+                pdf.set_font("Arial", "B", 9)
+                for h in headers:
+                    pdf.cell(width, 7, _latin1(h), 1)
+                pdf.ln()
+                pdf.set_font("Arial", "", 9)
+                for row in rows:
+                    for value in row:
+                        pdf.cell(width, 7, _latin1(str(value)[:int(width / 1.9)]), 1)
+                    pdf.ln()
+                pdf.ln(3)
+            elif kind == "image":
+                # FPDF 1.7 only embeds images from files
+                path = os.path.join(tmpdir, f"chart_{id(block)}.png")
+                with open(path, "wb") as f:
+                    f.write(block[1])
+                h = 190 * CHART_HEIGHT / CHART_WIDTH
+                if pdf.get_y() + h + 10 > 280:
+                    pdf.add_page()
+                pdf.set_font("Arial", "I", 9)
+                pdf.cell(0, 6, _latin1(block[2]), 0, 1)
+                pdf.image(path, x=10, w=190, h=h)
+                pdf.ln(4)
+
+    def build(self, df: pd.DataFrame, filename: str, pins: list = None, profile: dict = None) -> tuple:
+        """
+        Returns (pdf bytes, {section: seconds}). With a SQL engine profile
+        (sql_engine.profile), overview, summary and correlation statistics are taken
+        from it instead of being recomputed from df.
+        """
+        outlier_cols = analysis_service.get_numeric_cols(df)[:MAX_OUTLIER_COLUMNS]
+        # Slowest work first so it is not queued behind the cheap sections
+        tasks = [("outliers", self.outlier_row, (df, col)) for col in outlier_cols] + [
+            ("pins", self.section_pins, (pins or [],)),
+            ("drivers", self.section_drivers, (df, profile)),
+            ("overview", self.section_overview, (df, filename, profile)),
+            ("numeric_summary", self.section_numeric_summary, (df, profile)),
+            ("column_profiles", self.section_column_profiles, (df,)),
+            ("correlations", self.section_correlations, (df, profile)),
+        ]
+        order = ["overview", "numeric_summary", "column_profiles", "correlations", "drivers", "outliers", "pins"]
+        spans = {}
+        lock = threading.Lock()
+
+        def run(name, fn, args):
+            started = time.perf_counter()
+            try:
+                with timed(f"report_section_{name}"):
+                    return fn(*args)
+            except Exception as e:
+                print(f"Report section '{name}' failed: {e}")
+                return None if name == "outliers" else [("text", f"[Section '{name}' failed: {e}]")]
+            finally:
+                finished = time.perf_counter()
+                with lock:
+                    first, last = spans.get(name, (started, finished))
+                    spans[name] = (min(first, started), max(last, finished))
+
+        start = time.perf_counter()
+        futures = [(name, self._sections.submit(contextvars.copy_context().run, run, name, fn, args))
+                   for name, fn, args in tasks]
+        results, outlier_rows = {}, []
+        for name, future in futures:
+            if name == "outliers":
+                row = future.result()
+                if row is not None:
+                    outlier_rows.append(row)
+            else:
+                results[name] = future.result()
+        results["outliers"] = self.section_outliers(outlier_rows)
+
+        # Wall time per section (first task start to last task end)
+        timings = {name: spans[name][1] - spans[name][0] for name in order if name in spans}
+        for name, seconds in timings.items():
+            SECTION_SECONDS.observe(seconds, section=name)
+
+        assemble_start = time.perf_counter()
+        pdf = PDFReport()
+        pdf.set_auto_page_break(auto=True, margin=15)
+        pdf.add_page()
+        with tempfile.TemporaryDirectory(prefix="report_") as tmpdir:
+            for name in order:
+                self._draw(pdf, results[name], tmpdir)
+            data = _pdf_bytes(pdf)
+        timings["assemble"] = time.perf_counter() - assemble_start
+        SECTION_SECONDS.observe(timings["assemble"], section="assemble")
+        timings["total"] = time.perf_counter() - start
+
+        print(f"Executive report {filename}: {pdf.page_no()} pages in {timings['total']:.2f}s ("
+              + ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items() if k != "total") + ")")
+        return data, timings
+
+
+report_builder = ReportBuilder(
+    section_workers=settings.REPORT_SECTION_WORKERS,
+    chart_workers=settings.REPORT_CHART_WORKERS,
+)
@@ -1,8 +1,19 @@
 from fpdf import FPDF
 import pandas as pd
 from datetime import datetime
-import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.services.telemetry import REGISTRY, timed, current_trace
+import asyncio
+import contextvars
+import threading
 import io
+import time
+
+REPORT_CACHE = REGISTRY.counter("report_cache_total", "Report cache lookups", ["result"])
+REPORT_CACHE_BYTES = REGISTRY.gauge("report_cache_bytes", "Bytes of rendered reports held in memory")
+REPORT_RENDER_SECONDS = REGISTRY.histogram("report_render_seconds", "Report rendering time", ["report"])
 
 class PDFReport(FPDF):
     def header(self):
@@ -17,10 +28,88 @@ class PDFReport(FPDF):
         self.set_font('Arial', 'I', 8)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
+def _pdf_bytes(pdf: FPDF) -> bytes:
+    # fpdf 1.7 returns a latin-1 str for dest='S'; fpdf2 returns a bytearray
+    out = pdf.output(dest='S')
+    return out.encode('latin-1') if isinstance(out, str) else bytes(out)
+
+
+class ReportCache:
+    """LRU of finished report bytes, bounded by total size rather than entry count."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+        REPORT_CACHE.inc(result="hit" if data is not None else "miss")
+        return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._size -= len(self._items.pop(key))
+            self._items[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+            REPORT_CACHE_BYTES.set(self._size)
+
+
 class ReportService:
+    def __init__(self):
+        self.cache = ReportCache(settings.REPORT_CACHE_MB * 1024 * 1024)
+        # Dedicated, small pool: a burst of report downloads queues here instead of
+        # occupying the shared threadpool that chat and query requests run on
+        self._executor = ThreadPoolExecutor(max_workers=settings.REPORT_WORKERS, thread_name_prefix="report")
+        self._inflight = {}
+
+    async def render(self, key, report: str, fn, *args) -> bytes:
+        """
+        Returns cached bytes for key, or runs fn(*args) -> bytes on the report pool.
+        Concurrent requests for the same key share one render.
+        """
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        future = self._inflight.get(key)
+        if future is None:
+            trace = current_trace()
+            submitted = time.perf_counter()
+
+            def run():
+                # Time spent waiting for a free report worker
+                if trace is not None:
+                    trace.add_span("stage", "report_queue", time.perf_counter() - submitted)
+                with timed(f"report_{report}"):
+                    return fn(*args)
+
+            # copy_context keeps the request trace attached to the render
+            future = self._executor.submit(contextvars.copy_context().run, run)
+            self._inflight[key] = future
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+
+            def done(f):
+                if f.exception() is None:
+                    self.cache.put(key, f.result())
+                    REPORT_RENDER_SECONDS.observe(loop.time() - start, report=report)
+                self._inflight.pop(key, None)
+            future.add_done_callback(done)
+        return await asyncio.wrap_future(future)
+
     # --- Full Data Report (CSV) ---
-    def generate_pdf(self, df: pd.DataFrame, filename: str) -> str:
-        """Generates a full summary report and saves it to disk."""
+    def generate_pdf(self, df: pd.DataFrame, filename: str) -> bytes:
+        """Generates a full summary report as PDF bytes."""
         
         pdf = PDFReport()
         pdf.add_page()
@@ -73,13 +162,10 @@ class ReportService:
             
         pdf.ln(5)
 
-        output_path = f"temp_uploads/{filename}_report.pdf"
-        os.makedirs("temp_uploads", exist_ok=True)
-        pdf.output(output_path)
-        return output_path
+        return _pdf_bytes(pdf)
 
     # --- Selective Chat Export ---
-    def generate_chat_pdf(self, messages: list, session_id: str) -> str:
+    def generate_chat_pdf(self, messages: list, session_id: str) -> bytes:
         """Generates a PDF from a selected subset of chat messages."""
         pdf = PDFReport()
         pdf.add_page()
@@ -118,13 +204,10 @@ class ReportService:
             pdf.line(10, pdf.get_y(), 200, pdf.get_y())
             pdf.ln(5)
 
-        os.makedirs("temp_uploads", exist_ok=True)
-        output_path = f"temp_uploads/{session_id}_chat_export.pdf"
-        pdf.output(output_path)
-        return output_path
+        return _pdf_bytes(pdf)
 
     # --- NEW: Generic Text Report (for SQL/RAG Metadata) ---
-    def generate_text_report(self, text_content: str, filename: str) -> str:
+    def generate_text_report(self, text_content: str, filename: str) -> bytes:
         pdf = PDFReport()
         pdf.add_page()
         pdf.set_auto_page_break(auto=True, margin=15)
@@ -137,9 +220,6 @@ class ReportService:
         # Use multi_cell for wrapping long text content
         pdf.multi_cell(0, 6, text_content)
 
-        output_path = f"temp_uploads/{filename}_summary.pdf"
-        os.makedirs("temp_uploads", exist_ok=True)
-        pdf.output(output_path)
-        return output_path
+        return _pdf_bytes(pdf)
 
 report_service = ReportService()
\ No newline at end of file
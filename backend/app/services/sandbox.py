@@ -0,0 +1,204 @@
+"""
+Isolated execution of agent-generated pandas code.
+
+A pool of pre-warmed worker processes runs the code instead of the API process.
+The session DataFrame is exported once to an Arrow IPC file that workers memory-map,
+so it never has to be pickled per call. Each task is bounded by CPU time (RLIMIT_CPU),
+address space (RLIMIT_AS), a wall-clock deadline and an RSS watchdog; a worker that
+breaches a limit is killed and replaced.
+"""
+from langchain_core.tools import BaseTool
+from app.config import settings
+from app.services.telemetry import REGISTRY
+from app.services import sandbox_worker
+import multiprocessing as mp
+import hashlib
+import glob
+import os
+import queue
+import threading
+import time
+
+SANDBOX_TASK_SECONDS = REGISTRY.histogram("sandbox_task_duration_seconds", "Agent code execution time in sandbox workers", ["outcome"])
+SANDBOX_KILLS = REGISTRY.counter("sandbox_worker_kills_total", "Sandbox workers killed for breaching a limit", ["reason"])
+SANDBOX_BUSY = REGISTRY.gauge("sandbox_workers_busy", "Sandbox workers currently executing code")
+
+ARROW_DIR = os.path.join(settings.UPLOAD_DIR, "arrow")
+
+
+def _arrow_compatible(df):
+    """
+    Arrow needs one type per column, so mixed object columns (e.g. [1, "two", 3.0]
+    from xlsx uploads) are exported as strings, like they would read back from CSV.
+    """
+    import pyarrow as pa
+
+    mixed = []
+    for column in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            mixed.append(column)
+    if not mixed:
+        return df
+    return df.assign(**{column: df[column].where(df[column].isna(), df[column].astype(str)) for column in mixed})
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=sandbox_worker.worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self, timeout: float = 60) -> bool:
+        if not self.ready and self.conn.poll(timeout):
+            self.ready = "ready" in self.conn.recv()
+        return self.ready
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class SandboxPool:
+    def __init__(self, size: int, cpu_seconds: float, wall_seconds: float, memory_mb: int):
+        self.size = max(1, size)
+        self.cpu_seconds = cpu_seconds
+        self.wall_seconds = wall_seconds
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self._ctx = mp.get_context("spawn")
+        self._idle = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Spawns the workers. Called lazily on first use, or explicitly to pre-warm."""
+        with self._start_lock:
+            if self._started:
+                return
+            workers = [_Worker(self._ctx) for _ in range(self.size)]
+            for w in workers:
+                w.wait_ready()
+                self._idle.put(w)
+            self._started = True
+
+    def shutdown(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+        self._started = False
+
+    def export_dataframe(self, session_id: str, df) -> str:
+        """
+        Writes df as an uncompressed Arrow IPC file once per content fingerprint, so
+        workers can memory-map it. Older exports of the same session are removed.
+        """
+        import pandas as pd
+        import pyarrow as pa
+
+        sample = pd.concat([df.head(1000), df.tail(1000)])
+        digest = hashlib.sha1()
+        digest.update(repr((df.shape, list(df.columns), [str(t) for t in df.dtypes])).encode())
+        digest.update(pd.util.hash_pandas_object(sample, index=True).values.tobytes())
+        path = os.path.join(ARROW_DIR, f"{session_id}_{digest.hexdigest()[:16]}.arrow")
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(ARROW_DIR, exist_ok=True)
+        table = pa.Table.from_pandas(_arrow_compatible(df), preserve_index=False)
+        tmp_path = f"{path}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+        for old in glob.glob(os.path.join(ARROW_DIR, f"{session_id}_*.arrow")):
+            if old != path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        return path
+
+    def execute(self, code: str, arrow_path: str) -> str:
+        if not self._started:
+            self.start()
+
+        worker = self._idle.get()
+        SANDBOX_BUSY.inc()
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            worker.conn.send({
+                "code": code,
+                "arrow_path": arrow_path,
+                "cpu_seconds": self.cpu_seconds,
+                "memory_bytes": self.memory_bytes,
+            })
+            deadline = start + self.wall_seconds
+            while True:
+                if worker.conn.poll(0.05):
+                    result = worker.conn.recv()
+                    outcome = "ok" if result["ok"] else "error"
+                    return result["output"]
+                if not worker.process.is_alive():
+                    outcome = "crashed"
+                    return "Error: the sandbox worker crashed while running this code."
+                if time.perf_counter() > deadline:
+                    outcome = "wall_timeout"
+                    return f"TimeoutError: code ran longer than {self.wall_seconds:.0f}s and was stopped"
+                if self.memory_bytes and _rss_bytes(worker.process.pid) > self.memory_bytes:
+                    outcome = "memory"
+                    return "MemoryError: the computation exceeded the sandbox memory limit"
+        except (EOFError, OSError, BrokenPipeError):
+            outcome = "crashed"
+            return "Error: the sandbox worker crashed while running this code."
+        finally:
+            SANDBOX_BUSY.dec()
+            SANDBOX_TASK_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+            if outcome in ("ok", "error"):
+                self._idle.put(worker)
+            else:
+                SANDBOX_KILLS.inc(reason=outcome)
+                worker.kill()
+                replacement = _Worker(self._ctx)
+                replacement.wait_ready()
+                self._idle.put(replacement)
+
+
+class SandboxedPythonTool(BaseTool):
+    """Drop-in replacement for PythonAstREPLTool that runs code in the sandbox pool."""
+    name: str = "python_repl_ast"
+    description: str = (
+        "A Python shell. Use this to execute python commands. "
+        "Input should be a valid python command. "
+        "The dataframe is available as `df`; variables do not persist between calls. "
+        "When using this tool, sometimes output is abbreviated - "
+        "make sure it does not look abbreviated before using it in your answer."
+    )
+    arrow_path: str
+
+    def _run(self, query: str, run_manager=None) -> str:
+        from langchain_experimental.tools.python.tool import sanitize_input
+        return sandbox_pool.execute(sanitize_input(query), self.arrow_path)
+
+
+sandbox_pool = SandboxPool(
+    size=settings.SANDBOX_WORKERS,
+    cpu_seconds=settings.SANDBOX_CPU_SECONDS,
+    wall_seconds=settings.SANDBOX_WALL_SECONDS,
+    memory_mb=settings.SANDBOX_MEMORY_MB,
+)
@@ -0,0 +1,134 @@
+"""
+Child-process side of the sandbox pool. Kept free of app/langchain imports so that
+spawned workers start quickly; only pandas/numpy/pyarrow are pre-imported.
+"""
+from contextlib import redirect_stdout
+from io import StringIO
+import ast
+import os
+import signal
+
+try:
+    import resource
+except ImportError:  # Windows: no rlimits, only the parent's wall-clock/RSS watchdog applies
+    resource = None
+
+MAX_OUTPUT_CHARS = 20000
+
+
+class CPUTimeExceeded(Exception):
+    pass
+
+
+def _on_sigxcpu(signum, frame):
+    raise CPUTimeExceeded("CPU time limit exceeded")
+
+
+def _load_frame(path: str, cache: dict):
+    """
+    Memory-maps the Arrow IPC file so the table buffers come straight from the page cache.
+    The table is cached, but every task gets its own writable DataFrame built from it, so
+    changes made by one call never leak into the next.
+    """
+    import pyarrow as pa
+
+    mtime = os.path.getmtime(path)
+    cached = cache.get(path)
+    if cached and cached[0] == mtime:
+        table = cached[1]
+    else:
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        cache.clear()  # one dataset per worker keeps RSS predictable
+        cache[path] = (mtime, table)
+    return table.to_pandas()
+
+
+def _address_space() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _set_limits(cpu_seconds: float, memory_bytes: int):
+    if resource is None:
+        return
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = usage.ru_utime + usage.ru_stime
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (int(used + cpu_seconds) + 1, hard))
+    if memory_bytes:
+        # Address space is far larger than RSS (thread stacks, allocator arenas), so cap
+        # new allocations relative to the current size; the parent watches RSS itself.
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = _address_space() + memory_bytes
+        if hard == resource.RLIM_INFINITY or limit < hard:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _clear_limits():
+    if resource is None:
+        return
+    for limit in (resource.RLIMIT_CPU, resource.RLIMIT_AS):
+        _, hard = resource.getrlimit(limit)
+        resource.setrlimit(limit, (hard, hard))
+
+
+def run_code(code: str, df) -> str:
+    """Same semantics as PythonAstREPLTool: exec all statements, eval and return the last one."""
+    import pandas as pd
+    import numpy as np
+
+    scope = {"df": df, "pd": pd, "np": np}
+    tree = ast.parse(code)
+    exec(ast.unparse(ast.Module(tree.body[:-1], type_ignores=[])), scope)
+    last = ast.unparse(ast.Module(tree.body[-1:], type_ignores=[]))
+    buffer = StringIO()
+    try:
+        with redirect_stdout(buffer):
+            ret = eval(last, scope)
+        return buffer.getvalue() if ret is None else str(ret)
+    except SyntaxError:
+        with redirect_stdout(buffer):
+            exec(last, scope)
+        return buffer.getvalue()
+
+
+def worker_main(conn):
+    # Pre-warm the heavy imports before reporting ready
+    import pandas  # noqa: F401
+    import numpy  # noqa: F401
+    import pyarrow  # noqa: F401
+
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _on_sigxcpu)
+    cache = {}
+    conn.send({"ready": os.getpid()})
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        try:
+            df = _load_frame(task["arrow_path"], cache)
+            _set_limits(task.get("cpu_seconds"), task.get("memory_bytes"))
+            try:
+                output = run_code(task["code"], df)
+            finally:
+                _clear_limits()
+            result = {"ok": True, "output": output[:MAX_OUTPUT_CHARS]}
+        except MemoryError:
+            cache.clear()
+            result = {"ok": False, "output": "MemoryError: the computation exceeded the sandbox memory limit"}
+        except CPUTimeExceeded as e:
+            result = {"ok": False, "output": f"TimeoutError: {e}"}
+        except Exception as e:
+            result = {"ok": False, "output": f"{type(e).__name__}: {e}"}
+        conn.send(result)
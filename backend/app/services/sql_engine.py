@@ -0,0 +1,333 @@
+"""
+Embedded columnar SQL engine (DuckDB) over uploaded datasets.
+
+On first use, a session's upload is copied once into a Parquet file (columns dropped
+exactly as DataHandler.clean_data does), and every query reads it as the table `df`.
+DuckDB scans only the columns a query touches, in parallel and vectorized, so charts,
+insights and report statistics can aggregate without loading the whole dataset into
+pandas; only the (small) result comes back as a DataFrame.
+
+CSV, JSON and Parquet are read by DuckDB directly; anything else (xlsx, or a file its
+reader rejects) is converted once from what pandas loads. Without duckdb installed,
+table() returns None and callers use their pandas path.
+
+The CSV agent's sql_query tool runs on a separate, locked-down connection per call:
+no file access beyond the session's own copy, no extensions, and a row cap.
+"""
+from collections import OrderedDict, namedtuple
+from app.config import settings
+from app.services.data_handler import data_handler
+from app.services.telemetry import REGISTRY, timed
+from langchain_core.tools import BaseTool
+import pandas as pd
+import glob
+import importlib.util
+import os
+import re
+import threading
+import time
+
+SQL_QUERY_SECONDS = REGISTRY.histogram("sql_engine_query_seconds", "Embedded SQL engine query time", ["kind"])
+SQL_REGISTRATIONS = REGISTRY.counter("sql_engine_registrations_total", "Datasets copied into the SQL engine's columnar format", ["reader"])
+
+# Optional, and imported on first use (~50ms at startup): without it everything runs through pandas
+DUCKDB_AVAILABLE = importlib.util.find_spec("duckdb") is not None
+
+SQL_DIR = os.path.join(settings.UPLOAD_DIR, "duckdb")
+READERS = {".csv": "read_csv", ".json": "read_json_auto", ".parquet": "read_parquet"}
+NUMERIC_TYPES = re.compile(r"^(U?TINYINT|U?SMALLINT|U?INTEGER|U?BIGINT|U?HUGEINT|FLOAT|DOUBLE|DECIMAL.*)$")
+TEMPORAL_TYPES = re.compile(r"^(DATE|TIME.*)$")
+
+# path: the Parquet copy (None if the dataset could not be registered); columns: name -> DuckDB type
+SessionTable = namedtuple("SessionTable", ["version", "path", "columns", "rows"])
+
+
+def ident(name: str) -> str:
+    """Quotes a column name for use in SQL."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def literal(text: str) -> str:
+    """Quotes a string (file path) for use in SQL."""
+    return "'" + str(text).replace("'", "''") + "'"
+
+
+def is_numeric(sql_type: str) -> bool:
+    return bool(NUMERIC_TYPES.match(sql_type))
+
+
+def is_temporal(sql_type: str) -> bool:
+    return bool(TEMPORAL_TYPES.match(sql_type))
+
+
+class SQLEngine:
+    def __init__(self, threads: int, memory_mb: int, timeout: float, profile_cache: int = 16):
+        self.threads = threads or os.cpu_count() or 1
+        self.memory_mb = memory_mb
+        self.timeout = timeout
+        self.profile_cache = profile_cache
+        self._con = None
+        self._tables = {}                # session_id -> SessionTable
+        self._profiles = OrderedDict()   # (session_id, version) -> profile
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return DUCKDB_AVAILABLE and settings.SQL_ENGINE_ENABLED
+
+    def warmup(self):
+        """Imports duckdb ahead of the first query."""
+        if self.enabled:
+            import duckdb
+
+    def _config(self) -> dict:
+        return {"threads": self.threads, "memory_limit": f"{self.memory_mb}MB"}
+
+    def _connection(self):
+        import duckdb
+        with self._lock:
+            if self._con is None:
+                self._con = duckdb.connect(config=self._config())
+            return self._con
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    # --- Registration ---
+    def table(self, session_id: str) -> SessionTable:
+        """
+        The session's table, registered on first use and again whenever the upload
+        changes. None if the engine is off or the file could not be registered.
+        Raises FileNotFoundError for unknown sessions, like DataHandler.
+        """
+        if not self.enabled:
+            return None
+        version = data_handler.dataset_version(session_id)
+        cached = self._tables.get(session_id)
+        if cached is None or cached.version != version or (cached.path and not os.path.exists(cached.path)):
+            # Per-session lock: concurrent first requests convert the file once
+            with self._session_lock(session_id):
+                cached = self._tables.get(session_id)
+                if cached is None or cached.version != version or (cached.path and not os.path.exists(cached.path)):
+                    cached = self._register(session_id, version)
+                    self._tables[session_id] = cached
+        return cached if cached.path else None
+
+    def _register(self, session_id: str, version: str) -> SessionTable:
+        target = os.path.join(SQL_DIR, f"{session_id}_{version}.parquet")
+        try:
+            if not os.path.exists(target):
+                os.makedirs(SQL_DIR, exist_ok=True)
+                start = time.perf_counter()
+                with timed("sql_register"):
+                    self._convert(session_id, target)
+                SQL_QUERY_SECONDS.observe(time.perf_counter() - start, kind="register")
+            cur = self._connection().cursor()
+            try:
+                source = f"read_parquet({literal(target)})"
+                columns = OrderedDict(
+                    (row[0], row[1]) for row in cur.execute(f"DESCRIBE SELECT * FROM {source}").fetchall())
+                rows = cur.execute(f"SELECT count(*) FROM {source}").fetchone()[0]
+            finally:
+                cur.close()
+        except Exception as e:
+            print(f"SQL engine: could not register {session_id}, using pandas: {e}")
+            return SessionTable(version, None, {}, 0)
+
+        # Copies of earlier versions of the upload are not needed any more
+        for old in glob.glob(os.path.join(SQL_DIR, f"{session_id}_*.parquet")):
+            if old != target:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        return SessionTable(version, target, columns, rows)
+
+    def _convert(self, session_id: str, target: str):
+        path = data_handler.dataset_path(session_id)
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        import duckdb
+        tmp_path = f"{target}.tmp"
+        cur = self._connection().cursor()
+        try:
+            try:
+                if reader is None:
+                    raise ValueError("no DuckDB reader for this format")
+                source = f"{reader}({literal(path)})"
+                names = [row[0] for row in cur.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+                counts = cur.execute(
+                    f"SELECT count(*), {', '.join(f'count({ident(c)})' for c in names)} FROM {source}").fetchone()
+                # Same columns as DataHandler.clean_data: drop empty ones and those under 5% filled
+                keep = [c for c, n in zip(names, counts[1:]) if n > 0 and n >= counts[0] * 0.05]
+                if not keep:
+                    raise ValueError("no columns left after cleaning")
+                cur.execute(f"COPY (SELECT {', '.join(ident(c) for c in keep)} FROM {source}) "
+                            f"TO {literal(tmp_path)} (FORMAT parquet)")
+                SQL_REGISTRATIONS.inc(reader=reader)
+            except (ValueError, duckdb.Error) as e:
+                # xlsx, or a file DuckDB's reader rejects: convert what pandas loads
+                print(f"SQL engine: converting {session_id} through pandas ({e})")
+                df = data_handler.load_dataset(session_id)
+                cur.register("upload", df)
+                cur.execute(f"COPY upload TO {literal(tmp_path)} (FORMAT parquet)")
+                SQL_REGISTRATIONS.inc(reader="pandas")
+            os.replace(tmp_path, target)
+        finally:
+            cur.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # --- Queries ---
+    def _run(self, con, sql: str, params, kind: str):
+        # Long scans are interrupted rather than left to hold a worker thread
+        timer = threading.Timer(self.timeout, con.interrupt)
+        timer.start()
+        start = time.perf_counter()
+        try:
+            with timed("sql_query"):
+                return con.execute(sql, params or [])
+        finally:
+            timer.cancel()
+            SQL_QUERY_SECONDS.observe(time.perf_counter() - start, kind=kind)
+
+    def _cursor(self, session_id: str):
+        table = self.table(session_id)
+        if table is None:
+            raise ValueError("Dataset is not available to the SQL engine.")
+        # A cursor is its own connection to the shared database, so the temp view is private to it
+        cur = self._connection().cursor()
+        cur.execute(f"CREATE OR REPLACE TEMP VIEW df AS SELECT * FROM read_parquet({literal(table.path)})")
+        return cur
+
+    def query(self, session_id: str, sql: str, params: list = None, kind: str = "query") -> pd.DataFrame:
+        """Runs trusted SQL (built by us, identifiers quoted with ident()) against `df`."""
+        cur = self._cursor(session_id)
+        try:
+            return self._run(cur, sql, params, kind).df()
+        finally:
+            cur.close()
+
+    def export(self, session_id: str, sql: str, path: str, params: list = None, kind: str = "export"):
+        """Writes the result of trusted SQL against `df` to a Parquet file (atomically)."""
+        cur = self._cursor(session_id)
+        tmp_path = f"{path}.tmp"
+        try:
+            self._run(cur, f"COPY ({sql}) TO {literal(tmp_path)} (FORMAT parquet)", params, kind)
+            os.replace(tmp_path, path)
+        finally:
+            cur.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def agent_query(self, session_id: str, sql: str, max_rows: int = None) -> str:
+        """Runs agent-written SQL on a locked-down connection; returns the result as text."""
+        max_rows = max_rows or settings.SQL_AGENT_MAX_ROWS
+        table = self.table(session_id)
+        if table is None:
+            return "Error: SQL is not available for this dataset; use python_repl_ast instead."
+        import duckdb
+        con = duckdb.connect(config=self._config())
+        try:
+            con.execute(f"CREATE VIEW df AS SELECT * FROM read_parquet({literal(table.path)})")
+            con.execute(f"SET allowed_paths = [{literal(table.path)}]")
+            con.execute("SET enable_external_access = false")
+            con.execute("SET lock_configuration = true")
+            try:
+                result = self._run(con, sql, None, "agent")
+                if result.description is None:
+                    return "Statement executed; it returned no rows."
+                columns = [d[0] for d in result.description]
+                rows = result.fetchmany(max_rows + 1)
+            except duckdb.Error as e:
+                return f"{type(e).__name__}: {e}"
+        finally:
+            con.close()
+        if not rows:
+            return "The query returned no rows."
+        text = pd.DataFrame(rows[:max_rows], columns=columns).to_string(index=False)
+        if len(rows) > max_rows:
+            text += f"\n(first {max_rows} rows shown; aggregate or add LIMIT for the rest)"
+        return text
+
+    # --- Statistics ---
+    def profile(self, session_id: str) -> dict:
+        """
+        Whole-table statistics in two scans, cached per dataset version: row count, nulls
+        per column, duplicate rows, and for numeric columns mean/std/min/median/max and
+        the pairwise Pearson correlation matrix (pairwise-complete, like pandas).
+        """
+        table = self.table(session_id)
+        if table is None:
+            raise ValueError("Dataset is not available to the SQL engine.")
+        key = (session_id, table.version)
+        with self._lock:
+            if key in self._profiles:
+                self._profiles.move_to_end(key)
+                return self._profiles[key]
+
+        names = list(table.columns)
+        numeric = [c for c in names if is_numeric(table.columns[c])]
+        pairs = [(a, b) for i, a in enumerate(numeric) for b in numeric[i + 1:]]
+        aggregates = [f"count({ident(c)})" for c in names]
+        for c in numeric:
+            q = ident(c)
+            aggregates += [f"avg({q})", f"stddev_samp({q})", f"min({q})", f"median({q})", f"max({q})"]
+        aggregates += [f"corr({ident(a)}, {ident(b)})" for a, b in pairs]
+        values = list(self.query(session_id, f"SELECT {', '.join(aggregates)} FROM df", kind="profile").iloc[0])
+        duplicates = self.query(
+            session_id, "SELECT count(*) - (SELECT count(*) FROM (SELECT DISTINCT * FROM df)) FROM df",
+            kind="profile").iloc[0, 0]
+
+        counts, values = values[:len(names)], values[len(names):]
+        stats = pd.DataFrame(
+            [values[i * 5:(i + 1) * 5] for i in range(len(numeric))],
+            index=numeric, columns=["mean", "std", "min", "50%", "max"], dtype=float)
+        corr = pd.DataFrame(1.0, index=numeric, columns=numeric)
+        for (a, b), r in zip(pairs, values[len(numeric) * 5:]):
+            corr.loc[a, b] = corr.loc[b, a] = float("nan") if r is None else r
+        profile = {
+            "rows": table.rows,
+            "columns": dict(table.columns),
+            "null_counts": {c: table.rows - int(n) for c, n in zip(names, counts)},
+            "duplicates": int(duplicates),
+            "numeric": numeric,
+            "stats": stats,
+            "corr": corr,
+        }
+        with self._lock:
+            self._profiles[key] = profile
+            while len(self._profiles) > self.profile_cache:
+                self._profiles.popitem(last=False)
+        return profile
+
+
+class SessionSQLTool(BaseTool):
+    """Agent tool: read-only SQL over the session's dataset, for filters, group-bys and aggregates."""
+    name: str = "sql_query"
+    description: str = (
+        "Runs one DuckDB SQL query against the dataset, available as the table `df`. "
+        "Prefer this over Python for filtering, grouping, counting and aggregating: it is "
+        "faster and returns only the result. Input should be a single SQL SELECT statement; "
+        "quote column names with double quotes. Long results are truncated, so aggregate or use LIMIT."
+    )
+    session_id: str
+
+    @classmethod
+    def for_session(cls, session_id: str) -> "SessionSQLTool":
+        table = sql_engine.table(session_id)
+        columns = ", ".join(f"{ident(name)} {sql_type}" for name, sql_type in table.columns.items())
+        return cls(session_id=session_id, description=f"{cls.model_fields['description'].default} Columns: {columns}")
+
+    def _run(self, query: str, run_manager=None) -> str:
+        # Models like to wrap SQL in markdown fences
+        sql = re.sub(r"^\s*```(?:sql)?|```\s*$", "", query.strip(), flags=re.IGNORECASE).strip()
+        return sql_engine.agent_query(self.session_id, sql)
+
+
+sql_engine = SQLEngine(
+    threads=settings.SQL_ENGINE_THREADS,
+    memory_mb=settings.SQL_ENGINE_MEMORY_MB,
+    timeout=settings.SQL_ENGINE_TIMEOUT_SECONDS,
+)
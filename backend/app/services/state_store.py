@@ -0,0 +1,395 @@
+"""
+Shared session state, so any uvicorn worker or pod can serve any session.
+
+Everything a request needs to rebuild a session lives here rather than in process
+memory: the session registry, chat history, SQL connection descriptors, knowledge base
+versions and artifacts (uploaded datasets, keyword indexes). Workers keep their own
+caches (DataFrames, SQL engines, vector store handles) and rebuild them lazily from
+this store when a session first lands on them.
+
+Backends (STATE_BACKEND):
+    sqlite  SQLite (WAL) + an artifact directory; shared by workers on one host, or
+            across hosts when STATE_DIR is on a shared volume
+    redis   any Redis-compatible server (Redis, Valkey, KeyDB, Dragonfly) via
+            STATE_REDIS_URL; "fakeredis://" runs an in-process stand-in for local dev
+"""
+from app.config import settings
+from app.services.telemetry import REGISTRY
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+STATE_OPS = REGISTRY.counter("state_ops_total", "Shared state store operations", ["backend", "op"])
+STATE_ARTIFACT_FETCHES = REGISTRY.counter("state_artifact_fetch_total", "Artifacts copied from the shared store to local disk", ["kind"])
+STATE_REBUILDS = REGISTRY.counter("state_rebuilds_total", "Per-worker objects rebuilt from shared state", ["kind"])
+
+
+def _artifact_kind(name: str) -> str:
+    return name.split("/", 1)[0]
+
+
+class StateBackend:
+    """
+    JSON key/value records (optionally expiring), counters, capped lists and
+    artifacts (files). Keys are grouped by namespace.
+    """
+    name = "base"
+
+    def get(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value, ttl: float = None):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def keys(self, namespace: str) -> list:
+        raise NotImplementedError
+
+    def incr(self, namespace: str, key: str) -> int:
+        raise NotImplementedError
+
+    def counter(self, namespace: str, key: str) -> int:
+        raise NotImplementedError
+
+    def append(self, namespace: str, key: str, items: list, max_items: int = None):
+        raise NotImplementedError
+
+    def items(self, namespace: str, key: str) -> list:
+        raise NotImplementedError
+
+    def _write_artifact(self, name: str, path: str):
+        raise NotImplementedError
+
+    def _read_artifact(self, name: str, dest: str) -> bool:
+        raise NotImplementedError
+
+    def _delete_artifact(self, name: str):
+        raise NotImplementedError
+
+    # --- Artifacts (shared by both backends) ---
+    def put_artifact(self, name: str, path: str):
+        """Publishes a local file under name (e.g. "uploads/<session>_data.csv")."""
+        stat = os.stat(path)
+        self._write_artifact(name, path)
+        self.set("artifacts", name, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "stored_at": time.time()})
+        STATE_OPS.inc(backend=self.name, op="put_artifact")
+
+    def artifact_info(self, name: str):
+        return self.get("artifacts", name)
+
+    def sync_artifact(self, name: str, dest: str) -> bool:
+        """
+        Makes dest a copy of the artifact if it is missing or differs (size/mtime).
+        Returns False if there is no such artifact.
+        """
+        info = self.artifact_info(name)
+        if info is None:
+            return False
+        try:
+            stat = os.stat(dest)
+            if stat.st_size == info["size"] and stat.st_mtime_ns == info["mtime_ns"]:
+                return True
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        tmp = f"{dest}.{uuid.uuid4().hex[:8]}.part"
+        if not self._read_artifact(name, tmp):
+            return False
+        # Same mtime as the original, so mtime-based versions agree across workers
+        os.utime(tmp, ns=(info["mtime_ns"], info["mtime_ns"]))
+        os.replace(tmp, dest)
+        STATE_ARTIFACT_FETCHES.inc(kind=_artifact_kind(name))
+        return True
+
+    def delete_artifact(self, name: str):
+        self._delete_artifact(name)
+        self.delete("artifacts", name)
+
+
+class SQLiteStateBackend(StateBackend):
+    name = "sqlite"
+
+    def __init__(self, root: str):
+        self.artifact_dir = os.path.join(root, "artifacts")
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        # Several worker processes share the file; wait on their write locks instead of failing
+        self._conn = sqlite3.connect(os.path.join(root, "state.db"), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires_at REAL, PRIMARY KEY (ns, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lists (ns TEXT NOT NULL, key TEXT NOT NULL, seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " value TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lists_key ON lists (ns, key, seq)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        STATE_OPS.inc(backend=self.name, op="get")
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM kv WHERE ns = ? AND key = ?", (namespace, key)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        STATE_OPS.inc(backend=self.name, op="set")
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                               (namespace, key, json.dumps(value), expires))
+            self._conn.commit()
+
+    def delete(self, namespace, key):
+        STATE_OPS.inc(backend=self.name, op="delete")
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (namespace, key))
+            self._conn.execute("DELETE FROM lists WHERE ns = ? AND key = ?", (namespace, key))
+            self._conn.commit()
+
+    def keys(self, namespace):
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM kv WHERE ns = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                                      (namespace, time.time())).fetchall()
+        return [r[0] for r in rows]
+
+    def incr(self, namespace, key):
+        STATE_OPS.inc(backend=self.name, op="incr")
+        with self._lock:
+            # Single statement, so concurrent workers never lose an increment
+            value = self._conn.execute(
+                "INSERT INTO kv (ns, key, value) VALUES (?, ?, '1')"
+                " ON CONFLICT (ns, key) DO UPDATE SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT)"
+                " RETURNING value",
+                (namespace, key),
+            ).fetchone()[0]
+            self._conn.commit()
+            return int(value)
+
+    def counter(self, namespace, key):
+        value = self.get(namespace, key)
+        return int(value) if value is not None else 0
+
+    def append(self, namespace, key, items, max_items=None):
+        STATE_OPS.inc(backend=self.name, op="append")
+        with self._lock:
+            self._conn.executemany("INSERT INTO lists (ns, key, value) VALUES (?, ?, ?)",
+                                   [(namespace, key, json.dumps(item)) for item in items])
+            if max_items:
+                self._conn.execute(
+                    "DELETE FROM lists WHERE ns = ? AND key = ? AND seq NOT IN"
+                    " (SELECT seq FROM lists WHERE ns = ? AND key = ? ORDER BY seq DESC LIMIT ?)",
+                    (namespace, key, namespace, key, max_items),
+                )
+            self._conn.commit()
+
+    def items(self, namespace, key):
+        STATE_OPS.inc(backend=self.name, op="items")
+        with self._lock:
+            rows = self._conn.execute("SELECT value FROM lists WHERE ns = ? AND key = ? ORDER BY seq",
+                                      (namespace, key)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def _artifact_path(self, name: str) -> str:
+        root = os.path.abspath(self.artifact_dir)
+        path = os.path.abspath(os.path.join(root, name))
+        if not path.startswith(root + os.sep):
+            raise ValueError(f"Invalid artifact name: {name}")
+        return path
+
+    def _write_artifact(self, name, path):
+        dest = self._artifact_path(name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            # Uploads are never modified in place, so a hard link is as good as a copy
+            os.link(path, tmp)
+        except OSError:
+            shutil.copy2(path, tmp)
+        os.replace(tmp, dest)
+
+    def _read_artifact(self, name, dest):
+        src = self._artifact_path(name)
+        if not os.path.exists(src):
+            return False
+        shutil.copyfile(src, dest)
+        return True
+
+    def _delete_artifact(self, name):
+        try:
+            os.remove(self._artifact_path(name))
+        except FileNotFoundError:
+            pass
+
+
+class RedisStateBackend(StateBackend):
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "ea"):
+        if url.startswith("fakeredis://"):
+            import fakeredis
+            self._redis = fakeredis.FakeRedis()
+        else:
+            import redis
+            self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, *parts) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def get(self, namespace, key):
+        STATE_OPS.inc(backend=self.name, op="get")
+        raw = self._redis.get(self._key("kv", namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, namespace, key, value, ttl=None):
+        STATE_OPS.inc(backend=self.name, op="set")
+        name = self._key("kv", namespace, key)
+        pipe = self._redis.pipeline()
+        pipe.set(name, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+        pipe.sadd(self._key("keys", namespace), key)
+        pipe.execute()
+
+    def delete(self, namespace, key):
+        STATE_OPS.inc(backend=self.name, op="delete")
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key("kv", namespace, key), self._key("list", namespace, key))
+        pipe.srem(self._key("keys", namespace), key)
+        pipe.execute()
+
+    def keys(self, namespace):
+        # Expired records drop out of the set lazily
+        members = [m.decode() for m in self._redis.smembers(self._key("keys", namespace))]
+        if not members:
+            return []
+        exists = self._redis.pipeline()
+        for m in members:
+            exists.exists(self._key("kv", namespace, m))
+        alive = exists.execute()
+        gone = [m for m, ok in zip(members, alive) if not ok]
+        if gone:
+            self._redis.srem(self._key("keys", namespace), *gone)
+        return [m for m, ok in zip(members, alive) if ok]
+
+    def incr(self, namespace, key):
+        STATE_OPS.inc(backend=self.name, op="incr")
+        return int(self._redis.incr(self._key("kv", namespace, key)))
+
+    def counter(self, namespace, key):
+        raw = self._redis.get(self._key("kv", namespace, key))
+        return int(raw) if raw is not None else 0
+
+    def append(self, namespace, key, items, max_items=None):
+        STATE_OPS.inc(backend=self.name, op="append")
+        name = self._key("list", namespace, key)
+        pipe = self._redis.pipeline()
+        pipe.rpush(name, *[json.dumps(item) for item in items])
+        if max_items:
+            pipe.ltrim(name, -max_items, -1)
+        pipe.execute()
+
+    def items(self, namespace, key):
+        STATE_OPS.inc(backend=self.name, op="items")
+        return [json.loads(raw) for raw in self._redis.lrange(self._key("list", namespace, key), 0, -1)]
+
+    def _write_artifact(self, name, path):
+        with open(path, "rb") as f:
+            self._redis.set(self._key("artifact", name), f.read())
+
+    def _read_artifact(self, name, dest):
+        data = self._redis.get(self._key("artifact", name))
+        if data is None:
+            return False
+        with open(dest, "wb") as f:
+            f.write(data)
+        return True
+
+    def _delete_artifact(self, name):
+        self._redis.delete(self._key("artifact", name))
+
+
+def create_state_backend() -> StateBackend:
+    if settings.STATE_BACKEND == "redis":
+        return RedisStateBackend(settings.STATE_REDIS_URL, prefix=settings.STATE_REDIS_PREFIX)
+    if settings.STATE_BACKEND != "sqlite":
+        raise ValueError(f"Unknown STATE_BACKEND: {settings.STATE_BACKEND}")
+    os.makedirs(settings.STATE_DIR, exist_ok=True)
+    return SQLiteStateBackend(settings.STATE_DIR)
+
+
+state = create_state_backend()
+
+
+class SessionActivity:
+    """
+    Last access time per session, shared through the state store so the janitor on
+    any worker sees activity from all of them. Writes are throttled to one per
+    session per flush interval; leases mark a session busy in this process for the
+    duration of a long operation (ingest, agent run) regardless of the clock.
+    """
+    def __init__(self, backend: StateBackend, flush_seconds: float = 60):
+        self.backend = backend
+        self.flush_seconds = flush_seconds
+        self._local = {}    # session_id -> last access seen by this worker
+        self._flushed = {}  # session_id -> when this worker last wrote it to the store
+        self._leases = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def touch(self, session_id: str):
+        now = time.time()
+        with self._lock:
+            self._local[session_id] = now
+            if now - self._flushed.get(session_id, 0) < self.flush_seconds:
+                return
+            self._flushed[session_id] = now
+        self.backend.set("activity", session_id, now)
+
+    @contextmanager
+    def lease(self, session_id: str):
+        self.touch(session_id)
+        with self._lock:
+            self._leases[session_id] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._leases[session_id] -= 1
+                if self._leases[session_id] <= 0:
+                    del self._leases[session_id]
+            self.touch(session_id)
+
+    def leased(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._leases
+
+    def last_access(self, session_id: str) -> float:
+        """Most recent access seen by any worker, or 0 if the session was never touched."""
+        with self._lock:
+            local = self._local.get(session_id, 0)
+        return max(local, self.backend.get("activity", session_id) or 0)
+
+    def sessions(self) -> list:
+        with self._lock:
+            local = set(self._local)
+        return sorted(local | set(self.backend.keys("activity")))
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._local.pop(session_id, None)
+            self._flushed.pop(session_id, None)
+        self.backend.delete("activity", session_id)
+
+
+activity = SessionActivity(state)
@@ -0,0 +1,85 @@
+"""
+Server-Sent Events helpers for the chat, SQL and RAG endpoints.
+
+Event types:
+    step_started   - the agent started a new reasoning step (LLM call)
+    tool_running   - a tool (python, SQL, retrieval) started
+    tool_finished  - that tool finished
+    token          - a piece of the final answer
+    chart          - a chart payload (SQL visualizations)
+    error          - a user-facing error message
+    heartbeat      - keep-alive while nothing else is happening
+    done           - end of stream
+"""
+from collections import namedtuple
+import json
+import queue
+
+StreamEvent = namedtuple("StreamEvent", ["event", "data"])
+
+HEARTBEAT_SECONDS = 10
+# Disable proxy buffering so events reach the browser as they are produced
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def wants_sse(request) -> bool:
+    """Clients opt in with `Accept: text/event-stream` or `?stream=sse`."""
+    accept = request.headers.get("accept", "")
+    return "text/event-stream" in accept or request.query_params.get("stream") == "sse"
+
+
+def format_sse(event: StreamEvent) -> str:
+    data = event.data if isinstance(event.data, str) else json.dumps(event.data, default=str)
+    # Each line of a multi-line payload needs its own data: prefix
+    body = "\n".join(f"data: {line}" for line in data.split("\n"))
+    return f"event: {event.event}\n{body}\n\n"
+
+
+def drain_queue(q: queue.Queue, heartbeat: float = None):
+    """Yields items from q until a None sentinel; emits heartbeat events while idle."""
+    while True:
+        try:
+            item = q.get(timeout=heartbeat) if heartbeat else q.get()
+        except queue.Empty:
+            yield StreamEvent("heartbeat", {})
+            continue
+        if item is None:
+            break
+        yield item
+
+
+def sse_response_body(events):
+    """Wraps a StreamEvent iterator as SSE text and guarantees a trailing done event."""
+    for event in events:
+        yield format_sse(event)
+    yield format_sse(StreamEvent("done", {}))
+
+
+class FinalAnswerScanner:
+    """
+    Finds "Final Answer:" in a token stream without re-scanning the whole buffer.
+    Only the last len(marker) - 1 characters are carried between tokens, so the
+    work per token is O(len(token)) and the total is linear in the trace length.
+    """
+    MARKER = "Final Answer:"
+
+    def __init__(self):
+        self.found = False
+        self._tail = ""
+
+    def reset(self):
+        if not self.found:
+            self._tail = ""
+
+    def feed(self, token: str) -> str:
+        """Returns the part of token that belongs to the final answer ("" before the marker)."""
+        if self.found:
+            return token
+        window = self._tail + token
+        idx = window.find(self.MARKER)
+        if idx == -1:
+            self._tail = window[-(len(self.MARKER) - 1):]
+            return ""
+        self.found = True
+        self._tail = ""
+        return window[idx + len(self.MARKER):]
@@ -0,0 +1,228 @@
+"""
+Lightweight request tracing and Prometheus-format metrics.
+
+Metrics are kept in-process and rendered in the Prometheus text exposition format
+by GET /metrics. Each HTTP request gets a RequestTrace (see app.middleware) that
+collects per-step spans: LLM calls, tool runs, SQL, retrieval and dataset loading.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import OrderedDict
+import functools
+import threading
+import time
+import uuid
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_str(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> list:
+        return [f"{self.name}{_label_str(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_value(self, key, state) -> list:
+        lines = []
+        names = self.labelnames + ("le",)
+        for bound, count in zip(self.buckets, state["counts"]):
+            lines.append(f"{self.name}_bucket{_label_str(names, key + (bound,))} {count}")
+        lines.append(f"{self.name}_bucket{_label_str(names, key + ('+Inf',))} {state['count']}")
+        lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {state['sum']}")
+        lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"])
+LLM_CALL_SECONDS = REGISTRY.histogram("llm_call_duration_seconds", "Latency of a single LLM call", ["model"])
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram("llm_first_token_seconds", "Time from LLM call start to first streamed token", ["model"])
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "LLM tokens consumed", ["model", "kind"])
+LLM_ERRORS = REGISTRY.counter("llm_errors_total", "Failed LLM calls", ["model"])
+LLM_RETRIES = REGISTRY.counter("llm_retries_total", "LLM and tool call retries")
+AGENT_STEPS = REGISTRY.counter("agent_steps_total", "ReAct agent actions taken", ["tool"])
+TOOL_SECONDS = REGISTRY.histogram("agent_tool_duration_seconds", "Agent tool execution time", ["tool"])
+TOOL_ERRORS = REGISTRY.counter("agent_tool_errors_total", "Agent tool failures", ["tool"])
+STAGE_SECONDS = REGISTRY.histogram("stage_duration_seconds", "Time spent in named processing stages", ["stage"])
+
+
+class RequestTrace:
+    """Collects the spans of a single request. Safe to append to from agent threads."""
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started = time.time()
+        self.spans = []
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def add_span(self, kind: str, name: str, duration: float, **attrs):
+        with self._lock:
+            self.spans.append({"kind": kind, "name": name, "duration_ms": round(duration * 1000, 2), **attrs})
+
+    def summary(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        totals = {}
+        for span in spans:
+            totals[span["kind"]] = round(totals.get(span["kind"], 0) + span["duration_ms"], 2)
+        return {
+            "trace_id": self.trace_id,
+            "started": self.started,
+            "retries": self.retries,
+            "prompt_tokens": sum(s.get("prompt_tokens", 0) for s in spans),
+            "completion_tokens": sum(s.get("completion_tokens", 0) for s in spans),
+            "totals_ms": totals,
+            "spans": spans,
+        }
+
+
+_current_trace: ContextVar = ContextVar("current_trace", default=None)
+_recent_traces = OrderedDict()
+_recent_lock = threading.Lock()
+MAX_RECENT_TRACES = 200
+
+
+def start_trace(trace_id: str = None) -> RequestTrace:
+    trace = RequestTrace(trace_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def finish_trace(trace: RequestTrace):
+    """Keeps the trace in a bounded in-memory buffer so it can be looked up by id."""
+    with _recent_lock:
+        _recent_traces[trace.trace_id] = trace
+        while len(_recent_traces) > MAX_RECENT_TRACES:
+            _recent_traces.popitem(last=False)
+
+
+def get_trace(trace_id: str):
+    with _recent_lock:
+        return _recent_traces.get(trace_id)
+
+
+@contextmanager
+def timed(stage: str):
+    """Times a block into stage_duration_seconds and the current request trace."""
+    trace = current_trace()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=stage)
+        if trace is not None:
+            trace.add_span("stage", stage, duration)
+
+
+def timed_stage(stage: str):
+    """Decorator form of timed(), for service methods that are a stage on their own."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
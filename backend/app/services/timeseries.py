@@ -0,0 +1,267 @@
+"""
+Multi-resolution rollups ("pyramids") for time series in uploaded datasets.
+
+For every date column, the numeric columns are aggregated per minute, hour, day, week
+and month: rows per bucket, and per value count/sum/min/max (mean is sum/count). Each
+level is built from the one below it (months from days, since weeks straddle months),
+so only the minute level scans the dataset. Levels that do not reduce the number of
+points (minutes and hours of daily data) are dropped.
+
+series() serves a date range at the finest resolution that fits the requested pixel
+width, so a multi-year, per-second series comes back as at most about `width` points,
+and zooming in reads only the rollup that matches the new range.
+
+Rollups are built in the background after upload (or on first use) through the SQL
+engine, and stored as Parquet per dataset version (janitor kind "exports").
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.services.sql_engine import sql_engine, ident, literal, is_numeric, is_temporal
+from app.services.state_store import state
+from app.services.telemetry import REGISTRY, timed
+import pandas as pd
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+
+ROLLUP_BUILD_SECONDS = REGISTRY.histogram("timeseries_rollup_build_seconds", "Time to build a dataset's rollup pyramids")
+TIMESERIES_SERVED = REGISTRY.counter("timeseries_requests_total", "Time-series ranges served, by resolution", ["resolution"])
+
+ROLLUP_DIR = os.path.join(settings.UPLOAD_DIR, "rollups")
+LEVELS = OrderedDict([("minute", 60), ("hour", 3600), ("day", 86400), ("week", 7 * 86400), ("month", 30 * 86400)])
+PARENT = {"hour": "minute", "day": "hour", "week": "day", "month": "day"}
+AGGREGATES = ("mean", "sum", "count", "min", "max")
+# Text dates DuckDB does not cast by itself (ISO 8601 casts directly); month-first wins, as in pandas
+DATE_FORMATS = ["%m/%d/%Y", "%d/%m/%Y", "%m/%d/%Y %H:%M", "%d/%m/%Y %H:%M", "%m/%d/%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S",
+                "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d", "%d %b %Y", "%b %d, %Y"]
+
+
+def _date_expr(name: str, sql_type: str) -> str:
+    """SQL expression giving the column as TIMESTAMP, or None if it cannot be one."""
+    q = ident(name)
+    if sql_type.startswith("TIMESTAMP"):
+        return q
+    if sql_type == "DATE":
+        return f"CAST({q} AS TIMESTAMP)"
+    if sql_type == "VARCHAR":
+        formats = ", ".join(literal(f) for f in DATE_FORMATS)
+        return f"coalesce(TRY_CAST({q} AS TIMESTAMP), TRY_STRPTIME({q}, [{formats}]))"
+    return None
+
+
+class TimeSeriesService:
+    def __init__(self, default_width: int, max_width: int):
+        self.default_width = default_width
+        self.max_width = max_width
+        self._manifests = {}  # session_id -> manifest of its rollups
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rollups")
+
+    @property
+    def enabled(self) -> bool:
+        return settings.TIMESERIES_ROLLUPS and sql_engine.enabled
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    # --- Building ---
+    def build_async(self, session_id: str):
+        """Builds the rollups in the background, e.g. right after upload."""
+        if self.enabled:
+            self._pool.submit(self._build_quietly, session_id)
+
+    def _build_quietly(self, session_id: str):
+        try:
+            self.manifest(session_id)
+        except Exception as e:
+            # Retried on first use
+            print(f"Rollups for {session_id} failed: {e}")
+
+    def manifest(self, session_id: str) -> dict:
+        """The session's rollups (built if missing or stale), or None without the SQL engine."""
+        if not self.enabled:
+            return None
+        table = sql_engine.table(session_id)
+        if table is None:
+            return None
+        manifest = self._manifests.get(session_id)
+        if manifest and manifest["version"] == table.version and os.path.isdir(manifest["dir"]):
+            return manifest
+        # Per-session lock: a request arriving while the upload's build runs waits for it
+        with self._session_lock(session_id):
+            manifest = self._manifests.get(session_id)
+            if manifest and manifest["version"] == table.version and os.path.isdir(manifest["dir"]):
+                return manifest
+            directory = os.path.join(ROLLUP_DIR, f"{session_id}_{table.version}")
+            manifest_path = os.path.join(directory, "manifest.json")
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+                manifest["dir"] = directory
+            else:
+                start = time.perf_counter()
+                with timed("rollup_build"):
+                    manifest = self._build(session_id, table, directory)
+                ROLLUP_BUILD_SECONDS.observe(time.perf_counter() - start)
+                print(f"Rollups for {session_id}: {len(manifest['dates'])} date x {len(manifest['values'])} value "
+                      f"columns in {time.perf_counter() - start:.2f}s")
+            # Rollups of earlier versions of the upload are not needed any more
+            for old in glob.glob(os.path.join(ROLLUP_DIR, f"{session_id}_*")):
+                if old != directory:
+                    shutil.rmtree(old, ignore_errors=True)
+            self._manifests[session_id] = manifest
+            return manifest
+
+    def _date_columns(self, session_id: str, table) -> OrderedDict:
+        # Detected at upload (text dates included), plus anything DuckDB typed as a date
+        record = state.get("sessions", session_id) or {}
+        names = list(record.get("date_cols") or []) + [c for c, t in table.columns.items() if is_temporal(t)]
+        exprs = OrderedDict()
+        for name in dict.fromkeys(names):
+            expr = _date_expr(name, table.columns.get(name, ""))
+            if expr:
+                exprs[name] = expr
+        return exprs
+
+    def _build(self, session_id: str, table, directory: str) -> dict:
+        values = [c for c, t in table.columns.items() if is_numeric(t)]
+        manifest = {"version": table.version, "values": values, "dates": OrderedDict()}
+        tmp_dir = f"{directory}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            for index, (name, expr) in enumerate(self._date_columns(session_id, table).items()):
+                first, last, rows = sql_engine.query(
+                    session_id, f"SELECT min({expr}), max({expr}), count({expr}) FROM df", kind="rollup").iloc[0]
+                if not rows or not values:
+                    continue
+                buckets = {}
+                for level in LEVELS:
+                    path = os.path.join(tmp_dir, f"{index}_{level}.parquet")
+                    if level == "minute":
+                        aggregates = "".join(
+                            f", count({ident(v)}) AS v{j}_count, sum({ident(v)}) AS v{j}_sum, "
+                            f"min({ident(v)}) AS v{j}_min, max({ident(v)}) AS v{j}_max" for j, v in enumerate(values))
+                        sql = (f"SELECT date_trunc('minute', {expr}) AS bucket, count(*) AS rows{aggregates} "
+                               f"FROM df WHERE {expr} IS NOT NULL GROUP BY 1 ORDER BY 1")
+                    else:
+                        aggregates = "".join(
+                            f", sum(v{j}_count)::BIGINT AS v{j}_count, sum(v{j}_sum) AS v{j}_sum, "
+                            f"min(v{j}_min) AS v{j}_min, max(v{j}_max) AS v{j}_max" for j in range(len(values)))
+                        parent = os.path.join(tmp_dir, f"{index}_{PARENT[level]}.parquet")
+                        sql = (f"SELECT date_trunc('{level}', bucket) AS bucket, sum(rows)::BIGINT AS rows{aggregates} "
+                               f"FROM read_parquet({literal(parent)}) GROUP BY 1 ORDER BY 1")
+                    sql_engine.export(session_id, sql, path, kind="rollup")
+                    buckets[level] = int(sql_engine.query(
+                        session_id, f"SELECT count(*) FROM read_parquet({literal(path)})", kind="rollup").iloc[0, 0])
+
+                # Keep a level only if it has fewer points than the finer data below it; when a
+                # coarser level has as many points (daily data bucketed per minute), the data is
+                # really that coarse and the level is kept under the coarser name
+                kept, finer = OrderedDict(), int(rows)
+                for level, count in buckets.items():
+                    previous = next(reversed(kept), None)
+                    if previous and count == kept[previous]:
+                        del kept[previous]
+                        kept[level] = count
+                    elif count < finer:
+                        kept[level] = count
+                    finer = min(finer, count)
+                for level in buckets:
+                    if level not in kept:
+                        os.remove(os.path.join(tmp_dir, f"{index}_{level}.parquet"))
+                manifest["dates"][name] = {
+                    "index": index, "expr": expr, "rows": int(rows),
+                    "min": pd.Timestamp(first).isoformat(), "max": pd.Timestamp(last).isoformat(), "levels": kept,
+                }
+            with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_dir, directory)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        manifest["dir"] = directory
+        return manifest
+
+    # --- Serving ---
+    def date_columns(self, session_id: str) -> list:
+        manifest = self.manifest(session_id)
+        return list(manifest["dates"]) if manifest else []
+
+    def series(self, session_id: str, date: str, value: str, start=None, end=None, width: int = None) -> dict:
+        """
+        `value` over `date` between start and end (default: everything) with at most about
+        `width` points: raw rows if they fit, else the finest rollup level that does.
+        Returns arrays of bucket start (x) and count/sum/min/max/mean per bucket.
+        """
+        manifest = self.manifest(session_id)
+        if manifest is None:
+            raise ValueError("Time series need the SQL engine (duckdb) and TIMESERIES_ROLLUPS.")
+        info = manifest["dates"].get(date)
+        if info is None:
+            raise ValueError(f"'{date}' is not a date column of this dataset.")
+        if value not in manifest["values"]:
+            raise ValueError(f"'{value}' is not a numeric column of this dataset.")
+        width = min(max(int(width or self.default_width), 10), self.max_width)
+        start = pd.Timestamp(start or info["min"]).tz_localize(None)
+        end = pd.Timestamp(end or info["max"]).tz_localize(None)
+        j = manifest["values"].index(value)
+
+        def level_path(level):
+            return literal(os.path.join(manifest["dir"], f"{info['index']}_{level}.parquet"))
+
+        def in_range(level):
+            return f"bucket >= date_trunc('{level}', ?::TIMESTAMP) AND bucket <= ?::TIMESTAMP"
+
+        # Finest resolution whose number of points in the range fits the width. Raw rows in
+        # range are counted from the finest rollup, which is cheaper than scanning the data.
+        resolution = "raw"
+        levels = list(info["levels"])
+        if levels:
+            counts = {}
+            for level in levels:
+                points, rows = sql_engine.query(
+                    session_id, f"SELECT count(*), sum(rows) FROM read_parquet({level_path(level)}) WHERE {in_range(level)}",
+                    [start, end], kind="timeseries").iloc[0]
+                counts[level] = int(points)
+                if level == levels[0]:
+                    counts["raw"] = 0 if pd.isna(rows) else int(rows)
+            fits = [r for r in ["raw"] + levels if counts[r] <= width]
+            resolution = fits[0] if fits else levels[-1]
+
+        if resolution == "raw":
+            v, expr = ident(value), info["expr"]
+            sql = (f"SELECT {expr} AS bucket, count({v}) AS count, sum({v}) AS sum, min({v}) AS min, max({v}) AS max "
+                   f"FROM df WHERE {expr} BETWEEN ?::TIMESTAMP AND ?::TIMESTAMP AND {v} IS NOT NULL GROUP BY 1 ORDER BY 1")
+        else:
+            sql = (f"SELECT bucket, v{j}_count AS count, v{j}_sum AS sum, v{j}_min AS min, v{j}_max AS max "
+                   f"FROM read_parquet({level_path(resolution)}) WHERE {in_range(resolution)} AND v{j}_count > 0 ORDER BY bucket")
+        df = sql_engine.query(session_id, sql, [start, end], kind="timeseries")
+        TIMESERIES_SERVED.inc(resolution=resolution)
+        return {
+            "date": date,
+            "value": value,
+            "resolution": resolution,
+            "resolutions": ["raw"] + levels,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "width": width,
+            "points": len(df),
+            "x": df["bucket"].to_numpy(),
+            "count": df["count"].to_numpy(),
+            "sum": df["sum"].to_numpy(dtype=float),
+            "min": df["min"].to_numpy(dtype=float),
+            "max": df["max"].to_numpy(dtype=float),
+            "mean": (df["sum"] / df["count"]).to_numpy(dtype=float),
+        }
+
+
+timeseries = TimeSeriesService(
+    default_width=settings.TIMESERIES_DEFAULT_WIDTH,
+    max_width=settings.TIMESERIES_MAX_WIDTH,
+)
@@ -0,0 +1,361 @@
+"""
+Compact vector store for small per-session corpora.
+
+Embeddings are L2-normalised and quantised to int8 (per-row scale) or float16 and kept
+in .npy files that are memory-mapped on load, so opening a session touches almost no
+memory until it is searched. Search is an exact, blocked dot product over the whole
+matrix; the top candidates can be re-scored against an optional float32 copy.
+
+Each write appends an immutable segment (vectors, ids/metadata, chunk texts) and
+deletes are tombstones in a small manifest, so adding a batch costs that batch, not
+the collection. Segments are merged size-tiered (a segment is merged into the one
+before it once that one is no more than twice its size), which rewrites each row
+O(log n) times over an ingest. Chunk texts are memory-mapped and only read for hits.
+
+Implements the subset of the Chroma vector store interface RAGService uses
+(add_documents, get, delete, reset_collection, as_retriever), so it can be swapped in
+with RAG_VECTOR_BACKEND=quantized.
+"""
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+SEARCH_BLOCK_ROWS = 1024
+MANIFEST = "manifest.json"
+
+
+def _matches(metadata: dict, where: dict) -> bool:
+    if not where:
+        return True
+    if "$and" in where:
+        return all(_matches(metadata, clause) for clause in where["$and"])
+    return all(metadata.get(k) == v for k, v in where.items())
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """Returns (matrix, per-row scales). Scales are None for float16."""
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1)
+    scales[scales == 0] = 1.0
+    q = np.round(vectors / scales[:, None] * 127).astype(np.int8)
+    return q, (scales / 127).astype(np.float32)
+
+
+class _Segment:
+    """One immutable batch of rows. Vectors and texts are memory-mapped; ids and metadata are small."""
+
+    def __init__(self, directory: str, name: str):
+        base = os.path.join(directory, name)
+        self.name = name
+        with open(f"{base}.docs.json") as f:
+            docs = json.load(f)
+        self.ids, self.metadatas = docs["ids"], docs["metadatas"]
+        self.row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.vectors = np.load(f"{base}.vectors.npy", mmap_mode="r")
+        self.scales = np.load(f"{base}.scales.npy", mmap_mode="r") if os.path.exists(f"{base}.scales.npy") else None
+        self.full = np.load(f"{base}.full.npy", mmap_mode="r") if os.path.exists(f"{base}.full.npy") else None
+        self._offsets = np.load(f"{base}.offsets.npy")
+        # Mapped, so readers of an older snapshot keep working after a merge removes the file
+        self._texts = np.load(f"{base}.texts.npy", mmap_mode="r") if self._offsets[-1] else b""
+
+    def __len__(self):
+        return len(self.ids)
+
+    def text(self, row: int) -> str:
+        return bytes(self._texts[self._offsets[row]:self._offsets[row + 1]]).decode("utf-8")
+
+    def full_vectors(self, rows) -> np.ndarray:
+        """Float32 rows for rewrites: the stored copy if kept, otherwise dequantised."""
+        if self.full is not None:
+            return np.asarray(self.full[rows], dtype=np.float32)
+        v = np.asarray(self.vectors[rows], dtype=np.float32)
+        return v * self.scales[rows][:, None] if self.scales is not None else v
+
+    @staticmethod
+    def write(directory: str, ids: list, texts: list, metadatas: list, full: np.ndarray, dtype: str, rerank: bool) -> str:
+        name = f"seg-{uuid.uuid4().hex[:12]}"
+        base = os.path.join(directory, name)
+        vectors, scales = quantize(full, dtype)
+        np.save(f"{base}.vectors.npy", vectors)
+        if scales is not None:
+            np.save(f"{base}.scales.npy", scales)
+        if rerank:
+            np.save(f"{base}.full.npy", full.astype(np.float32))
+        encoded = [t.encode("utf-8") for t in texts]
+        np.save(f"{base}.offsets.npy", np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64))
+        np.save(f"{base}.texts.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        # Written last: a segment without docs.json is an interrupted write and is never listed
+        with open(f"{base}.docs.json", "w") as f:
+            json.dump({"ids": ids, "metadatas": metadatas}, f)
+        return name
+
+
+class QuantizedVectorIndex(VectorStore):
+    def __init__(self, path: str, embedding_function, dtype: str = "int8", rerank: bool = True, rerank_factor: int = 4):
+        if dtype not in ("int8", "float16"):
+            raise ValueError("dtype must be 'int8' or 'float16'")
+        self.path = path
+        self._embedding = embedding_function
+        self.dtype = dtype
+        self.rerank = rerank
+        self.rerank_factor = max(1, rerank_factor)
+        self._write_lock = threading.Lock()
+        # Replaced as a whole on every write so readers always see a consistent snapshot
+        self._state = self._snapshot([], {})
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            self._load()
+        elif os.path.exists(os.path.join(path, "docs.json")):
+            self._migrate()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, MANIFEST)) or os.path.exists(os.path.join(path, "docs.json"))
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # --- Persistence ---
+    @staticmethod
+    def _snapshot(segments: list, deleted: dict) -> dict:
+        """Segments, their tombstones (segment name -> rows) and a live-row mask per segment."""
+        live = {}
+        for seg in segments:
+            mask = np.ones(len(seg), dtype=bool)
+            if deleted.get(seg.name):
+                mask[list(deleted[seg.name])] = False
+            live[seg.name] = mask
+        return {"segments": segments, "deleted": deleted, "live": live, "size": int(sum(m.sum() for m in live.values()))}
+
+    @staticmethod
+    def _tombstone(state, deleted: dict, doc_ids) -> bool:
+        """Marks the live rows with these ids deleted (copy-on-write per segment)."""
+        changed = False
+        for seg in state["segments"]:
+            rows = {seg.row_of[d] for d in doc_ids if d in seg.row_of}
+            rows = {r for r in rows if state["live"][seg.name][r]}
+            if rows:
+                deleted[seg.name] = set(deleted.get(seg.name, ())) | rows
+                changed = True
+        return changed
+
+    def _load(self):
+        with open(os.path.join(self.path, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.dtype = manifest.get("dtype", self.dtype)
+        segments = [_Segment(self.path, entry["name"]) for entry in manifest["segments"]]
+        self._state = self._snapshot(segments, {e["name"]: set(e["deleted"]) for e in manifest["segments"]})
+
+    def _migrate(self):
+        """Indexes written before segments (one vectors.npy + docs.json) become a single segment."""
+        with open(os.path.join(self.path, "docs.json")) as f:
+            docs = json.load(f)
+        legacy = {}
+        for name in ("vectors", "scales", "full"):
+            file = os.path.join(self.path, f"{name}.npy")
+            legacy[name] = np.load(file) if os.path.exists(file) else None
+        segments = []
+        if docs["ids"]:
+            self.dtype = str(legacy["vectors"].dtype)
+            if legacy["full"] is not None:
+                full = legacy["full"].astype(np.float32)
+            else:
+                full = legacy["vectors"].astype(np.float32)
+                if legacy["scales"] is not None:
+                    full *= legacy["scales"][:, None]
+            name = _Segment.write(self.path, docs["ids"], docs["texts"], docs["metadatas"], full, self.dtype, self.rerank)
+            segments = [_Segment(self.path, name)]
+        self._commit(segments, {})
+        for name in ("vectors.npy", "scales.npy", "full.npy", "docs.json"):
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    def _commit(self, segments: list, deleted: dict):
+        """Publishes a new manifest atomically, then drops segment files it no longer lists."""
+        os.makedirs(self.path, exist_ok=True)
+        manifest = {"dtype": self.dtype, "segments": [
+            {"name": seg.name, "deleted": sorted(deleted.get(seg.name, ()))} for seg in segments
+        ]}
+        tmp = os.path.join(self.path, f"{MANIFEST}.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+        self._state = self._snapshot(segments, deleted)
+
+        keep = {seg.name for seg in segments}
+        for file in os.listdir(self.path):
+            if file.startswith("seg-") and file.split(".", 1)[0] not in keep:
+                try:
+                    os.remove(os.path.join(self.path, file))
+                except OSError:
+                    pass
+
+    def _merge(self, segments: list, deleted: dict):
+        """Rewrites the live rows of segments into one (None if none are left)."""
+        ids, texts, metadatas, vectors = [], [], [], []
+        for seg in segments:
+            rows = [r for r in range(len(seg)) if r not in deleted.get(seg.name, ())]
+            if not rows:
+                continue
+            ids += [seg.ids[r] for r in rows]
+            texts += [seg.text(r) for r in rows]
+            metadatas += [seg.metadatas[r] for r in rows]
+            vectors.append(seg.full_vectors(rows))
+        if not ids:
+            return None
+        return _Segment(self.path, _Segment.write(self.path, ids, texts, metadatas, np.vstack(vectors), self.dtype, self.rerank))
+
+    def _compact(self, segments: list, deleted: dict) -> tuple:
+        def live(seg):
+            return len(seg) - len(deleted.get(seg.name, ()))
+
+        segments, deleted = list(segments), dict(deleted)
+        # Size-tiered: merge the newest segment into the one before while that one is not much bigger
+        while len(segments) >= 2 and live(segments[-2]) <= 2 * live(segments[-1]):
+            merged = self._merge(segments[-2:], deleted)
+            for seg in segments[-2:]:
+                deleted.pop(seg.name, None)
+            segments[-2:] = [merged] if merged is not None else []
+        # Mostly tombstones (documents replaced or removed): rewrite everything once
+        dead = sum(len(deleted.get(seg.name, ())) for seg in segments)
+        if dead and dead >= sum(live(seg) for seg in segments):
+            merged = self._merge(segments, deleted)
+            segments, deleted = ([merged] if merged is not None else []), {}
+        return segments, deleted
+
+    # --- Writes ---
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs) -> list:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        new = np.asarray(self._embedding.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(new, axis=1, keepdims=True)
+        new = new / np.where(norms == 0, 1, norms)
+
+        with self._write_lock:
+            state = self._state
+            os.makedirs(self.path, exist_ok=True)
+            segment = _Segment(self.path, _Segment.write(
+                self.path, list(ids), texts, [dict(m) for m in metadatas], new, self.dtype, self.rerank))
+            # Same id = upsert: tombstone the old row
+            deleted = dict(state["deleted"])
+            self._tombstone(state, deleted, ids)
+            self._commit(*self._compact(state["segments"] + [segment], deleted))
+        return list(ids)
+
+    def delete(self, ids: list = None, where: dict = None, **kwargs):
+        with self._write_lock:
+            state = self._state
+            drop = set(ids or [])
+            if where:
+                drop |= {seg.ids[row] for seg, row in self._rows(state) if _matches(seg.metadatas[row], where)}
+            deleted = dict(state["deleted"])
+            if self._tombstone(state, deleted, drop):
+                self._commit(*self._compact(state["segments"], deleted))
+
+    def reset_collection(self):
+        with self._write_lock:
+            self._commit([], {})
+
+    def _rows(self, state):
+        """(segment, row) of every live row, in insertion order."""
+        for seg in state["segments"]:
+            for row in np.flatnonzero(state["live"][seg.name]):
+                yield seg, int(row)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None, **kwargs) -> dict:
+        state = self._state
+        wanted = set([ids] if isinstance(ids, str) else ids or [])
+        rows = [(seg, row) for seg, row in self._rows(state)
+                if (not wanted or seg.ids[row] in wanted) and _matches(seg.metadatas[row], where)]
+        rows = rows[offset or 0:][:limit] if limit else rows[offset or 0:]
+        include = ["documents", "metadatas"] if include is None else include
+        result = {"ids": [seg.ids[row] for seg, row in rows]}
+        if "documents" in include:
+            result["documents"] = [seg.text(row) for seg, row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [seg.metadatas[row] for seg, row in rows]
+        return result
+
+    # --- Search ---
+    def _scores(self, seg: _Segment, query: np.ndarray) -> np.ndarray:
+        vectors, scales = seg.vectors, seg.scales
+        scores = np.empty(len(vectors), dtype=np.float32)
+        q = query.astype(np.float32)
+        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ q
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter: dict = None) -> list:
+        state = self._state
+        segments = state["segments"]
+        if not state["size"]:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+
+        # One score array over all segments; tombstoned and filtered-out rows never win
+        scores = np.concatenate([self._scores(seg, query) for seg in segments])
+        mask = np.concatenate([state["live"][seg.name] for seg in segments])
+        if filter:
+            mask &= np.array([_matches(m, filter) for seg in segments for m in seg.metadatas])
+        scores[~mask] = -np.inf
+        starts = np.cumsum([0] + [len(seg) for seg in segments])
+
+        def locate(i):
+            s = int(np.searchsorted(starts, i, side="right")) - 1
+            return segments[s], int(i - starts[s])
+
+        rerank = all(seg.full is not None for seg in segments)
+        n_candidates = min(int(mask.sum()), k * self.rerank_factor if rerank else k)
+        if n_candidates <= 0:
+            return []
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        candidates = candidates[np.isfinite(scores[candidates])]
+        if rerank:
+            # Exact float32 scores for the shortlist only
+            scores = {int(i): float(np.asarray(seg.full[row], dtype=np.float32) @ query)
+                      for i, (seg, row) in ((i, locate(i)) for i in candidates)}
+        else:
+            scores = {int(i): float(scores[i]) for i in candidates}
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        hits = []
+        for i in best:
+            seg, row = locate(i)
+            hits.append((Document(page_content=seg.text(row), metadata=seg.metadatas[row], id=seg.ids[row]), scores[i]))
+        return hits
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, kwargs.get("filter"))]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, kwargs.get("filter"))
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities in [-1, 1]
+        return lambda score: (score + 1) / 2
+
+    def __len__(self):
+        return self._state["size"]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, path: str = None, **kwargs):
+        index = cls(path, embedding, **kwargs)
+        index.add_texts(texts, metadatas, ids=ids)
+        return index
@@ -1,22 +1,120 @@
 import numpy as np
 import pandas as pd
-import json
+import gzip
+import orjson
+from decimal import Decimal
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from starlette.responses import StreamingResponse
+from app.config import settings
+from app.services.telemetry import REGISTRY, timed
 
-class NpEncoder(json.JSONEncoder):
+try:
+    import brotli
+except ImportError:  # optional: without it, responses are gzip-compressed only
+    brotli = None
+
+RESPONSE_BYTES = REGISTRY.counter("http_response_body_bytes_total", "JSON response bytes before and after compression", ["encoding", "stage"])
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _orjson_default(obj):
     """
-    Custom encoder to handle Numpy data types which are not JSON serializable by default.
-    Essential for returning Pandas results to React.
+    Everything orjson does not encode natively. NumPy arrays of numeric, bool and
+    datetime64 dtypes, NumPy scalars, datetimes (pd.Timestamp included) and NaN
+    (as null) are handled by orjson itself.
     """
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        if isinstance(obj, pd.Timestamp):
-            return obj.isoformat()
-        return super(NpEncoder, self).default(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()  # object/string arrays
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return obj.to_numpy()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "to_plotly_json"):
+        return obj.to_plotly_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """One-pass JSON encoding of API payloads, NumPy/pandas/Decimal/Plotly included."""
+    return orjson.dumps(content, default=_orjson_default, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    orjson-based JSON response; JSON encoding shows up as the "serialize" stage in traces.
+    Returning it directly from a route (instead of a dict) also skips FastAPI's
+    jsonable_encoder pass, so NumPy arrays go straight to the encoder.
+    """
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return dumps(content)
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    with timed("compress"):
+        if encoding == "br":
+            return brotli.compress(body, quality=settings.RESPONSE_BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=settings.RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def _pick_encoding(accept_encoding: str):
+    accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class CompressedJSONRoute(APIRoute):
+    """
+    Route class for the data-heavy routers: JSON bodies of at least
+    RESPONSE_COMPRESS_MIN_BYTES are brotli- or gzip-compressed per Accept-Encoding.
+    Streaming responses (SSE, PDFs) pass through untouched.
+    """
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def compressed_handler(request):
+            response = await handler(request)
+            if isinstance(response, StreamingResponse) or "content-encoding" in response.headers:
+                return response
+            if not response.media_type or "json" not in response.media_type:
+                return response
+            body = response.body
+            if len(body) < settings.RESPONSE_COMPRESS_MIN_BYTES:
+                return response
+            response.headers["vary"] = "Accept-Encoding"
+            encoding = _pick_encoding(request.headers.get("accept-encoding", ""))
+            if encoding is None:
+                return response
+            # Large payloads are compressed off the event loop
+            if len(body) > 256 * 1024:
+                compressed = await run_in_threadpool(_compress, body, encoding)
+            else:
+                compressed = _compress(body, encoding)
+            RESPONSE_BYTES.inc(len(body), encoding=encoding, stage="raw")
+            RESPONSE_BYTES.inc(len(compressed), encoding=encoding, stage="wire")
+            response.body = compressed
+            response.headers["content-encoding"] = encoding
+            response.headers["content-length"] = str(len(compressed))
+            # The representation differs per encoding, so a strong validator would be wrong
+            etag = response.headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                response.headers["etag"] = "W/" + etag
+            return response
+
+        return compressed_handler
+
 
 def clean_filename(filename: str) -> str:
     return "".join(x for x in filename if x.isalnum() or x in "._-")
\ No newline at end of file
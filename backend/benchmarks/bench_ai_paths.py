@@ -0,0 +1,293 @@
+"""
+End-to-end benchmark for the AI paths (CSV chat, SQL agent, RAG) using the offline fake LLM.
+
+Spins up the API with LLM_PROVIDER=fake inside a scratch directory, seeds a CSV dataset,
+a local SQLite database and a PDF document, then fires concurrent requests at
+/api/chat/query, /api/analytics/sql/query and /api/analytics/rag/query and reports
+time-to-first-token, total latency and throughput.
+
+Usage (from backend/):
+    python benchmarks/bench_ai_paths.py --requests 40 --concurrency 8
+    python benchmarks/bench_ai_paths.py --json results.json
+    python benchmarks/bench_ai_paths.py --sse
+    python benchmarks/bench_ai_paths.py --baseline results.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The SQL trace runs a real query against the fixture instead of only listing tables
+BENCH_TRACES = [
+    {
+        "name": "sql",
+        "match": r"sql_db_query(?![\s\S]*wants a visualization)",
+        "turns": [
+            " I should count the orders per region.\nAction: sql_db_query\nAction Input: SELECT region, COUNT(*), SUM(amount) FROM orders GROUP BY region",
+            "I now know the final answer.\nFinal Answer: Orders are spread across four regions; the totals are listed above."
+        ]
+    }
+]
+
+ENDPOINTS = {
+    "chat": "/api/chat/query",
+    "sql": "/api/analytics/sql/query",
+    "rag": "/api/analytics/rag/query",
+}
+
+QUERIES = {
+    "chat": "How many rows does the dataset have?",
+    "sql": "How many orders are there per region?",
+    "rag": "What does the contract say about termination?",
+}
+
+
+def build_fixtures(workdir: str) -> dict:
+    rng = random.Random(42)
+    regions = ["North", "South", "East", "West"]
+
+    csv_path = os.path.join(workdir, "bench_sales.csv")
+    with open(csv_path, "w") as f:
+        f.write("order_id,region,units,amount\n")
+        for i in range(5000):
+            f.write(f"{i},{rng.choice(regions)},{rng.randint(1, 20)},{rng.uniform(5, 500):.2f}\n")
+
+    db_path = os.path.join(workdir, "bench_orders.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, region TEXT, amount REAL)")
+    conn.executemany(
+        "INSERT INTO orders (region, amount) VALUES (?, ?)",
+        [(rng.choice(regions), rng.uniform(5, 500)) for _ in range(20000)]
+    )
+    conn.commit()
+    conn.close()
+
+    from fpdf import FPDF
+    pdf_path = os.path.join(workdir, "bench_contract.pdf")
+    pdf = FPDF()
+    pdf.set_font("Arial", "", 11)
+    for page in range(20):
+        pdf.add_page()
+        for clause in range(12):
+            pdf.multi_cell(0, 6, f"Clause {page}.{clause}: Either party may terminate this agreement with "
+                                 f"thirty days written notice. Payment terms are net {30 + clause} days.")
+    pdf.output(pdf_path)
+
+    return {"csv": csv_path, "sqlite": db_path, "pdf": pdf_path}
+
+
+def start_server(port: int):
+    import uvicorn
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def seed_sessions(client, fixtures: dict, endpoints: list) -> str:
+    with open(fixtures["csv"], "rb") as f:
+        res = await client.post("/api/data/upload", files={"file": ("bench_sales.csv", f, "text/csv")})
+    res.raise_for_status()
+    session_id = res.json()["session_id"]
+
+    res = await client.post("/api/analytics/sql/connect", json={
+        "session_id": session_id, "connection_string": f"sqlite:///{fixtures['sqlite']}"
+    })
+    res.raise_for_status()
+
+    with open(fixtures["pdf"], "rb") as f:
+        res = await client.post(f"/api/analytics/rag/upload?session_id={session_id}",
+                                files={"file": ("bench_contract.pdf", f, "application/pdf")})
+    if res.status_code != 200 and "rag" in endpoints:
+        print(f"Skipping rag: document upload failed ({res.status_code}: {res.text[:200]})")
+        endpoints.remove("rag")
+    return session_id
+
+
+async def timed_request(client, path: str, payload: dict, sse: bool = False) -> dict:
+    """
+    Plain mode: TTFT is the first non-empty body chunk.
+    SSE mode: TTFT is the first `token`/`chart` event; first_event is any event (progress).
+    """
+    start = time.perf_counter()
+    ttft = first_event = None
+    headers = {"Accept": "text/event-stream"} if sse else {}
+    async with client.stream("POST", path, json=payload, headers=headers) as res:
+        async for chunk in res.aiter_bytes():
+            now = time.perf_counter() - start
+            if sse:
+                if first_event is None and b"event:" in chunk:
+                    first_event = now
+                if ttft is None and (b"event: token" in chunk or b"event: chart" in chunk):
+                    ttft = now
+            elif ttft is None and chunk.strip():
+                ttft = now
+        status = res.status_code
+    total = time.perf_counter() - start
+    return {
+        "ttft": ttft if ttft is not None else total,
+        "first_event": first_event if first_event is not None else (ttft or total),
+        "total": total,
+        "ok": status == 200,
+    }
+
+
+async def run_endpoint(client, name: str, session_id: str, n: int, concurrency: int, sse: bool = False) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    payload = {"session_id": session_id, "query": QUERIES[name]}
+
+    async def one():
+        async with sem:
+            return await timed_request(client, ENDPOINTS[name], payload, sse)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one() for _ in range(n)])
+    wall = time.perf_counter() - start
+
+    ttfts = [r["ttft"] for r in results]
+    first_events = [r["first_event"] for r in results]
+    totals = [r["total"] for r in results]
+    return {
+        "endpoint": ENDPOINTS[name],
+        "requests": n,
+        "concurrency": concurrency,
+        "errors": sum(1 for r in results if not r["ok"]),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "first_event_p50": percentile(first_events, 50),
+        "latency_p50": percentile(totals, 50),
+        "latency_p95": percentile(totals, 95),
+        "latency_p99": percentile(totals, 99),
+        "latency_mean": statistics.mean(totals),
+        "throughput_rps": n / wall,
+    }
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+def print_report(results: dict):
+    header = f"{'path':<6}{'n':>5}{'conc':>6}{'err':>5}{'1st evt':>10}{'ttft p50':>10}{'ttft p95':>10}{'lat p50':>10}{'lat p95':>10}{'lat p99':>10}{'req/s':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:<6}{r['requests']:>5}{r['concurrency']:>6}{r['errors']:>5}"
+              f"{r['first_event_p50']:>10.3f}{r['ttft_p50']:>10.3f}{r['ttft_p95']:>10.3f}{r['latency_p50']:>10.3f}"
+              f"{r['latency_p95']:>10.3f}{r['latency_p99']:>10.3f}{r['throughput_rps']:>9.2f}")
+
+
+def compare_to_baseline(results: dict, baseline_path: str, tolerance: float) -> list:
+    """Returns a list of human-readable regressions beyond the given relative tolerance."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ("ttft_p95", "latency_p95"):
+            if r[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {base[metric]:.3f}s -> {r[metric]:.3f}s")
+        if r["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}.throughput_rps: {base['throughput_rps']:.2f} -> {r['throughput_rps']:.2f}")
+    return regressions
+
+
+async def main_async(args, fixtures: dict) -> dict:
+    import httpx
+
+    port = free_port()
+    server = start_server(port)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300) as client:
+            endpoints = args.endpoints.split(",")
+            session_id = await seed_sessions(client, fixtures, endpoints)
+            results = {}
+            for name in endpoints:
+                # One warmup request so agent construction and index loads are not counted
+                await timed_request(client, ENDPOINTS[name], {"session_id": session_id, "query": QUERIES[name]}, args.sse)
+                results[name] = await run_endpoint(client, name, session_id, args.requests, args.concurrency, args.sse)
+            return results
+    finally:
+        server.should_exit = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for chat, SQL and RAG endpoints")
+    parser.add_argument("--requests", type=int, default=20, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--endpoints", default="chat,sql,rag")
+    parser.add_argument("--token-latency-ms", type=float, default=20)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--sse", action="store_true", help="use the Server-Sent Events protocol")
+    parser.add_argument("--rpm", type=float, default=0, help="LLM gateway rate limit (0 = unlimited)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    # The app uses paths relative to the working directory, so run it in a scratch dir.
+    # Settings are read at import time, so the environment must be set before importing app.
+    workdir = tempfile.mkdtemp(prefix="edip_bench_")
+    traces_path = os.path.join(workdir, "traces.json")
+    os.environ.update({
+        "LLM_PROVIDER": "fake",
+        "FAKE_LLM_TRACES": traces_path,
+        "FAKE_LLM_TOKEN_LATENCY_MS": str(args.token_latency_ms),
+        "FAKE_LLM_FIRST_TOKEN_MS": str(args.first_token_ms),
+        "LLM_RATE_LIMIT_RPM": str(args.rpm),
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+
+    from app.services.llm_provider import DEFAULT_TRACES
+    with open(traces_path, "w") as f:
+        json.dump(BENCH_TRACES + DEFAULT_TRACES, f)
+
+    fixtures = build_fixtures(workdir)
+    results = asyncio.run(main_async(args, fixtures))
+    print_report(results)
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    if baseline_path:
+        regressions = compare_to_baseline(results, baseline_path, args.tolerance)
+        if regressions:
+            print("\nPerformance regressions detected:")
+            for r in regressions:
+                print(f"  - {r}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Compares the RAG vector store backends on a synthetic per-session corpus:
+Chroma (HNSW, persistent) vs QuantizedVectorIndex (int8 / float16, memory-mapped).
+
+Vectors are generated directly (clustered, bge-small sized), so the numbers measure the
+stores and not the embedding model. Each backend is opened and queried in a fresh
+child process so load time and RSS are not polluted by the other backend.
+
+Reports on-disk size, open time, RSS growth after open and after the query run,
+p50/p99 query latency and recall@k against exact float32 search.
+
+Usage (from backend/):
+    python benchmarks/bench_vector_index.py --chunks 5000 --queries 500
+    python benchmarks/bench_vector_index.py --backends chroma,int8 --json results.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+BACKENDS = ("chroma", "int8", "float16", "int8-norerank")
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def make_corpus(n: int, dim: int, n_queries: int, seed: int = 7):
+    """Clustered unit vectors (topics) plus queries that are noisy copies of corpus rows."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, n // 100), dim))
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.normal(size=(n, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.integers(0, n, n_queries)] + 0.3 * rng.normal(size=(n_queries, dim))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+class _Precomputed:
+    """Embeddings stand-in that maps a chunk id (the text) to its pre-generated vector."""
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[int(t.split("-")[1])] for t in texts]
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+# --- Build (parent process) ---
+
+def build(backend: str, path: str, vectors: np.ndarray):
+    ids = [f"chunk-{i}" for i in range(len(vectors))]
+    metadatas = [{"doc_id": f"doc{i // 200}", "page": i % 200} for i in range(len(vectors))]
+    start = time.perf_counter()
+    if backend == "chroma":
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+        collection = client.get_or_create_collection("bench", metadata={"hnsw:space": "cosine"})
+        for i in range(0, len(ids), 1000):
+            collection.add(ids=ids[i:i + 1000], embeddings=vectors[i:i + 1000].tolist(),
+                           documents=ids[i:i + 1000], metadatas=metadatas[i:i + 1000])
+    else:
+        from app.services.vector_index import QuantizedVectorIndex
+        index = QuantizedVectorIndex(path, _Precomputed(vectors), dtype=backend.split("-")[0],
+                                     rerank=not backend.endswith("norerank"))
+        index.add_texts(ids, metadatas, ids=ids)
+    return time.perf_counter() - start
+
+
+# --- Open + query (child process) ---
+
+def run_child(backend: str, path: str, queries_path: str, k: int) -> dict:
+    queries = np.load(queries_path)
+    if backend == "chroma":
+        import chromadb
+    else:
+        from app.services.vector_index import QuantizedVectorIndex
+
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    if backend == "chroma":
+        collection = chromadb.PersistentClient(path=path).get_collection("bench")
+        search = lambda q: collection.query(query_embeddings=[q.tolist()], n_results=k)["ids"][0]
+    else:
+        index = QuantizedVectorIndex(path, None, dtype=backend.split("-")[0], rerank=not backend.endswith("norerank"))
+        search = lambda q: [d.id for d in index.similarity_search_by_vector(q, k)]
+    open_seconds = time.perf_counter() - start
+    rss_open = _rss_bytes()
+
+    first = time.perf_counter()
+    results = [search(queries[0])]
+    first_query = time.perf_counter() - first
+    latencies = []
+    for q in queries[1:]:
+        t = time.perf_counter()
+        results.append(search(q))
+        latencies.append(time.perf_counter() - t)
+
+    return {
+        "open_ms": open_seconds * 1000,
+        "first_query_ms": first_query * 1000,
+        "rss_open_mb": (rss_open - rss_before) / 2**20,
+        "rss_queried_mb": (_rss_bytes() - rss_before) / 2**20,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1000,
+        "results": results,
+    }
+
+
+def recall(results, truth) -> float:
+    hits = sum(len(set(r) & set(t)) for r, t in zip(results, truth))
+    return hits / sum(len(t) for t in truth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=384, help="bge-small-en-v1.5 is 384-d")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--child", nargs=3, metavar=("BACKEND", "PATH", "QUERIES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(*args.child, k=args.k)))
+        return
+
+    vectors, queries = make_corpus(args.chunks, args.dim, args.queries)
+    scores = queries @ vectors.T
+    truth = [[f"chunk-{i}" for i in np.argsort(-row)[:args.k]] for row in scores]
+
+    workdir = tempfile.mkdtemp(prefix="bench_vectors_")
+    queries_path = os.path.join(workdir, "queries.npy")
+    np.save(queries_path, queries)
+
+    rows = []
+    try:
+        for backend in args.backends.split(","):
+            path = os.path.join(workdir, backend)
+            build_seconds = build(backend, path, vectors)
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "-k", str(args.k), "--child", backend, path, queries_path],
+                capture_output=True, text=True, check=True,
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            result["recall"] = recall(result.pop("results"), truth)
+            result.update(backend=backend, build_s=build_seconds, disk_mb=_dir_size(path) / 2**20)
+            rows.append(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{args.chunks} chunks x {args.dim}d, {args.queries} queries, k={args.k}\n")
+    header = f"{'backend':<15}{'build s':>9}{'disk MB':>9}{'open ms':>9}{'1st q ms':>10}{'RSS open':>10}{'RSS qry':>9}{'p50 ms':>9}{'p99 ms':>9}{'recall':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['backend']:<15}{r['build_s']:>9.2f}{r['disk_mb']:>9.1f}{r['open_ms']:>9.1f}{r['first_query_ms']:>10.2f}"
+              f"{r['rss_open_mb']:>10.1f}{r['rss_queried_mb']:>9.1f}{r['p50_ms']:>9.3f}{r['p99_ms']:>9.3f}{r['recall']:>8.3f}")
+
+    if args.json:
+        with open(os.path.abspath(args.json), "w") as f:
+            json.dump({"chunks": args.chunks, "dim": args.dim, "queries": args.queries, "k": args.k, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
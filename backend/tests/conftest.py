@@ -0,0 +1,41 @@
+"""
+Runs the API against a scratch directory with the offline fake LLM. Settings are read
+at import time, so the environment is set before anything from app is imported.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+WORKDIR = tempfile.mkdtemp(prefix="edip_tests_")
+os.environ.update({
+    "LLM_PROVIDER": "fake",
+    "FAKE_LLM_TOKEN_LATENCY_MS": "0",
+    "FAKE_LLM_FIRST_TOKEN_MS": "0",
+    "STATE_DIR": os.path.join(WORKDIR, "state"),
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORKDIR, 'app.db')}",
+    "STARTUP_WARMUP": "false",
+    "JANITOR_ENABLED": "false",
+    "SANDBOX_ENABLED": "false",
+})
+os.chdir(WORKDIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def upload_csv(client):
+    """Uploads a CSV and returns its session id."""
+    def upload(text: str, name: str = "data.csv") -> str:
+        res = client.post("/api/data/upload", files={"file": (name, text.encode(), "text/csv")})
+        assert res.status_code == 200, res.text
+        return res.json()["session_id"]
+    return upload
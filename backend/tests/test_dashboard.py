@@ -0,0 +1,77 @@
+import sqlite3
+
+import pytest
+
+from app.services.ai_engine import ai_engine
+from app.services.dashboard_service import dashboard_service, validate_spec
+
+
+def _pin_static(client, session_id: str) -> int:
+    res = client.post("/api/analytics/dashboard/pin", json={
+        "session_id": session_id, "title": "Static", "chart_type": "bar",
+        "chart_config": {"data": [{"type": "bar", "x": ["a"], "y": [1]}], "layout": {}},
+    })
+    assert res.status_code == 200, res.text
+    return res.json()["id"]
+
+
+def test_pin_payload_is_scoped_to_its_session(client):
+    pin_id = _pin_static(client, "owner-session")
+
+    res = client.get(f"/api/analytics/dashboard/owner-session/pin/{pin_id}")
+    assert res.status_code == 200
+    assert res.json()["data"][0]["y"] == [1]
+
+    # Pin ids are sequential: another session must not be able to read them
+    assert client.get(f"/api/analytics/dashboard/other-session/pin/{pin_id}").status_code == 404
+
+
+def _spec(session_id: str) -> dict:
+    return {"source": "csv", "session_id": session_id,
+            "chart": {"chart_type": "Bar Chart", "x_axis": "name", "y_axis": "amount"}}
+
+
+def test_live_pin_reads_its_own_session(client, upload_csv):
+    session_id = upload_csv("name,amount\nalice,10\nbob,20\n")
+    res = client.post("/api/analytics/dashboard/pin", json={
+        "session_id": session_id, "title": "Live", "chart_type": "bar", "spec": _spec(session_id),
+    })
+    assert res.status_code == 200, res.text
+    payload = client.get(f"/api/analytics/dashboard/{session_id}/pin/{res.json()['id']}")
+    assert payload.status_code == 200
+    assert "alice" in payload.text
+
+
+def test_live_pin_cannot_read_another_session(client, upload_csv):
+    victim = upload_csv("name,amount\nalice,10\nbob,20\n")
+    res = client.post("/api/analytics/dashboard/pin", json={
+        "session_id": "attacker-session", "title": "Stolen", "chart_type": "bar", "spec": _spec(victim),
+    })
+    assert res.status_code == 400
+    listing = client.get("/api/analytics/dashboard/attacker-session").json()
+    assert listing["total"] == 0
+
+
+def test_pin_sql_must_be_read_only():
+    chart = {"chart_type": "Bar Chart", "x_axis": "x"}
+    validate_spec({"source": "sql", "session_id": "s", "chart": chart, "sql": "SELECT * FROM t WHERE status = 'deleted'"})
+    for sql in ("WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d", "SELECT 1; DROP TABLE t", "UPDATE t SET x = 1"):
+        with pytest.raises(ValueError):
+            validate_spec({"source": "sql", "session_id": "s", "chart": chart, "sql": sql})
+
+
+def test_pin_sql_runs_in_a_read_only_transaction(tmp_path):
+    path = tmp_path / "live.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1)")
+    ai_engine.sql_engines.connect("sql-session", f"sqlite:///{path}")
+
+    # Past validate_spec, the database itself refuses writes
+    with pytest.raises(Exception):
+        dashboard_service._sql_frame("sql-session", "DELETE FROM t")
+    df, _ = dashboard_service._sql_frame("sql-session", "SELECT count(*) AS n FROM t")
+    assert df["n"][0] == 1
+    # The pooled connection is writable again for the SQL agent
+    with ai_engine.sql_engines["sql-session"]._engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO t VALUES (2)")
@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Any
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.services.llm_gateway import LLMGateway
+
+
+class _SlowModel(BaseChatModel):
+    """Streams `tokens` words, `delay` seconds apart; counts upstream calls."""
+    tokens: int = 10
+    delay: float = 0.02
+    calls: Any = None
+    interrupt: Any = None  # exception the next _generate raises once
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append("generate")
+        time.sleep(self.delay * 5)
+        if self.interrupt is not None:
+            error, self.interrupt = self.interrupt, None
+            raise error
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="answer"))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append("stream")
+        for i in range(self.tokens):
+            time.sleep(self.delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"t{i} "))
+
+
+def _setup(**model_kwargs):
+    gateway = LLMGateway(max_concurrency=4, per_session=4, rate_per_minute=0, burst=1)
+    inner = _SlowModel(calls=[], **model_kwargs)
+    return gateway, inner, gateway.wrap(inner)
+
+
+def _in_thread(fn):
+    out = {}
+    thread = threading.Thread(target=lambda: out.setdefault("value", fn()))
+    thread.start()
+    return thread, out
+
+
+def test_follower_keeps_streaming_when_leader_disconnects():
+    _, inner, model = _setup()
+    prompt = [HumanMessage(content="same question")]
+    leader = model._stream(prompt)
+    next(leader)  # the leader's upstream call is running
+    thread, out = _in_thread(lambda: "".join(c.message.content for c in model._stream(prompt)))
+    time.sleep(0.05)
+    leader.close()  # client went away
+    thread.join(5)
+    assert out["value"] == "".join(f"t{i} " for i in range(10))
+    assert inner.calls == ["stream"]
+
+
+def test_stream_stops_upstream_when_nobody_listens():
+    gateway, inner, model = _setup(tokens=50)
+    stream = model._stream([HumanMessage(content="q")])
+    next(stream)
+    stream.close()
+    time.sleep(0.2)
+    assert gateway.stats()["inflight_prompts"] == 0 and gateway.stats()["active"] == 0
+
+
+def test_follower_retries_when_leader_is_interrupted():
+    _, inner, model = _setup(interrupt=KeyboardInterrupt())
+    prompt = [HumanMessage(content="q")]
+    leader, leader_out = _in_thread(lambda: pytest.raises(KeyboardInterrupt, model._generate, prompt))
+    time.sleep(0.02)
+    follower, out = _in_thread(lambda: model._generate(prompt))
+    leader.join(5)
+    follower.join(5)
+    assert out["value"].generations[0].message.content == "answer"
+    assert inner.calls == ["generate", "generate"]
+
+
+def test_followers_get_their_own_result_copy():
+    _, inner, model = _setup()
+    prompt = [HumanMessage(content="q")]
+    leader, leader_out = _in_thread(lambda: model._generate(prompt))
+    time.sleep(0.02)
+    follower, follower_out = _in_thread(lambda: model._generate(prompt))
+    leader.join(5)
+    follower.join(5)
+    assert inner.calls == ["generate"]
+    mine, theirs = leader_out["value"], follower_out["value"]
+    assert mine is not theirs
+    mine.generations[0].message.content = "changed by a callback"
+    assert theirs.generations[0].message.content == "answer"
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.analysis import analysis_service
+from app.services.chart_raster import rasterize_chart
+from app.utils import dumps
+
+PNG = b"\x89PNG"
+
+
+@pytest.fixture(scope="module")
+def df():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "cat": rng.choice(list("ABCD"), 300), "grp": rng.choice(["x", "y"], 300),
+        "v": rng.normal(size=300), "w": rng.uniform(1, 5, 300),
+        "d": pd.date_range("2022-01-01", periods=300, freq="D").astype(str),
+    })
+
+
+@pytest.mark.parametrize("chart", [
+    ("Bar Chart", "cat", "v", "grp", None),
+    ("Line Chart", "d", "v", None, None),
+    ("Scatter Plot", "v", "w", "grp", "w"),
+    ("Box Plot", "cat", "v", "grp", None),
+    ("Histogram", "v", None, "grp", None),
+    ("Correlation Heatmap", "v", None, None, None),
+])
+def test_app_charts_rasterize_without_a_browser(df, chart):
+    fig = analysis_service.generate_chart_json(df, *chart)
+    assert rasterize_chart(dumps(fig).decode(), 900, 500).startswith(PNG)
+
+
+def test_timeseries_band_rasterizes():
+    x = pd.date_range("2022-01-01", periods=50, freq="D").to_numpy()
+    values = np.arange(50, dtype=float)
+    fig = analysis_service.timeseries_chart({
+        "x": x, "mean": values, "min": values - 1, "max": values + 1, "count": values, "sum": values,
+        "date": "d", "value": "v", "resolution": "day", "width": 1200,
+    })
+    assert rasterize_chart(dumps(fig).decode(), 900, 500).startswith(PNG)
+
+
+def test_report_embeds_pinned_chart(client, upload_csv):
+    session_id = upload_csv("name,amount\nalice,10\nbob,20\ncarol,5\n")
+    res = client.post("/api/analytics/dashboard/pin", json={
+        "session_id": session_id, "title": "Amounts", "chart_type": "bar",
+        "spec": {"source": "csv", "chart": {"chart_type": "Bar Chart", "x_axis": "name", "y_axis": "amount"}},
+    })
+    assert res.status_code == 200, res.text
+    pdf = client.get(f"/api/analytics/report/CSV/{session_id}")
+    assert pdf.status_code == 200
+    assert b"/Subtype /Image" in pdf.content
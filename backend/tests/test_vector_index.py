@@ -0,0 +1,48 @@
+import numpy as np
+
+from app.services.vector_index import QuantizedVectorIndex
+
+
+class _Embeddings:
+    """Deterministic vectors per text, so a text's own query is its nearest neighbour."""
+    def _vector(self, text):
+        return np.random.default_rng(abs(hash(text)) % 2**32).standard_normal(32).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+def _ingest(index, n, batch=50):
+    for start in range(0, n, batch):
+        rows = range(start, min(start + batch, n))
+        index.add_texts([f"chunk {i}" for i in rows], [{"doc_id": f"d{i % 3}"} for i in rows],
+                        ids=[f"id{i}" for i in rows])
+
+
+def test_batches_are_appended_as_segments_and_merged(tmp_path):
+    index = QuantizedVectorIndex(str(tmp_path), _Embeddings())
+    _ingest(index, 1000)
+    assert len(index) == 1000
+    # Size-tiered merging keeps the segment count logarithmic
+    assert len(index._state["segments"]) <= 6
+    assert index.similarity_search("chunk 123", k=1)[0].id == "id123"
+
+
+def test_upsert_delete_and_reopen(tmp_path):
+    index = QuantizedVectorIndex(str(tmp_path), _Embeddings())
+    _ingest(index, 300)
+    index.add_texts(["replaced"], [{"doc_id": "d0"}], ids=["id3"])
+    index.delete(where={"doc_id": "d1"})
+    index.delete(ids=["id0"])
+
+    reopened = QuantizedVectorIndex(str(tmp_path), _Embeddings())
+    assert len(reopened) == len(index) == 300 - 100 - 1
+    assert reopened.get(ids="id3")["documents"] == ["replaced"]
+    assert reopened.get(where={"doc_id": "d1"})["ids"] == []
+    assert all(d.metadata["doc_id"] != "d1" for d in reopened.similarity_search("chunk 4", k=20))
+
+    reopened.reset_collection()
+    assert len(reopened) == 0 and reopened.similarity_search("chunk 4") == []
@@ -30,20 +30,68 @@ const KpiCard = ({ title, value, icon: Icon }) => (
 );
 
 // 1. DASHBOARD VIEW
+// Chart payloads are fetched per pin, once, when the card scrolls into view
+const pinPayloads = new Map();
+
+const PinChart = ({ pin, sessionId }) => {
+    const ref = useRef(null);
+    const [config, setConfig] = useState(pin.chart_config || pinPayloads.get(pin.etag) || null);
+
+    useEffect(() => {
+        if (config || !ref.current) return;
+        const observer = new IntersectionObserver(entries => {
+            if (!entries[0].isIntersecting) return;
+            observer.disconnect();
+            api.get(`/analytics/dashboard/${sessionId}/pin/${pin.id}`)
+               .then(res => { pinPayloads.set(pin.etag, res.data); setConfig(res.data); })
+               .catch(() => setConfig({ error: true }));
+        }, { rootMargin: '200px' });
+        observer.observe(ref.current);
+        return () => observer.disconnect();
+    }, [pin.id, pin.etag, sessionId, config]);
+
+    if (!config) return <div ref={ref} style={{height: '100%', display: 'flex', alignItems: 'center', justifyContent: 'center', color: '#94a3b8'}}><Loader2 className="spin" size={20}/></div>;
+    if (config.error) return <div style={{color: '#94a3b8'}}>Chart could not be loaded.</div>;
+    return (
+        <Plot 
+            data={config.data} 
+            layout={{...config.layout, autosize: true, margin: {l:40, r:20, t:20, b:40}}} 
+            useResizeHandler={true} 
+            style={{width: "100%", height: "100%"}} 
+            config={{displayModeBar: false, responsive: true}} 
+        />
+    );
+};
+
 const DashboardView = ({ session }) => {
     const [pins, setPins] = useState([]);
+    const [total, setTotal] = useState(0);
     
+    const loadPins = (offset = 0) => {
+        api.get(`/analytics/dashboard/${session.id}`, { params: { offset } })
+           .then(res => {
+               setPins(prev => offset === 0 ? res.data.items : [...prev, ...res.data.items]);
+               setTotal(res.data.total);
+           })
+           .catch(err => console.log("No pins yet"));
+    };
+
     useEffect(() => {
-        if(session.id) {
-            api.get(`/analytics/dashboard/${session.id}`)
-               .then(res => setPins(res.data))
-               .catch(err => console.log("No pins yet"));
-        }
+        if(session.id) loadPins(0);
     }, [session.id]);
 
+    const [refreshing, setRefreshing] = useState(false);
+    const refreshPins = async () => {
+        setRefreshing(true);
+        try { await api.post(`/analytics/dashboard/${session.id}/refresh`); loadPins(0); }
+        catch (e) { alert("Refresh failed"); }
+        finally { setRefreshing(false); }
+    };
+
     const deletePin = async (id) => {
         await api.delete(`/analytics/dashboard/${id}`);
         setPins(pins.filter(p => p.id !== id));
+        setTotal(total - 1);
     };
 
     return (
@@ -51,6 +99,11 @@ const DashboardView = ({ session }) => {
             <header className="dashboard-header">
                 <h2>Executive Dashboard</h2>
                 <p>Overview of your saved insights and key metrics.</p>
+                {pins.some(p => p.live) && (
+                    <button onClick={refreshPins} disabled={refreshing} className="btn-primary" style={{marginTop: '0.75rem'}}>
+                        <RefreshCw size={16} className={refreshing ? "spin" : ""}/> Refresh live charts
+                    </button>
+                )}
             </header>
 
             {session.meta && (
@@ -78,6 +131,7 @@ const DashboardView = ({ session }) => {
                                 <strong style={{display: 'flex', alignItems: 'center', gap: '0.5rem'}}>
                                     {pin.chart_type === 'text' ? <Quote size={16} color="#3b82f6"/> : <BarChart3 size={16} color="#a855f7"/>}
                                     {pin.title}
+                                    {pin.live && <RefreshCw size={12} color="#16a34a" title="Live chart"/>}
                                 </strong>
                                 <button onClick={() => deletePin(pin.id)} style={{border: 'none', background: 'none', cursor: 'pointer', color: '#94a3b8'}}><Trash2 size={16}/></button>
                             </div>
@@ -88,19 +142,18 @@ const DashboardView = ({ session }) => {
                                         {pin.chart_config.text}
                                     </div>
                                 ) : (
-                                    <Plot 
-                                        data={pin.chart_config.data} 
-                                        layout={{...pin.chart_config.layout, autosize: true, margin: {l:40, r:20, t:20, b:40}}} 
-                                        useResizeHandler={true} 
-                                        style={{width: "100%", height: "100%"}} 
-                                        config={{displayModeBar: false, responsive: true}} 
-                                    />
+                                    <PinChart key={pin.etag} pin={pin} sessionId={session.id} />
                                 )}
                             </div>
                         </div>
                     ))
                 )}
             </div>
+            {pins.length < total && (
+                <div style={{display: 'flex', justifyContent: 'center', marginTop: '1.5rem'}}>
+                    <button onClick={() => loadPins(pins.length)} className="btn-primary">Load more ({total - pins.length})</button>
+                </div>
+            )}
         </div>
     );
 };
@@ -149,7 +202,7 @@ const CsvUploadView = ({ session, onUpload }) => {
                 {loading ? <Loader2 className="spin" size={32} color="#2563eb" /> : <FileText size={32} color="#94a3b8" />}
                 <span style={{fontWeight: 600, color: '#2563eb', marginTop: '1rem'}}>Click to browse</span>
                 <span style={{fontSize: '0.8rem', color: '#94a3b8'}}>CSV, XLSX (Max 200MB)</span>
-                <input type="file" className="hidden" onChange={handleFile} accept=".csv,.xlsx" />
+                <input type="file" className="hidden" onChange={handleFile} accept=".csv,.xlsx,.json,.parquet" />
             </label>
         </div>
     );
@@ -360,7 +413,7 @@ const UnifiedChatView = ({ session, chatHistories, onUpdateHistory, onCacheSugge
                 const { done, value } = await reader.read();
                 if (done) break;
                 const chunk = decoder.decode(value);
-                if (mode === 'csv') { 
+                if (mode === 'csv' || mode === 'pdf') { 
                     aiText += chunk; 
                     onUpdateHistory(mode, { role: 'assistant', content: aiText }, true); 
                 } else { 
@@ -368,7 +421,7 @@ const UnifiedChatView = ({ session, chatHistories, onUpdateHistory, onCacheSugge
                 }
             }
             
-            if (mode !== 'csv') {
+            if (mode === 'sql') {
                 try { 
                     const jsonRes = JSON.parse(aiText); 
                     onUpdateHistory(mode, jsonRes, true); 
@@ -614,9 +667,27 @@ const VisualizationView = ({ session }) => {
         } catch { alert("Error generating chart"); } finally { setLoading(false); }
     };
 
+    // Time-series line charts come from server-side rollups: on zoom, fetch the visible range at a finer resolution
+    const onRelayout = async (e) => {
+        const ts = plotData?.layout?.meta?.timeseries;
+        if (!ts || !session.meta) return;
+        const zoomed = e['xaxis.range[0]'] !== undefined;
+        if (!zoomed && !e['xaxis.autorange']) return;
+        try {
+            const params = { date: ts.date, value: ts.value, agg: ts.agg, width: ts.width, figure: true };
+            if (zoomed) { params.start = e['xaxis.range[0]']; params.end = e['xaxis.range[1]']; }
+            const res = await api.get(`/analytics/timeseries/${session.id}`, { params }); setPlotData(res.data);
+        } catch (err) { console.error("Error loading time series range"); }
+    };
+
     const pinChart = async () => {
         if(!plotData) return;
-        await api.post('/analytics/dashboard/pin', { session_id: session.id, title: `${config.chart_type}: ${config.y_axis} vs ${config.x_axis}`, chart_type: config.chart_type, chart_config: plotData }); alert("Pinned!");
+        const title = `${config.chart_type}: ${config.y_axis} vs ${config.x_axis}`;
+        // CSV charts are pinned live (as a spec) so the dashboard can refresh them
+        const pin = session.meta
+            ? { spec: { source: 'csv', session_id: session.id, chart: { chart_type: config.chart_type, x_axis: config.x_axis, y_axis: config.y_axis, color_by: config.color_by === "None" ? null : config.color_by } } }
+            : { chart_config: plotData };
+        await api.post('/analytics/dashboard/pin', { session_id: session.id, title, chart_type: config.chart_type, ...pin }); alert("Pinned!");
     };
 
     return (
@@ -641,7 +712,7 @@ const VisualizationView = ({ session }) => {
                 <button onClick={generatePlot} disabled={loading} className="btn-primary" style={{width: '100%', justifyContent: 'center'}}>{loading ? "Loading..." : "Generate"}</button>
             </div>
             <div className="chart-card" style={{height: '500px', position: 'relative'}}>
-                {plotData ? (<><button onClick={pinChart} style={{position: 'absolute', top: 10, right: 10, zIndex: 10, background: 'white', border: '1px solid #e2e8f0', padding: '0.5rem', borderRadius: '0.5rem', cursor: 'pointer'}}><Pin size={16}/></button><div className="chart-wrapper"><Plot data={plotData.data} layout={{...plotData.layout, autosize: true, margin: {l:40, r:20, t:20, b:40}}} useResizeHandler={true} style={{width: "100%", height: "100%"}} config={{displayModeBar: false, responsive: true}} /></div></>) : <div style={{height: '100%', display: 'flex', alignItems: 'center', justifyContent: 'center', color: '#94a3b8'}}>Generate a chart to view</div>}
+                {plotData ? (<><button onClick={pinChart} style={{position: 'absolute', top: 10, right: 10, zIndex: 10, background: 'white', border: '1px solid #e2e8f0', padding: '0.5rem', borderRadius: '0.5rem', cursor: 'pointer'}}><Pin size={16}/></button><div className="chart-wrapper"><Plot data={plotData.data} layout={{...plotData.layout, autosize: true, margin: {l:40, r:20, t:20, b:40}}} useResizeHandler={true} onRelayout={onRelayout} style={{width: "100%", height: "100%"}} config={{displayModeBar: false, responsive: true}} /></div></>) : <div style={{height: '100%', display: 'flex', alignItems: 'center', justifyContent: 'center', color: '#94a3b8'}}>Generate a chart to view</div>}
             </div>
         </div>
     );